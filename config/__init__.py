@@ -1,4 +1,29 @@
-from .llm import configure_llm
-
-__all__ = ["configure_llm"]
+from .cassette import Cassette, CassetteLM, CassetteMissError, LatencyModel
+from .concurrency import AdaptiveConcurrency, AdaptiveConcurrencyLM, resolve_num_threads
+from .llm import configure_hedged_llm, configure_llm
+from .rate_limit import RateLimitedLM, SharedRateLimiter
+from .registry import LMRegistry, ModelLimits, get_lm, get_registry
+from .routing import HedgedLM
+from .single_flight import SingleFlightLM
+from .stub_server import StubServer
 
+__all__ = [
+    "configure_llm",
+    "configure_hedged_llm",
+    "get_lm",
+    "get_registry",
+    "LMRegistry",
+    "ModelLimits",
+    "RateLimitedLM",
+    "SharedRateLimiter",
+    "SingleFlightLM",
+    "AdaptiveConcurrency",
+    "AdaptiveConcurrencyLM",
+    "resolve_num_threads",
+    "Cassette",
+    "CassetteLM",
+    "CassetteMissError",
+    "LatencyModel",
+    "HedgedLM",
+    "StubServer",
+]
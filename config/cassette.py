@@ -0,0 +1,301 @@
+"""
+Запись и воспроизведение ответов LLM (кассеты) для офлайн-бенчмарков.
+
+`CassetteLM` оборачивает LM: в режиме "record" отправляет запросы в настоящую
+модель и дописывает пары запрос/ответ в кассету, в режиме "replay" отвечает из
+кассеты без сети (промах — `CassetteMissError`), в режиме "auto" воспроизводит
+записанное и записывает недостающее.
+
+Кассета — JSONL (сжатый gzip, если путь оканчивается на ".gz"), строка на ответ:
+    {"k": ключ запроса, "r": {"choices": [...], "usage": {...}, "model": ...}, "t": задержка, с}
+Ключ — sha256 сообщений (или prompt) запроса; модель и параметры генерации в ключ
+не входят, поэтому одна кассета соответствует одной конфигурации моделей. Ответы
+на одинаковые запросы воспроизводятся по кругу в порядке записи.
+
+Задержка воспроизведения задаётся `LatencyModel` ("none", "fixed:0.5",
+"uniform:0.2,1.0", "lognormal:0.8,0.5", "recorded", "recorded:2.0") и
+детерминирована: зависит только от ключа, номера повтора и `seed`.
+
+Все LM из реестра (`config.registry`) заворачиваются в кассету, если задана
+переменная окружения `LLM_CASSETTE` (режим — `LLM_CASSETTE_MODE`, задержка —
+`LLM_CASSETTE_LATENCY`), так что демо и скрипты оптимизации работают с кассетой
+без изменений кода. См. также `config.stub_server`.
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+
+import dspy
+
+CASSETTE_MODES = ("record", "replay", "auto")
+
+
+class CassetteMissError(KeyError):
+    """В кассете нет ответа на запрос (режим "replay")."""
+
+
+def request_key(messages: list[dict[str, Any]] | None = None, prompt: str | None = None) -> str:
+    """Ключ запроса: sha256 канонического JSON сообщений (role + content) или prompt."""
+    if messages:
+        payload: Any = [{"role": m.get("role"), "content": m.get("content")} for m in messages]
+    else:
+        payload = prompt or ""
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _get(obj: Any, key: str, default: Any = None) -> Any:
+    if isinstance(obj, dict):
+        return obj.get(key, default)
+    return getattr(obj, key, default)
+
+
+def compact_response(response: Any) -> dict[str, Any]:
+    """Ответ провайдера (ModelResponse или dict) -> компактная запись кассеты."""
+    choices = []
+    for choice in _get(response, "choices", None) or []:
+        message = _get(choice, "message")
+        entry: dict[str, Any] = {"content": _get(message, "content")}
+        reasoning = _get(message, "reasoning_content")
+        if reasoning:
+            entry["reasoning_content"] = reasoning
+        tool_calls = _get(message, "tool_calls")
+        if tool_calls:
+            entry["tool_calls"] = json.loads(json.dumps(tool_calls, default=lambda o: getattr(o, "__dict__", str(o))))
+        entry["finish_reason"] = _get(choice, "finish_reason") or "stop"
+        choices.append(entry)
+    usage = _get(response, "usage", None) or {}
+    return {
+        "choices": choices,
+        "usage": {
+            name: int(_get(usage, name, 0) or 0) for name in ("prompt_tokens", "completion_tokens", "total_tokens")
+        },
+        "model": _get(response, "model", None),
+    }
+
+
+class CassetteResponse:
+    """Ответ из кассеты в форме, которую разбирает `dspy.BaseLM` (как ответ OpenAI chat completion)."""
+
+    def __init__(self, record: dict[str, Any], model: str):
+        self.choices = [
+            {
+                "index": i,
+                "message": {
+                    "role": "assistant",
+                    **{k: v for k, v in choice.items() if k != "finish_reason"},
+                },
+                "finish_reason": choice.get("finish_reason", "stop"),
+            }
+            for i, choice in enumerate(record.get("choices", []))
+        ]
+        self.usage = dict(record.get("usage") or {})
+        self.model = record.get("model") or model
+        self.cache_hit = False
+        self._hidden_params: dict[str, Any] = {}
+
+    def to_openai(self) -> dict[str, Any]:
+        return {
+            "id": "chatcmpl-cassette",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": self.model,
+            "choices": self.choices,
+            "usage": self.usage,
+        }
+
+
+class Cassette:
+    """Файл кассеты: ключ -> записанные ответы; потокобезопасный, запись дописыванием."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: dict[str, list[dict[str, Any]]] = {}
+        self._played: dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self._load()
+
+    def _open(self, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with self._open("r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    # обрезанная последняя строка (процесс убит во время записи)
+                    continue
+                self._entries.setdefault(row["k"], []).append(row)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(rows) for rows in self._entries.values())
+
+    def next(self, key: str) -> tuple[dict[str, Any], int] | None:
+        """Следующий по кругу ответ на ключ и номер повтора (None — ключа нет)."""
+        with self._lock:
+            rows = self._entries.get(key)
+            if not rows:
+                self.misses += 1
+                return None
+            n = self._played.get(key, 0)
+            self._played[key] = n + 1
+            self.hits += 1
+            return rows[n % len(rows)], n
+
+    def append(self, key: str, record: dict[str, Any], latency: float) -> None:
+        row = {"k": key, "r": record, "t": round(latency, 4)}
+        with self._lock:
+            dirname = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(dirname, exist_ok=True)
+            with self._open("a") as f:
+                f.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self._entries.setdefault(key, []).append(row)
+            self.recorded += 1
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "entries": sum(len(rows) for rows in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "recorded": self.recorded,
+            }
+
+
+@dataclass(frozen=True)
+class LatencyModel:
+    """
+    Синтетическая задержка воспроизведения.
+
+    Args:
+        kind: "none", "fixed" (секунды), "uniform" (от, до), "lognormal" (медиана, sigma)
+            или "recorded" (записанная задержка, умноженная на params[0], по умолчанию 1)
+        params: Параметры распределения
+        seed: Зерно; задержка зависит только от ключа запроса, номера повтора и зерна
+    """
+
+    kind: str = "none"
+    params: tuple[float, ...] = ()
+    seed: int = 0
+
+    @classmethod
+    def from_spec(cls, spec: str | None, seed: int = 0) -> "LatencyModel":
+        """Разбор строки вида "lognormal:0.8,0.5"."""
+        if not spec:
+            return cls()
+        kind, _, raw = spec.partition(":")
+        params = tuple(float(x) for x in raw.split(",") if x.strip())
+        model = cls(kind.strip(), params, seed)
+        model.sample("", 0, 0.0)  # проверка параметров
+        return model
+
+    def sample(self, key: str, occurrence: int, recorded: float) -> float:
+        if self.kind == "none":
+            return 0.0
+        if self.kind == "recorded":
+            return max(0.0, recorded * (self.params[0] if self.params else 1.0))
+        rng = random.Random(f"{self.seed}:{key}:{occurrence}")
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            low, high = self.params
+            return rng.uniform(low, high)
+        if self.kind == "lognormal":
+            median, sigma = self.params
+            return rng.lognormvariate(math.log(median), sigma)
+        raise ValueError(f"Неизвестное распределение задержки {self.kind!r}")
+
+
+class CassetteLM(dspy.BaseLM):
+    """
+    LM с записью/воспроизведением ответов.
+
+    Args:
+        lm: Настоящая LM (в режиме "replay" может быть None)
+        cassette: Кассета или путь к ней
+        mode: "record", "replay" или "auto"
+        latency: Задержка воспроизведения
+        model: Имя модели, если `lm` не задана
+    """
+
+    def __init__(
+        self,
+        lm: dspy.BaseLM | None,
+        cassette: Cassette | str,
+        mode: str = "replay",
+        latency: LatencyModel | None = None,
+        model: str | None = None,
+    ):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"mode должен быть одним из {CASSETTE_MODES}, получено {mode!r}")
+        if lm is None and mode != "replay":
+            raise ValueError(f"Для режима {mode!r} нужна настоящая LM")
+        if lm is not None:
+            super().__init__(model=lm.model, model_type=lm.model_type, cache=False)
+            self.kwargs = dict(lm.kwargs)
+        else:
+            super().__init__(model=model or "cassette/replay", cache=False)
+        self.lm = lm
+        self.cassette = cassette if isinstance(cassette, Cassette) else Cassette(cassette)
+        self.mode = mode
+        self.latency = latency or LatencyModel()
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        key = request_key(messages, prompt)
+        if self.mode != "record":
+            found = self.cassette.next(key)
+            if found is not None:
+                row, occurrence = found
+                delay = self.latency.sample(key, occurrence, float(row.get("t") or 0.0))
+                if delay:
+                    time.sleep(delay)
+                return CassetteResponse(row["r"], self.model)
+            if self.mode == "replay":
+                raise CassetteMissError(f"Нет ответа в кассете {self.cassette.path} для запроса {key[:12]}")
+        started = time.perf_counter()
+        response = self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+        self.cassette.append(key, compact_response(response), time.perf_counter() - started)
+        return response
+
+    def copy(self, **kwargs) -> "CassetteLM":
+        lm = self.lm.copy(**kwargs) if self.lm is not None else None
+        return CassetteLM(lm, self.cassette, self.mode, self.latency, kwargs.get("model", self.model))
+
+
+_cassettes: dict[str, Cassette] = {}
+_cassettes_lock = threading.Lock()
+
+
+def cassette_from_env(lm: dspy.BaseLM) -> dspy.BaseLM:
+    """Заворачивает LM в кассету из `LLM_CASSETTE` (одна `Cassette` на путь в процессе); без переменной — LM как есть."""
+    path = os.getenv("LLM_CASSETTE", "").strip()
+    if not path:
+        return lm
+    with _cassettes_lock:
+        cassette = _cassettes.get(path)
+        if cassette is None:
+            cassette = _cassettes[path] = Cassette(path)
+    mode = os.getenv("LLM_CASSETTE_MODE", "auto").strip() or "auto"
+    latency = LatencyModel.from_spec(os.getenv("LLM_CASSETTE_LATENCY", "").strip() or None)
+    return CassetteLM(lm, cassette, mode, latency)
@@ -0,0 +1,275 @@
+"""
+Адаптивный лимит одновременных запросов к LLM (AIMD).
+
+Фиксированный `num_threads` либо недогружает быстрого провайдера, либо сразу
+упирается в 429 у медленного. `AdaptiveConcurrency` подбирает лимит по ходу
+работы, как окно TCP:
+
+- пока ответы здоровые, лимит растёт: вдвое за раунд до первого отката
+  ("медленный старт"), затем на `increase` за раунд; раунд — `limit` успешных
+  ответов, и растёт лимит, только если за раунд он был выбран целиком;
+- перегрузка (429, 5xx, таймаут, обрыв соединения — `is_overload_error`)
+  уменьшает лимит в `1 / decrease` раз, не чаще раза за раунд: ответы на
+  запросы, начатые до отката, лимит больше не меняют.
+
+Задержка ответа сигналом перегрузки не считается: она зависит от длины промпта
+и ответа, и на смешанной нагрузке (короткие и длинные вызовы) сравнение с
+нормой давало бы ложные откаты.
+
+`AdaptiveConcurrencyLM` — LM-обёртка, пропускающая запросы через контроллер;
+реестр (`config.registry`) с `adaptive_concurrency=True` ставит её в каждый
+клиент с одним контроллером на модель. Пулы потоков (`dspy.Parallel`, `SummaryRuntime`, оптимизаторы) при этом
+задают только верхнюю границу; с `num_threads="auto"` её размер берётся из
+контроллера (`resolve_num_threads`). Лимит — на процесс.
+"""
+from __future__ import annotations
+
+import collections
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+import dspy
+
+logger = logging.getLogger(__name__)
+
+# число потоков для num_threads="auto", если у LM нет контроллера
+DEFAULT_AUTO_THREADS = 8
+
+_OVERLOAD_STATUSES = {408, 429, 500, 502, 503, 504, 520, 524, 529}
+_OVERLOAD_NAMES = ("RateLimit", "Timeout", "ServiceUnavailable", "InternalServerError", "APIConnection", "Overloaded")
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """Признак перегрузки провайдера: 429/5xx/таймаут/обрыв соединения (по всей цепочке причин)."""
+    seen: set[int] = set()
+    current: BaseException | None = error
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        if isinstance(current, TimeoutError):
+            return True
+        status = getattr(current, "status_code", None)
+        if isinstance(status, int) and status in _OVERLOAD_STATUSES:
+            return True
+        if any(name in type(current).__name__ for name in _OVERLOAD_NAMES):
+            return True
+        current = current.__cause__ or current.__context__
+    return False
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD-контроллер: семафор с подстраиваемым лимитом.
+
+    Args:
+        initial: Начальный лимит
+        min_limit: Нижняя граница лимита
+        max_limit: Верхняя граница лимита (и размер пула потоков для num_threads="auto")
+        increase: Прирост лимита за раунд после медленного старта
+        decrease: Множитель лимита при перегрузке
+        window: Окно расчёта пропускной способности, секунды
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        increase: int = 1,
+        decrease: float = 0.5,
+        window: float = 30.0,
+    ):
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError("Нужно 1 <= min_limit <= max_limit")
+        if not 0 < decrease < 1:
+            raise ValueError("decrease должен быть в (0, 1)")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = max(1, int(increase))
+        self.decrease = decrease
+        self.window = window
+        self._limit = float(min(max(initial, min_limit), max_limit))
+        self._slow_start = True
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._epoch = 0
+        self._round_successes = 0
+        self._round_peak = 0
+        self._completions: collections.deque[float] = collections.deque()
+        self.completed = 0
+        self.overloads = 0
+        self.increases = 0
+        self.decreases = 0
+        self.max_in_flight = 0
+
+    @property
+    def limit(self) -> int:
+        with self._cond:
+            return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        with self._cond:
+            return self._in_flight
+
+    def acquire(self) -> int:
+        """Ждёт свободного места под лимитом; возвращает раунд, в котором запрос начат (для `release`)."""
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                self._cond.wait()
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+            self._round_peak = max(self._round_peak, self._in_flight)
+            return self._epoch
+
+    def release(self, epoch: int, latency: float | None = None, error: BaseException | None = None) -> None:
+        """
+        Освобождает место и учитывает исход запроса.
+
+        `latency=None` без ошибки — запрос не дошёл до провайдера (кэш, отмена) и на лимит не влияет;
+        ошибка, не являющаяся перегрузкой, тоже лимит не меняет.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if error is not None:
+                if is_overload_error(error):
+                    self.overloads += 1
+                    self._back_off(epoch, f"{type(error).__name__}")
+            elif latency is not None:
+                self.completed += 1
+                self._completions.append(now)
+                if epoch == self._epoch:
+                    self._round_successes += 1
+                    if self._round_successes >= int(self._limit):
+                        self._grow()
+            self._trim(now)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Место под лимитом на время блока; задержка и исключение блока учитываются."""
+        epoch = self.acquire()
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            self.release(epoch, error=e)
+            raise
+        self.release(epoch, time.perf_counter() - started)
+
+    def _grow(self) -> None:
+        previous = int(self._limit)
+        saturated = self._round_peak >= previous
+        self._round_successes = 0
+        self._round_peak = self._in_flight
+        if not saturated:
+            # лимит не был выбран: ответы ничего не говорят о том, выдержит ли провайдер больше
+            return
+        if self._slow_start:
+            self._limit = min(self.max_limit, self._limit * 2)
+        else:
+            self._limit = min(self.max_limit, self._limit + self.increase)
+        if int(self._limit) != previous:
+            self.increases += 1
+            logger.debug("[CONCURRENCY] Лимит %s -> %s", previous, int(self._limit))
+
+    def _back_off(self, epoch: int, reason: str) -> None:
+        if epoch != self._epoch:
+            # запрос начат до предыдущего отката: та же перегрузка уже учтена
+            return
+        previous = int(self._limit)
+        self._limit = max(float(self.min_limit), self._limit * self.decrease)
+        self._slow_start = False
+        self._epoch += 1
+        self._round_successes = 0
+        self._round_peak = self._in_flight
+        self.decreases += 1
+        logger.info("[CONCURRENCY] Перегрузка (%s): лимит %s -> %s", reason, previous, int(self._limit))
+
+    def _trim(self, now: float) -> None:
+        while self._completions and now - self._completions[0] > self.window:
+            self._completions.popleft()
+
+    @property
+    def throughput(self) -> float:
+        """Успешных ответов в секунду за последние `window` секунд."""
+        with self._cond:
+            now = time.monotonic()
+            self._trim(now)
+            if not self._completions:
+                return 0.0
+            span = max(now - self._completions[0], 1.0)
+            return len(self._completions) / span
+
+    def stats(self) -> dict[str, Any]:
+        throughput = self.throughput
+        with self._cond:
+            return {
+                "limit": int(self._limit),
+                "in_flight": self._in_flight,
+                "max_in_flight": self.max_in_flight,
+                "throughput": round(throughput, 3),
+                "completed": self.completed,
+                "overloads": self.overloads,
+                "increases": self.increases,
+                "decreases": self.decreases,
+            }
+
+
+class AdaptiveConcurrencyLM(dspy.BaseLM):
+    """
+    LM-обёртка, пропускающая запросы через `AdaptiveConcurrency`.
+
+    Args:
+        lm: Оборачиваемая LM
+        concurrency: Контроллер (общий для всех клиентов модели)
+    """
+
+    def __init__(self, lm: dspy.BaseLM, concurrency: AdaptiveConcurrency):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False)
+        self.kwargs = dict(lm.kwargs)
+        self.lm = lm
+        self.concurrency = concurrency
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        epoch = self.concurrency.acquire()
+        started = time.perf_counter()
+        try:
+            response = self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+        except BaseException as e:
+            self.concurrency.release(epoch, error=e)
+            raise
+        # ответ из кэша ничего не говорит о нагрузке провайдера
+        latency = None if getattr(response, "cache_hit", False) else time.perf_counter() - started
+        self.concurrency.release(epoch, latency)
+        return response
+
+    def copy(self, **kwargs) -> "AdaptiveConcurrencyLM":
+        return AdaptiveConcurrencyLM(self.lm.copy(**kwargs), self.concurrency)
+
+
+def find_concurrency(lm: Any) -> AdaptiveConcurrency | None:
+    """Контроллер в цепочке LM-обёрток (по атрибутам `lm`), если он есть."""
+    seen: set[int] = set()
+    while lm is not None and id(lm) not in seen:
+        seen.add(id(lm))
+        concurrency = getattr(lm, "concurrency", None)
+        if isinstance(concurrency, AdaptiveConcurrency):
+            return concurrency
+        lm = getattr(lm, "lm", None)
+    return None
+
+
+def resolve_num_threads(num_threads: int | str | None, *lms: Any) -> int:
+    """
+    Число потоков пула: целое — как есть; "auto" (или None) — верхняя граница
+    контроллеров `lms` (по умолчанию — глобально настроенной LM), без контроллера —
+    `DEFAULT_AUTO_THREADS`.
+    """
+    if num_threads is not None and str(num_threads).strip().lower() != "auto":
+        return max(1, int(num_threads))
+    limits = [c.max_limit for c in (find_concurrency(lm) for lm in (lms or (dspy.settings.lm,))) if c is not None]
+    return max(limits) if limits else DEFAULT_AUTO_THREADS
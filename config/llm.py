@@ -1,18 +1,36 @@
-import os
+from typing import Any
+
 import dspy
-import dotenv
+
+from .registry import DEFAULT_NAME, cerebras_settings, get_registry, openrouter_settings
+from .routing import HedgedLM
+
 
 def configure_llm():
-    dotenv.load_dotenv()
+    """
+    Глобальная LM из `OPENROUTER_*`. Клиент берётся из реестра процесса
+    (`config.registry`), поэтому повторные вызовы не создают новых клиентов.
+    """
+    lm = get_registry().register(DEFAULT_NAME, **openrouter_settings())
+    dspy.configure(lm=lm)
+    return lm
+
 
-    openrouter_api_base = os.getenv("OPENROUTER_API_BASE") or os.getenv("OPENROUTER_BASE", "https://openrouter.ai/api/v1")
-    openrouter_api_key = os.getenv("OPENROUTER_API_KEY", "")
-    openrouter_model = os.getenv("OPENROUTER_MODEL", "")
+def configure_hedged_llm(
+    primary: dspy.BaseLM | None = None,
+    secondary: dspy.BaseLM | None = None,
+    **options: Any,
+) -> HedgedLM:
+    """
+    Глобальная LM с хеджированием и переключением между провайдерами (`config.routing`).
 
-    lm = dspy.LM(
-        model=openrouter_model,
-        api_base=openrouter_api_base,
-        api_key=openrouter_api_key,
-    )
+    По умолчанию основной провайдер — OpenRouter (`OPENROUTER_*`, клиент "default"
+    реестра), запасной — Cerebras (`CEREBRAS_*`, клиент "cerebras"). `options` —
+    параметры `HedgedLM` (hedge_percentile, hedge_after, failover_errors, ...).
+    """
+    registry = get_registry()
+    primary = primary or registry.register(DEFAULT_NAME, **openrouter_settings())
+    secondary = secondary or registry.register("cerebras", **cerebras_settings())
+    lm = HedgedLM(primary, secondary, **options)
     dspy.configure(lm=lm)
     return lm
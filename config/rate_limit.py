@@ -0,0 +1,133 @@
+"""
+Общий лимит частоты запросов (и токенов) к LLM для потоков и процессов.
+
+`SharedRateLimiter` — token bucket в разделяемой памяти (`multiprocessing`):
+его создают в главном процессе и передают в пул через `initializer`/`initargs`,
+после чего все процессы пула расходуют одно и то же ведро. `RateLimitedLM`
+оборачивает любую LM: перед каждым запросом берёт единицу из ведра запросов и
+оценку prompt-токенов из ведра токенов, после ответа списывает разницу с
+фактическим usage.
+"""
+from __future__ import annotations
+
+import multiprocessing
+import threading
+import time
+from typing import Any
+
+import dspy
+
+
+class SharedRateLimiter:
+    """
+    Token bucket, общий для процессов и потоков.
+
+    Args:
+        per_minute: Средняя частота (запросов или токенов в минуту)
+        burst: Сколько единиц можно взять подряд без ожидания (по умолчанию — 1 секунда лимита, минимум 1)
+        mp_context: Контекст multiprocessing пула (для "spawn"/"fork")
+    """
+
+    def __init__(
+        self,
+        per_minute: float,
+        burst: float | None = None,
+        mp_context: Any = None,
+    ):
+        if per_minute <= 0:
+            raise ValueError("per_minute должен быть положительным")
+        ctx = mp_context or multiprocessing.get_context()
+        self.rate = float(per_minute) / 60.0
+        self.burst = float(burst) if burst is not None else max(1.0, self.rate)
+        self._lock = ctx.Lock()
+        self._tokens = ctx.RawValue("d", self.burst)
+        # time.monotonic() на Linux/macOS/Windows общий для всех процессов системы
+        self._stamp = ctx.RawValue("d", time.monotonic())
+        self._waited = ctx.RawValue("d", 0.0)
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """
+        Ждёт, пока в ведре наберётся `tokens`, и забирает их. Возвращает время ожидания.
+        Запрос больше ёмкости ведра ждёт полного ведра.
+        """
+        tokens = min(tokens, self.burst)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens.value = min(self.burst, self._tokens.value + (now - self._stamp.value) * self.rate)
+                self._stamp.value = now
+                if self._tokens.value >= tokens:
+                    self._tokens.value -= tokens
+                    self._waited.value += waited
+                    return waited
+                delay = (tokens - self._tokens.value) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def adjust(self, tokens: float) -> None:
+        """Списывает (или возвращает при отрицательном) `tokens` без ожидания; баланс может уйти в минус."""
+        with self._lock:
+            self._tokens.value = min(self.burst, self._tokens.value - tokens)
+
+    @property
+    def total_wait(self) -> float:
+        """Суммарное время ожидания всех процессов, секунды."""
+        with self._lock:
+            return self._waited.value
+
+
+def estimate_prompt_tokens(prompt: str | None = None, messages: list[dict[str, Any]] | None = None) -> int:
+    """Грубая офлайн-оценка prompt-токенов (~4 символа на токен) для ведра токенов до ответа."""
+    chars = len(prompt or "")
+    for message in messages or []:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = " ".join(str(part.get("text", "")) if isinstance(part, dict) else str(part) for part in content)
+        chars += len(str(content or ""))
+    return max(1, chars // 4)
+
+
+class RateLimitedLM(dspy.BaseLM):
+    """
+    LM-обёртка с лимитами и счётчиком запросов.
+
+    Args:
+        lm: Оборачиваемая LM
+        limiter: Ведро запросов (None — без лимита)
+        token_limiter: Ведро токенов (None — без лимита)
+    """
+
+    def __init__(
+        self,
+        lm: dspy.BaseLM,
+        limiter: SharedRateLimiter | None = None,
+        token_limiter: SharedRateLimiter | None = None,
+    ):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False)
+        self.kwargs = dict(lm.kwargs)
+        self.lm = lm
+        self.limiter = limiter
+        self.token_limiter = token_limiter
+        self.requests = 0
+        self._count_lock = threading.Lock()
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        if self.limiter is not None:
+            self.limiter.acquire()
+        estimated = 0
+        if self.token_limiter is not None:
+            estimated = estimate_prompt_tokens(prompt, messages)
+            self.token_limiter.acquire(estimated)
+        with self._count_lock:
+            self.requests += 1
+        response = self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+        if self.token_limiter is not None:
+            usage = dict(getattr(response, "usage", None) or {})
+            actual = int(usage.get("total_tokens") or 0)
+            if actual:
+                self.token_limiter.adjust(actual - estimated)
+        return response
+
+    def copy(self, **kwargs) -> "RateLimitedLM":
+        return RateLimitedLM(self.lm.copy(**kwargs), self.limiter, self.token_limiter)
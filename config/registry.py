@@ -0,0 +1,309 @@
+"""
+Общий на процесс реестр LM-клиентов.
+
+Модули получают клиента по имени (`get_lm("default")`) или по параметрам
+(`get_registry().register(name, model=..., ...)`), а не создают `dspy.LM` сами:
+
+- одинаковые параметры (модель, endpoint, ключ, kwargs) дают один и тот же
+  клиент, сколько бы модулей его ни запросили;
+- все клиенты реестра делят один пул HTTP-соединений: реестр ставит свой
+  `httpx.Client` в глобальный `litellm.client_session` (на время своей жизни —
+  `close()` возвращает прежнее значение); отключается `shared_http_client=False`
+  (`LLM_SHARED_HTTP_CLIENT=0` для реестра процесса);
+- на каждую модель (строка модели LiteLLM включает провайдера) заводится пара
+  token bucket'ов — запросы/мин и токены/мин, общая для всех клиентов этой модели;
+- одинаковые одновременные запросы клиента склеиваются в один вызов
+  (`SingleFlightLM`, до лимитов — склеенные запросы лимит не расходуют);
+- с `adaptive_concurrency=True` (или `LLM_ADAPTIVE_CONCURRENCY=1` для реестра
+  процесса) число одновременных запросов к модели подбирает общий для её
+  клиентов `AdaptiveConcurrency` (`config.concurrency`), пулы потоков задают
+  только верхнюю границу; по умолчанию параллелизм задают сами пулы.
+
+Лимиты задаются `set_limits(model, ModelLimits(...))`; по умолчанию берутся из
+переменных окружения `LLM_REQUESTS_PER_MINUTE` и `LLM_TOKENS_PER_MINUTE`
+(не заданы — без лимита), границы адаптивного параллелизма — из
+`LLM_INITIAL_CONCURRENCY` и `LLM_MAX_CONCURRENCY`. С `LLM_CASSETTE` клиенты
+пишут и воспроизводят ответы через кассету (`config.cassette`).
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any
+
+import dotenv
+import dspy
+
+from .cassette import cassette_from_env
+from .concurrency import AdaptiveConcurrency, AdaptiveConcurrencyLM
+from .rate_limit import RateLimitedLM, SharedRateLimiter
+from .single_flight import SingleFlightLM
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NAME = "default"
+
+
+@dataclass(frozen=True)
+class ModelLimits:
+    """
+    Args:
+        requests_per_minute: Лимит запросов в минуту (None — без лимита)
+        tokens_per_minute: Лимит prompt + completion токенов в минуту (None — без лимита)
+        burst_seconds: Сколько секунд лимита можно израсходовать подряд без ожидания
+        initial_concurrency: Начальный лимит одновременных запросов
+        max_concurrency: Верхняя граница лимита одновременных запросов
+    """
+
+    requests_per_minute: float | None = None
+    tokens_per_minute: float | None = None
+    burst_seconds: float = 1.0
+    initial_concurrency: int = 4
+    max_concurrency: int = 64
+
+    @classmethod
+    def from_env(cls) -> "ModelLimits":
+        rpm = os.getenv("LLM_REQUESTS_PER_MINUTE", "").strip()
+        tpm = os.getenv("LLM_TOKENS_PER_MINUTE", "").strip()
+        initial = os.getenv("LLM_INITIAL_CONCURRENCY", "").strip()
+        maximum = os.getenv("LLM_MAX_CONCURRENCY", "").strip()
+        return cls(
+            float(rpm) if rpm else None,
+            float(tpm) if tpm else None,
+            initial_concurrency=int(initial) if initial else cls.initial_concurrency,
+            max_concurrency=int(maximum) if maximum else cls.max_concurrency,
+        )
+
+
+class LMRegistry:
+    """
+    Реестр клиентов: имя -> клиент, параметры -> клиент, модель -> лимиты.
+
+    Args:
+        max_connections: Размер общего пула HTTP-соединений
+        max_keepalive_connections: Сколько простаивающих соединений держать открытыми
+        single_flight: Склеивать одинаковые одновременные запросы
+        adaptive_concurrency: Подбирать число одновременных запросов к модели (AIMD)
+        shared_http_client: Ставить общий `httpx.Client` реестра в `litellm.client_session`
+            (глобальная настройка LiteLLM на время жизни реестра, до `close()`)
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        single_flight: bool = True,
+        adaptive_concurrency: bool = False,
+        shared_http_client: bool = True,
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.single_flight = single_flight
+        self.adaptive_concurrency = adaptive_concurrency
+        self.shared_http_client = shared_http_client
+        self._lock = threading.RLock()
+        self._by_name: dict[str, dspy.BaseLM] = {}
+        self._by_spec: dict[str, dspy.BaseLM] = {}
+        self._rate_limited: dict[str, RateLimitedLM] = {}
+        self._gates: dict[str, AdaptiveConcurrencyLM] = {}
+        self._concurrency: dict[str, AdaptiveConcurrency] = {}
+        self._limits: dict[str, ModelLimits] = {}
+        self._limiters: dict[str, tuple[SharedRateLimiter | None, SharedRateLimiter | None]] = {}
+        self._http_client: Any = None
+        self._previous_session: Any = None
+
+    def _ensure_session(self) -> None:
+        if not self.shared_http_client or self._http_client is not None:
+            return
+        import httpx
+        import litellm
+
+        self._http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+            ),
+            timeout=httpx.Timeout(600.0, connect=10.0),
+        )
+        self._previous_session = litellm.client_session
+        litellm.client_session = self._http_client
+        logger.info("[LM_REGISTRY] Общий httpx.Client для LiteLLM: до %s соединений", self.max_connections)
+
+    def close(self) -> None:
+        """Закрывает общий `httpx.Client` и возвращает прежний `litellm.client_session`."""
+        with self._lock:
+            if self._http_client is None:
+                return
+            import litellm
+
+            # если сессию после нас заменили, чужую настройку не трогаем
+            if litellm.client_session is self._http_client:
+                litellm.client_session = self._previous_session
+            self._http_client.close()
+            self._http_client = None
+            self._previous_session = None
+
+    def set_limits(self, model: str, limits: ModelLimits) -> None:
+        """Лимиты модели; действуют и для уже выданных клиентов этой модели."""
+        with self._lock:
+            self._limits[model] = limits
+            requests, tokens = self._limiters_for(model, rebuild=True)
+            for client in self._rate_limited.values():
+                if client.model == model:
+                    client.limiter, client.token_limiter = requests, tokens
+            if model in self._concurrency:
+                concurrency = self._concurrency_for(model, rebuild=True)
+                for gate in self._gates.values():
+                    if gate.model == model:
+                        gate.concurrency = concurrency
+
+    def concurrency(self, model: str) -> AdaptiveConcurrency:
+        """Контроллер параллелизма модели (общий для всех её клиентов)."""
+        with self._lock:
+            return self._concurrency_for(model)
+
+    def _concurrency_for(self, model: str, rebuild: bool = False) -> AdaptiveConcurrency:
+        if rebuild or model not in self._concurrency:
+            limits = self._limits.get(model) or ModelLimits.from_env()
+            self._concurrency[model] = AdaptiveConcurrency(
+                initial=limits.initial_concurrency,
+                max_limit=max(1, limits.max_concurrency),
+            )
+        return self._concurrency[model]
+
+    def _limiters_for(
+        self, model: str, rebuild: bool = False
+    ) -> tuple[SharedRateLimiter | None, SharedRateLimiter | None]:
+        if rebuild or model not in self._limiters:
+            limits = self._limits.get(model) or ModelLimits.from_env()
+            requests = tokens = None
+            if limits.requests_per_minute:
+                rate = limits.requests_per_minute / 60.0
+                requests = SharedRateLimiter(limits.requests_per_minute, burst=max(1.0, rate * limits.burst_seconds))
+            if limits.tokens_per_minute:
+                rate = limits.tokens_per_minute / 60.0
+                tokens = SharedRateLimiter(limits.tokens_per_minute, burst=max(1.0, rate * limits.burst_seconds))
+            self._limiters[model] = (requests, tokens)
+        return self._limiters[model]
+
+    @staticmethod
+    def _spec_key(model: str, api_base: str | None, api_key: str | None, kwargs: dict[str, Any]) -> str:
+        return json.dumps([model, api_base, api_key, kwargs], sort_keys=True, default=repr)
+
+    def client(
+        self,
+        model: str,
+        api_base: str | None = None,
+        api_key: str | None = None,
+        **kwargs: Any,
+    ) -> dspy.BaseLM:
+        """Клиент для параметров; повторный запрос тех же параметров возвращает тот же объект."""
+        key = self._spec_key(model, api_base, api_key, kwargs)
+        with self._lock:
+            existing = self._by_spec.get(key)
+            if existing is not None:
+                return existing
+            self._ensure_session()
+            lm = cassette_from_env(dspy.LM(model=model, api_base=api_base, api_key=api_key, **kwargs))
+            if self.adaptive_concurrency:
+                # внутри лимитов частоты: ожидание ведра не считается задержкой провайдера
+                lm = self._gates[key] = AdaptiveConcurrencyLM(lm, self._concurrency_for(model))
+            requests, tokens = self._limiters_for(model)
+            limited = RateLimitedLM(lm, requests, tokens)
+            client = SingleFlightLM(limited) if self.single_flight else limited
+            self._rate_limited[key] = limited
+            self._by_spec[key] = client
+            logger.info("[LM_REGISTRY] Новый клиент: %s (%s)", model, api_base or "endpoint по умолчанию")
+            return client
+
+    def register(
+        self,
+        name: str,
+        model: str,
+        api_base: str | None = None,
+        api_key: str | None = None,
+        **kwargs: Any,
+    ) -> dspy.BaseLM:
+        """Связывает имя с клиентом для параметров (создаёт клиент, если таких параметров ещё не было)."""
+        client = self.client(model, api_base, api_key, **kwargs)
+        with self._lock:
+            previous = self._by_name.get(name)
+            if previous is not None and previous is not client:
+                logger.info("[LM_REGISTRY] Имя %r переназначено: %s -> %s", name, previous.model, client.model)
+            self._by_name[name] = client
+        return client
+
+    def get(self, name: str = DEFAULT_NAME) -> dspy.BaseLM:
+        with self._lock:
+            client = self._by_name.get(name)
+            if client is None and name == DEFAULT_NAME:
+                client = self.register(DEFAULT_NAME, **openrouter_settings())
+            if client is None:
+                raise KeyError(f"LM {name!r} не зарегистрирована; доступны: {sorted(self._by_name)}")
+            return client
+
+    def names(self) -> list[str]:
+        with self._lock:
+            return sorted(self._by_name)
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """Имя -> запросы, прошедшие к модели, вызовы, сэкономленные склейкой, и параллелизм модели."""
+        with self._lock:
+            stats: dict[str, dict[str, Any]] = {}
+            for name, client in sorted(self._by_name.items()):
+                concurrency = self._concurrency.get(client.model)
+                stats[name] = {
+                    "requests": client.requests,
+                    "saved_calls": getattr(client, "saved_calls", 0),
+                    "concurrency": concurrency.stats() if concurrency is not None else None,
+                }
+            return stats
+
+
+def openrouter_settings() -> dict[str, Any]:
+    """Параметры клиента из `OPENROUTER_*` (как в `configure_llm`)."""
+    dotenv.load_dotenv()
+    return {
+        "model": os.getenv("OPENROUTER_MODEL", ""),
+        "api_base": os.getenv("OPENROUTER_API_BASE") or os.getenv("OPENROUTER_BASE", "https://openrouter.ai/api/v1"),
+        "api_key": os.getenv("OPENROUTER_API_KEY", ""),
+    }
+
+
+def cerebras_settings() -> dict[str, Any]:
+    """Параметры клиента из `CEREBRAS_*` (как в конфигурациях модулей)."""
+    dotenv.load_dotenv()
+    return {
+        "model": os.getenv("CEREBRAS_MODEL") or "cerebras/qwen-3-235b-a22b-instruct-2507",
+        "api_base": os.getenv("CEREBRAS_API_BASE") or "https://api.cerebras.ai/v1",
+        "api_key": os.getenv("CEREBRAS_API_KEY", ""),
+    }
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name, "").strip().lower()
+    return value in ("1", "true", "yes", "on") if value else default
+
+
+_registry: LMRegistry | None = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> LMRegistry:
+    """Реестр процесса (создаётся при первом обращении)."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = LMRegistry(
+                adaptive_concurrency=_env_flag("LLM_ADAPTIVE_CONCURRENCY"),
+                shared_http_client=_env_flag("LLM_SHARED_HTTP_CLIENT", default=True),
+            )
+        return _registry
+
+
+def get_lm(name: str = DEFAULT_NAME) -> dspy.BaseLM:
+    """Клиент по имени; "default" при первом обращении создаётся из `OPENROUTER_*`."""
+    return get_registry().get(name)
@@ -0,0 +1,350 @@
+"""
+Маршрутизация запросов между двумя провайдерами: хеджирование и отказоустойчивость.
+
+`HedgedLM` отправляет запрос основному провайдеру; если ответа нет дольше
+выбранного перцентиля его недавних задержек (`hedge_percentile`, либо
+фиксированного `hedge_after`), тот же запрос дублируется запасному, и
+возвращается ответ, пришедший первым. Проигравший запрос отменяется, если ещё
+не начат; начатый HTTP-запрос прервать нельзя — он завершается в фоне, его
+ответ отбрасывается (и оплачивается: доля хеджей ограничена `max_hedge_fraction`),
+а задержка в статистику провайдера не попадает. Ошибка основного до хеджа сразу
+переводит запрос на запасного. Запросы к провайдерам идут через собственный
+пул `HedgedLM` (`max_workers` потоков; на вызов — до двух).
+
+После `failover_errors` ошибок подряд провайдер на `failover_cooldown` секунд
+выводится из ротации — все запросы идут к другому; по истечении паузы он
+снова получает запросы. Если из ротации выведены оба, запросы идут обоим
+по-прежнему: основному, при его ошибке — запасному.
+
+Провайдеры могут отдавать разные модели: ответы на одинаковые запросы тогда
+различаются — это цена хвостовой задержки. Глобальная LM с хеджированием между
+OpenRouter и Cerebras — `configure_hedged_llm` (`config.llm`). Проверка на
+паре локальных заглушек (`config.stub_server`):
+
+    python -m config.routing --primary-latency lognormal:0.3,0.8 --secondary-latency fixed:0.25
+"""
+from __future__ import annotations
+
+import argparse
+import collections
+import contextvars
+import logging
+import statistics
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any
+
+import dspy
+
+logger = logging.getLogger(__name__)
+
+
+class _Route:
+    """Провайдер маршрутизатора: LM, недавние задержки и состояние отказов."""
+
+    def __init__(self, name: str, lm: dspy.BaseLM, window: int):
+        self.name = name
+        self.lm = lm
+        self.latencies: collections.deque[float] = collections.deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.wins = 0
+        self.consecutive_errors = 0
+        self.abandoned = 0
+        self.down_until = 0.0
+
+    def percentile(self, q: float) -> float | None:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class HedgedLM(dspy.BaseLM):
+    """
+    LM, хеджирующая медленные запросы основного провайдера запасным.
+
+    Args:
+        primary: LM основного провайдера
+        secondary: LM запасного провайдера
+        hedge_percentile: Перцентиль задержек основного, после которого запрос дублируется
+        hedge_after: Фиксированная задержка хеджа, секунды (вместо перцентиля)
+        min_samples: Сколько задержек нужно накопить, прежде чем хеджировать по перцентилю
+        max_hedge_fraction: Максимальная доля запросов с хеджем
+        failover_errors: Ошибок подряд, после которых провайдер выводится из ротации
+        failover_cooldown: На сколько секунд провайдер выводится из ротации
+        window: Сколько последних задержек провайдера учитывается
+        max_workers: Потоков в пуле запросов к провайдерам (с запасом на хеджи —
+            вдвое больше числа одновременных вызовов)
+    """
+
+    def __init__(
+        self,
+        primary: dspy.BaseLM,
+        secondary: dspy.BaseLM,
+        hedge_percentile: float = 0.95,
+        hedge_after: float | None = None,
+        min_samples: int = 20,
+        max_hedge_fraction: float = 0.1,
+        failover_errors: int = 3,
+        failover_cooldown: float = 60.0,
+        window: int = 256,
+        max_workers: int = 64,
+    ):
+        if not 0 < hedge_percentile < 1:
+            raise ValueError("hedge_percentile должен быть в (0, 1)")
+        super().__init__(model=primary.model, model_type=primary.model_type, cache=False)
+        self.kwargs = dict(primary.kwargs)
+        self.primary = primary
+        self.secondary = secondary
+        self.hedge_percentile = hedge_percentile
+        self.hedge_after = hedge_after
+        self.min_samples = min_samples
+        self.max_hedge_fraction = max_hedge_fraction
+        self.failover_errors = failover_errors
+        self.failover_cooldown = failover_cooldown
+        self.window = window
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedged")
+        self._routes = [_Route("primary", primary, window), _Route("secondary", secondary, window)]
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.failovers = 0
+
+    @property
+    def lm(self) -> dspy.BaseLM:
+        """LM, которой сейчас уходят запросы первыми (для обёрток, ищущих вложенную LM)."""
+        with self._lock:
+            return self._order()[0].lm
+
+    def _order(self) -> list[_Route]:
+        # провайдеры в ротации — первыми; если из ротации выведены оба, порядок исходный
+        now = time.monotonic()
+        return sorted(self._routes, key=lambda route: route.down_until > now)
+
+    def _hedge_delay(self, route: _Route) -> float | None:
+        """Через сколько секунд дублировать запрос к `route` (None — не дублировать)."""
+        if self.hedged >= self.max_hedge_fraction * self.requests:
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if len(route.latencies) < self.min_samples:
+            return None
+        return route.percentile(self.hedge_percentile)
+
+    def _record(self, route: _Route, started: float, error: BaseException | None, abandoned: bool) -> None:
+        with self._lock:
+            route.calls += 1
+            if error is None:
+                if abandoned:
+                    # проигравший ответил после победителя: его задержка известна лишь снизу
+                    # и завысила бы перцентиль, по которому хеджируются следующие запросы
+                    route.abandoned += 1
+                else:
+                    route.latencies.append(time.perf_counter() - started)
+                # успех запроса, начатого до вывода из ротации, паузу не отменяет
+                route.consecutive_errors = 0
+                return
+            route.errors += 1
+            route.consecutive_errors += 1
+            now = time.monotonic()
+            if route.consecutive_errors >= self.failover_errors and route.down_until <= now:
+                route.down_until = now + self.failover_cooldown
+                self.failovers += 1
+                logger.warning(
+                    "[FAILOVER] %s (%s): %s ошибок подряд, вне ротации %.0f с; последняя: %s: %s",
+                    route.name,
+                    route.lm.model,
+                    route.consecutive_errors,
+                    self.failover_cooldown,
+                    type(error).__name__,
+                    error,
+                )
+
+    def _submit(
+        self,
+        route: _Route,
+        decided: threading.Event,
+        prompt: Any,
+        messages: Any,
+        kwargs: dict[str, Any],
+        running: threading.Event | None = None,
+    ) -> Future:
+        ctx = contextvars.copy_context()
+
+        def target() -> Any:
+            if running is not None:
+                running.set()
+            started = time.perf_counter()
+            try:
+                response = ctx.run(route.lm.forward, prompt=prompt, messages=messages, **kwargs)
+            except BaseException as e:
+                self._record(route, started, e, decided.is_set())
+                raise
+            self._record(route, started, None, decided.is_set())
+            return response
+
+        return self._pool.submit(target)
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        with self._lock:
+            self.requests += 1
+            first, backup = self._order()
+            backup_available = backup.down_until <= time.monotonic() or first.down_until > time.monotonic()
+            delay = self._hedge_delay(first) if backup_available else None
+
+        # выставляется, когда у запроса есть победитель: ответы остальных — проигравшие
+        decided = threading.Event()
+        running = threading.Event()
+        routes = {self._submit(first, decided, prompt, messages, kwargs, running): first}
+        pending = set(routes)
+        backup_sent = False
+        if delay is not None:
+            # ожидание свободного потока пула — не задержка провайдера: отсчёт хеджа с начала запроса
+            running.wait()
+            done, _ = wait(pending, timeout=delay)
+            if not done:
+                with self._lock:
+                    self.hedged += 1
+                hedge = self._submit(backup, decided, prompt, messages, kwargs)
+                routes[hedge] = backup
+                pending.add(hedge)
+                backup_sent = True
+
+        last_error: BaseException | None = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    decided.set()
+                    for loser in pending:
+                        loser.cancel()
+                    with self._lock:
+                        routes[future].wins += 1
+                    return future.result()
+                last_error = error
+            if not pending and not backup_sent and backup_available:
+                # основной ответил ошибкой до хеджа — запрос переходит к запасному
+                retry = self._submit(backup, decided, prompt, messages, kwargs)
+                routes[retry] = backup
+                pending.add(retry)
+                backup_sent = True
+        raise last_error
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "failovers": self.failovers,
+                "routes": {
+                    route.name: {
+                        "model": route.lm.model,
+                        "calls": route.calls,
+                        "errors": route.errors,
+                        "wins": route.wins,
+                        "abandoned": route.abandoned,
+                        "p50": route.percentile(0.5),
+                        "p95": route.percentile(0.95),
+                        "in_rotation": route.down_until <= now,
+                    }
+                    for route in self._routes
+                },
+            }
+
+    def close(self) -> None:
+        """Останавливает пул: не начатые запросы отменяются, начатые завершаются в фоне."""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def copy(self, **kwargs) -> "HedgedLM":
+        return HedgedLM(
+            self.primary.copy(**kwargs),
+            self.secondary.copy(**kwargs),
+            hedge_percentile=self.hedge_percentile,
+            hedge_after=self.hedge_after,
+            min_samples=self.min_samples,
+            max_hedge_fraction=self.max_hedge_fraction,
+            failover_errors=self.failover_errors,
+            failover_cooldown=self.failover_cooldown,
+            window=self.window,
+            max_workers=self.max_workers,
+        )
+
+
+def _latency_report(latencies: list[float]) -> str:
+    ordered = sorted(latencies)
+
+    def at(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return f"mean={statistics.fmean(ordered):.3f}s p50={at(0.5):.3f}s p95={at(0.95):.3f}s p99={at(0.99):.3f}s"
+
+
+def main() -> int:
+    """Сравнение одного провайдера и `HedgedLM` на паре локальных заглушек."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from .cassette import LatencyModel
+    from .stub_server import StubServer
+
+    parser = argparse.ArgumentParser(description="Бенчмарк HedgedLM на паре заглушек-провайдеров")
+    parser.add_argument("--primary-latency", default="lognormal:0.3,0.8", help="Задержка основного (см. LatencyModel)")
+    parser.add_argument("--secondary-latency", default="fixed:0.25", help="Задержка запасного")
+    parser.add_argument("--primary-errors", type=float, default=0.0, help="Доля ответов 503 у основного")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--hedge-percentile", type=float, default=0.9)
+    parser.add_argument("--max-hedge-fraction", type=float, default=0.15)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    primary_server = StubServer(
+        None,
+        LatencyModel.from_spec(args.primary_latency, args.seed),
+        fallback="primary",
+        error_rate=args.primary_errors,
+    )
+    secondary_server = StubServer(None, LatencyModel.from_spec(args.secondary_latency, args.seed), fallback="secondary")
+
+    def client(server: StubServer) -> dspy.BaseLM:
+        return dspy.LM("openai/stub", api_base=server.base_url, api_key="stub", cache=False, num_retries=0)
+
+    def run(lm: dspy.BaseLM, tag: str) -> list[float]:
+        def one(i: int) -> float | None:
+            started = time.perf_counter()
+            try:
+                lm.forward(messages=[{"role": "user", "content": f"{tag} request {i}"}])
+            except Exception:
+                return None
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(args.threads) as pool:
+            results = list(pool.map(one, range(args.requests)))
+        failed = sum(1 for r in results if r is None)
+        latencies = [r for r in results if r is not None]
+        logger.info("[HEDGE] %s: %s, ошибок %s/%s", tag, _latency_report(latencies), failed, len(results))
+        return latencies
+
+    with primary_server, secondary_server:
+        run(client(primary_server), "только основной")
+        hedged = HedgedLM(
+            client(primary_server),
+            client(secondary_server),
+            hedge_percentile=args.hedge_percentile,
+            max_hedge_fraction=args.max_hedge_fraction,
+        )
+        # первые min_samples запросов только накапливают задержки основного
+        run(hedged, "прогрев")
+        run(hedged, "с хеджированием")
+        logger.info("[HEDGE] %s", hedged.stats())
+        hedged.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
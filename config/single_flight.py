@@ -0,0 +1,90 @@
+"""
+Single-flight: одинаковые одновременные запросы к LLM — один сетевой вызов.
+
+Кэш DSPy помогает только после того, как ответ получен; в пачках `dspy.Parallel`
+одинаковые промпты (повторяющиеся тексты, шаблонные чанки) уходят в сеть
+одновременно и оплачиваются каждый. `SingleFlightLM` держит таблицу запросов в
+полёте: запрос с тем же ключом (модель, сообщения, параметры вызова) ждёт ответа
+первого и получает тот же результат.
+
+Ожидавшие получают копию ответа без usage: токены оплачены один раз и один раз
+учитываются (`SummaryRuntime`, бюджет, трекер usage DSPy). Ошибка первого
+запроса передаётся всем ожидавшим.
+"""
+from __future__ import annotations
+
+import copy
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any
+
+import dspy
+
+
+def flight_key(model: str, prompt: str | None, messages: list[dict[str, Any]] | None, kwargs: dict[str, Any]) -> str:
+    return json.dumps(
+        {"model": model, "prompt": prompt, "messages": messages, "kwargs": kwargs},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=repr,
+    )
+
+
+def _without_usage(response: Any) -> Any:
+    shared = copy.copy(response)
+    for name, value in (("usage", None), ("cache_hit", True)):
+        try:
+            object.__setattr__(shared, name, value)
+        except (AttributeError, TypeError):
+            pass
+    return shared
+
+
+class SingleFlightLM(dspy.BaseLM):
+    """LM-обёртка, склеивающая одинаковые запросы в полёте; `saved_calls` — сколько вызовов сэкономлено."""
+
+    def __init__(self, lm: dspy.BaseLM):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False)
+        self.kwargs = dict(lm.kwargs)
+        self.lm = lm
+        self.calls = 0
+        self.saved_calls = 0
+        self._lock = threading.Lock()
+        self._in_flight: dict[str, Future] = {}
+
+    @property
+    def requests(self) -> int:
+        """Запросы, прошедшие через внутреннюю LM (для счётчиков `RateLimitedLM`)."""
+        return getattr(self.lm, "requests", self.calls)
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        key = flight_key(self.lm.model, prompt, messages, kwargs)
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+                self.calls += 1
+            else:
+                self.saved_calls += 1
+        if not leader:
+            return _without_usage(future.result())
+        try:
+            response = self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(response)
+            return response
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"calls": self.calls, "saved_calls": self.saved_calls, "in_flight": len(self._in_flight)}
+
+    def copy(self, **kwargs) -> "SingleFlightLM":
+        return SingleFlightLM(self.lm.copy(**kwargs))
@@ -0,0 +1,199 @@
+"""
+Локальный OpenAI-совместимый сервер-заглушка, отвечающий из кассеты.
+
+    python -m config.stub_server --cassette runs/summary.jsonl.gz --latency lognormal:0.8,0.5 --port 8765
+
+и затем, например, `OPENROUTER_API_BASE=http://127.0.0.1:8765/v1 OPENROUTER_MODEL=openai/stub
+OPENROUTER_API_KEY=stub`: весь конвейер идёт по HTTP как с настоящим провайдером
+(сериализация, пул соединений, ретраи клиента), но без сети и детерминированно.
+
+Поддерживаются `POST /v1/chat/completions` (без stream) и `GET /v1/models`.
+Ответ ищется в кассете по ключу сообщений (`request_key`); промах — HTTP 404,
+а с `fallback` — синтетический ответ с этим текстом (без кассеты так отвечает
+на всё — для бенчмарков задержек). Задержка ответа — `LatencyModel`, доля
+ответов HTTP 503 — `error_rate` (детерминирована, как и задержка). В тестах и
+бенчмарках сервер можно поднять в фоновом потоке:
+`with StubServer(cassette) as server: ... server.base_url`.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+from .cassette import Cassette, CassetteResponse, LatencyModel, request_key
+
+logger = logging.getLogger(__name__)
+
+
+class StubServer:
+    """
+    Args:
+        cassette: Кассета или путь к ней (None — отвечать только `fallback`)
+        latency: Задержка ответа
+        host: Адрес
+        port: Порт (0 — свободный порт)
+        fallback: Текст ответа на запросы, которых нет в кассете (None — HTTP 404)
+        error_rate: Доля запросов, на которые отвечается HTTP 503
+    """
+
+    def __init__(
+        self,
+        cassette: Cassette | str | None,
+        latency: LatencyModel | None = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        fallback: str | None = None,
+        error_rate: float = 0.0,
+    ):
+        if cassette is None and fallback is None:
+            raise ValueError("Нужна кассета или fallback")
+        self.cassette = cassette if isinstance(cassette, Cassette) or cassette is None else Cassette(cassette)
+        self.latency = latency or LatencyModel()
+        self.fallback = fallback
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._occurrences: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _handler_class(self) -> type[BaseHTTPRequestHandler]:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logger.debug("[STUB] " + format, *args)
+
+            def _reply(self, status: int, body: dict[str, Any]) -> None:
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self) -> None:
+                if self.path.rstrip("/").endswith("/models"):
+                    self._reply(200, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+                else:
+                    self._reply(404, {"error": {"message": f"Unknown path {self.path}", "type": "not_found"}})
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    self._reply(400, {"error": {"message": "Invalid JSON", "type": "invalid_request_error"}})
+                    return
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._reply(404, {"error": {"message": f"Unknown path {self.path}", "type": "not_found"}})
+                    return
+                if body.get("stream"):
+                    self._reply(400, {"error": {"message": "stream is not supported", "type": "invalid_request_error"}})
+                    return
+                self._reply(*server.complete(body))
+
+        return Handler
+
+    def complete(self, body: dict[str, Any]) -> tuple[int, dict[str, Any]]:
+        """Ответ на тело запроса chat/completions: (HTTP-статус, JSON)."""
+        with self._lock:
+            self.requests += 1
+        key = request_key(body.get("messages"), body.get("prompt"))
+        found = self.cassette.next(key) if self.cassette is not None else None
+        if found is None and self.fallback is None:
+            message = f"No cassette entry for request {key[:12]}"
+            return 404, {"error": {"message": message, "type": "not_found", "code": "cassette_miss"}}
+        if found is not None:
+            row, occurrence = found
+        else:
+            row = {"r": {"choices": [{"content": self.fallback, "finish_reason": "stop"}], "usage": {}}, "t": 0.0}
+            with self._lock:
+                occurrence = self._occurrences.get(key, 0)
+                self._occurrences[key] = occurrence + 1
+        delay = self.latency.sample(key, occurrence, float(row.get("t") or 0.0))
+        if delay:
+            time.sleep(delay)
+        failure = random.Random(f"{self.latency.seed}:error:{key}:{occurrence}").random()
+        if failure < self.error_rate:
+            with self._lock:
+                self.errors += 1
+            return 503, {"error": {"message": "Injected stub failure", "type": "service_unavailable"}}
+        return 200, CassetteResponse(row["r"], body.get("model") or "stub").to_openai()
+
+    def serve_forever(self) -> None:
+        """Обслуживание в текущем потоке (до KeyboardInterrupt)."""
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="OpenAI-совместимая заглушка, отвечающая из кассеты")
+    parser.add_argument("--cassette", default=None, help="Путь к кассете (.jsonl или .jsonl.gz)")
+    parser.add_argument("--fallback", default=None, help="Текст ответа на запросы, которых нет в кассете")
+    parser.add_argument("--latency", default=None, help="Задержка: fixed:0.5, uniform:0.2,1.0, lognormal:0.8,0.5, recorded")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов HTTP 503")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    if args.cassette is None and args.fallback is None:
+        parser.error("нужен --cassette или --fallback")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    server = StubServer(
+        args.cassette,
+        LatencyModel.from_spec(args.latency, args.seed),
+        args.host,
+        args.port,
+        fallback=args.fallback,
+        error_rate=args.error_rate,
+    )
+    entries = len(server.cassette) if server.cassette is not None else 0
+    logger.info("[STUB] %s ответов в кассете, слушаю %s", entries, server.base_url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cassette_stats = server.cassette.stats() if server.cassette is not None else {}
+        logger.info("[STUB] Запросов: %s (ошибок %s), кассета: %s", server.requests, server.errors, cassette_stats)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
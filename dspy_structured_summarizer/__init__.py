@@ -1,3 +1,27 @@
-from .module import configure_module_llm, summarize_text, structure_and_summarize
+from .module import configure_module_llm, iter_summarize_text, summarize_text, structure_and_summarize
+from .budget import BudgetExceededError, SummaryBudget
+from .checkpoint import RunCheckpoint
+from .classify import TopicClassifier
+from .gists import GistStore
+from .incremental import SummaryMemo
+from .planner import SummaryPlan, SummaryPlanner
+from .runtime import SummaryRuntime, SummaryStats
+from .tiers import ModelTiers
 
-__all__ = ["configure_module_llm", "summarize_text", "structure_and_summarize"]
+__all__ = [
+    "configure_module_llm",
+    "summarize_text",
+    "iter_summarize_text",
+    "structure_and_summarize",
+    "BudgetExceededError",
+    "GistStore",
+    "ModelTiers",
+    "RunCheckpoint",
+    "SummaryBudget",
+    "SummaryMemo",
+    "SummaryPlan",
+    "SummaryPlanner",
+    "TopicClassifier",
+    "SummaryRuntime",
+    "SummaryStats",
+]
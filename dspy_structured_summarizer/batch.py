@@ -0,0 +1,326 @@
+"""
+Суммаризация корпуса документов пулом процессов.
+
+    python -m dspy_structured_summarizer.batch "datasets/long_texts/*.md" --output-dir summaries --processes 4 --rpm 120
+
+Документы распределяются по процессам `ProcessPoolExecutor`; каждый процесс один
+раз настраивает свою LM (`lm_factory`, по умолчанию `configure_module_llm`), а
+все процессы расходуют общий лимит запросов (`SharedRateLimiter`). Внутри
+процесса вызовы суммаризатора идут через `SummaryRuntime` с `num_threads` потоками.
+
+Документ пропускается, если его итоговый файл существует и в манифесте прошлого
+прогона записан тот же хэш содержимого (текст + настройки) со статусом "done".
+Манифест `manifest.json` в `output_dir` перезаписывается после каждого документа:
+задержка, число запросов к LLM, вызовов и ошибок суммаризатора, токены, ошибка.
+"""
+from __future__ import annotations
+
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from typing import Any
+
+import dspy
+
+from config.rate_limit import RateLimitedLM, SharedRateLimiter
+
+from .budget import SummaryBudget
+from .classify import TopicClassifier
+from .module import summarize_text
+from .runtime import SummaryRuntime
+from .tiers import ModelTiers
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+
+# состояние процесса пула, заполняется в _init_worker
+_WORKER: dict[str, Any] = {}
+
+
+@dataclass
+class DocumentResult:
+    """Строка манифеста по одному документу."""
+
+    source: str
+    output: str
+    content_hash: str
+    status: str  # "done", "skipped" или "failed"
+    latency: float = 0.0
+    llm_requests: int = 0
+    summarizer_calls: int = 0
+    failed_calls: int = 0
+    total_tokens: int = 0
+    cost: float = 0.0
+    error: str | None = None
+
+
+def content_hash(text: str, settings: dict[str, Any]) -> str:
+    payload = json.dumps({"text": text, "settings": settings}, sort_keys=True, ensure_ascii=False, default=repr)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _output_paths(sources: list[str], output_dir: str) -> dict[str, str]:
+    """Источник -> итоговый файл; структура поддиректорий относительно общего корня сохраняется."""
+    if not sources:
+        return {}
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in sources])
+    paths: dict[str, str] = {}
+    for source in sources:
+        rel = os.path.relpath(os.path.abspath(source), root)
+        paths[source] = os.path.join(output_dir, os.path.splitext(rel)[0] + ".summary.md")
+    return paths
+
+
+def _load_manifest(path: str) -> dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except ValueError:
+        logger.warning("[BATCH] Манифест %s повреждён — все документы будут обработаны заново", path)
+        return {}
+
+
+def _write_manifest(path: str, manifest: dict[str, Any]) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _default_lm_factory() -> dspy.BaseLM:
+    from .module import configure_module_llm
+
+    return configure_module_llm(use_global_config=True)
+
+
+def _init_worker(
+    limiter: SharedRateLimiter | None,
+    lm_factory: Callable[[], dspy.BaseLM] | None,
+    fast_model: str | None,
+) -> None:
+    """Инициализатор процесса пула: своя LM с общим лимитом запросов."""
+    lm = RateLimitedLM((lm_factory or _default_lm_factory)(), limiter)
+    dspy.configure(lm=lm)
+    lms = [lm]
+    tiers = None
+    if fast_model:
+        fast = lm.copy(model=fast_model)
+        lms.append(fast)
+        tiers = ModelTiers.fast_and_strong(fast, lm)
+    _WORKER.update(lms=lms, tiers=tiers)
+
+
+def _worker_requests() -> int:
+    return sum(lm.requests for lm in _WORKER.get("lms", []))
+
+
+def _summarize_document(
+    source: str,
+    output_path: str,
+    digest: str,
+    num_threads: int | str,
+    summarize_kwargs: dict[str, Any],
+) -> DocumentResult:
+    result = DocumentResult(source, output_path, digest, "failed")
+    requests_before = _worker_requests()
+    started = time.perf_counter()
+    runtime = SummaryRuntime(num_threads, _WORKER.get("tiers"), summarize_kwargs.get("budget"))
+    try:
+        with open(source, "r", encoding="utf-8") as f:
+            text = f.read()
+        with runtime:
+            summarize_text(text, output_path=output_path, runtime=runtime, **summarize_kwargs)
+        result.status = "done"
+    except Exception as e:
+        logger.exception("[BATCH] Ошибка суммаризации %s", source)
+        result.error = f"{type(e).__name__}: {e}"
+    result.latency = round(time.perf_counter() - started, 3)
+    result.llm_requests = _worker_requests() - requests_before
+    result.summarizer_calls = runtime.stats.total_calls
+    result.failed_calls = runtime.stats.failed_calls
+    result.total_tokens = runtime.stats.total_tokens
+    result.cost = runtime.stats.cost
+    return result
+
+
+def summarize_corpus(
+    pattern: str,
+    output_dir: str,
+    *,
+    processes: int = 4,
+    requests_per_minute: float | None = None,
+    num_threads: int | str = 8,
+    force: bool = False,
+    lm_factory: Callable[[], dspy.BaseLM] | None = None,
+    fast_model: str | None = None,
+    **summarize_kwargs: Any,
+) -> dict[str, Any]:
+    """
+    Суммирует все файлы по glob-шаблону `pattern` в `output_dir` и возвращает манифест.
+
+    Args:
+        pattern: Glob-шаблон документов (рекурсивный `**` поддерживается)
+        output_dir: Директория итоговых файлов и `manifest.json`
+        processes: Число процессов пула
+        requests_per_minute: Общий для всех процессов лимит запросов к LLM (None — без лимита)
+        num_threads: Потоки `SummaryRuntime` внутри каждого процесса ("auto" — по адаптивному
+            лимиту LM процесса, см. `config.concurrency`)
+        force: Обработать заново и актуальные документы
+        lm_factory: Функция уровня модуля (передаётся в процессы), создающая и настраивающая LM
+        fast_model: Модель для выжимок и классификации (см. `ModelTiers.fast_and_strong`)
+        **summarize_kwargs: Аргументы `summarize_text` (parent_heading, splitter_kwargs,
+            max_depth, classifier, budget, ...); должны сериализоваться pickle
+    """
+    out_root = os.path.abspath(output_dir) + os.sep
+    # итоговые файлы прошлых прогонов тоже могут подходить под шаблон
+    sources = sorted(
+        p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p) and not os.path.abspath(p).startswith(out_root)
+    )
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    previous = _load_manifest(manifest_path).get("documents", {})
+    outputs = _output_paths(sources, output_dir)
+    settings = {"summarize": summarize_kwargs, "fast_model": fast_model}
+
+    documents: dict[str, dict[str, Any]] = {}
+    pending: list[tuple[str, str]] = []
+    for source in sources:
+        with open(source, "r", encoding="utf-8") as f:
+            digest = content_hash(f.read(), settings)
+        old = previous.get(source) or {}
+        up_to_date = (
+            old.get("content_hash") == digest
+            and old.get("status") in ("done", "skipped")
+            and os.path.exists(outputs[source])
+        )
+        if up_to_date and not force:
+            documents[source] = {**old, "status": "skipped"}
+        else:
+            pending.append((source, digest))
+
+    manifest: dict[str, Any] = {
+        "pattern": pattern,
+        "processes": processes,
+        "requests_per_minute": requests_per_minute,
+        "documents": documents,
+    }
+    logger.info("[BATCH] Документов: %s, актуальных (пропуск): %s", len(sources), len(documents))
+    _write_manifest(manifest_path, manifest)
+
+    started = time.perf_counter()
+    mp_context = multiprocessing.get_context()
+    limiter = SharedRateLimiter(requests_per_minute, mp_context=mp_context) if requests_per_minute else None
+    if pending:
+        with ProcessPoolExecutor(
+            max_workers=max(1, min(processes, len(pending))),
+            mp_context=mp_context,
+            initializer=_init_worker,
+            initargs=(limiter, lm_factory, fast_model),
+        ) as pool:
+            futures = {
+                pool.submit(_summarize_document, source, outputs[source], digest, num_threads, summarize_kwargs): (
+                    source,
+                    digest,
+                )
+                for source, digest in pending
+            }
+            for future in as_completed(futures):
+                source, digest = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # процесс пула упал целиком (например, BrokenProcessPool)
+                    result = DocumentResult(source, outputs[source], digest, "failed", error=f"{type(e).__name__}: {e}")
+                documents[source] = asdict(result)
+                logger.info(
+                    "[BATCH] %s: %s за %.1f с, запросов LLM=%s, ошибок=%s",
+                    source,
+                    result.status,
+                    result.latency,
+                    result.llm_requests,
+                    result.failed_calls,
+                )
+                _write_manifest(manifest_path, manifest)
+
+    rows = list(documents.values())
+    manifest["documents"] = {source: documents[source] for source in sources if source in documents}
+    manifest["totals"] = {
+        "documents": len(rows),
+        "done": sum(1 for r in rows if r["status"] == "done"),
+        "skipped": sum(1 for r in rows if r["status"] == "skipped"),
+        "failed": sum(1 for r in rows if r["status"] == "failed"),
+        "wall_time": round(time.perf_counter() - started, 3),
+        "rate_limit_wait": round(limiter.total_wait, 3) if limiter is not None else 0.0,
+    }
+    _write_manifest(manifest_path, manifest)
+    logger.info("[BATCH] Итог: %s", manifest["totals"])
+    return manifest
+
+
+def _num_threads_arg(value: str) -> int | str:
+    return "auto" if value.strip().lower() == "auto" else int(value)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Суммаризация корпуса документов пулом процессов")
+    parser.add_argument("pattern", help="Glob-шаблон документов, например 'datasets/long_texts/*.md'")
+    parser.add_argument("--output-dir", default="summaries")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--rpm", type=float, default=None, help="Общий лимит запросов к LLM в минуту")
+    parser.add_argument(
+        "--num-threads",
+        type=_num_threads_arg,
+        default="auto",
+        help="Потоки суммаризатора в каждом процессе (число или auto — адаптивный лимит)",
+    )
+    parser.add_argument("--force", action="store_true", help="Обработать и актуальные документы")
+    parser.add_argument("--parent-heading", default="Summary")
+    parser.add_argument("--max-depth", type=int, default=3)
+    parser.add_argument("--max-chunk-size", type=int, default=3000)
+    parser.add_argument("--max-chunk-tokens", type=int, default=None)
+    parser.add_argument("--classify-mode", choices=["single", "batch", "lexical"], default="single")
+    parser.add_argument("--classify-batch-size", type=int, default=8)
+    parser.add_argument("--classify-by", choices=["chunk", "gist"], default="chunk")
+    parser.add_argument("--fast-model", default=None, help="Модель для выжимок и классификации")
+    parser.add_argument("--max-tokens", type=int, default=None, help="Бюджет токенов на документ")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(message)s")
+    manifest = summarize_corpus(
+        args.pattern,
+        args.output_dir,
+        processes=args.processes,
+        requests_per_minute=args.rpm,
+        num_threads=args.num_threads,
+        force=args.force,
+        fast_model=args.fast_model,
+        parent_heading=args.parent_heading,
+        splitter_kwargs={
+            "max_chunk_size": args.max_chunk_size,
+            "max_chunk_tokens": args.max_chunk_tokens,
+            "num_threads": args.num_threads,
+        },
+        max_depth=args.max_depth,
+        classifier=TopicClassifier(
+            mode=args.classify_mode,
+            batch_size=args.classify_batch_size,
+            classify_by=args.classify_by,
+        ),
+        budget=SummaryBudget(max_tokens=args.max_tokens) if args.max_tokens else None,
+    )
+    return 1 if manifest["totals"]["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,47 @@
+"""
+Жёсткий бюджет токенов/стоимости прогона суммаризатора.
+
+Бюджет используется дважды: планировщик (`planner.py`) подбирает глубину,
+порог базового случая и режим классификации так, чтобы оценка уложилась в
+бюджет, а `SummaryRuntime` по фактическому usage провайдера отказывается
+ставить новые вызовы, когда бюджет исчерпан.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+
+
+class BudgetExceededError(RuntimeError):
+    """Фактический расход достиг бюджета прогона — новые вызовы LLM не выполняются."""
+
+
+@dataclass(frozen=True)
+class SummaryBudget:
+    """
+    Args:
+        max_tokens: Лимит суммы prompt + completion токенов (None — без лимита)
+        max_cost: Лимит стоимости в долларах (None — без лимита; нужны `prices`)
+        prices: Уровень модели (см. `ModelTiers`, "default" — глобальная LM) ->
+            (цена за 1M prompt-токенов, цена за 1M completion-токенов)
+        safety: Доля бюджета, в которую должна уложиться оценка плана
+            (запас на неточность оценки)
+    """
+
+    max_tokens: int | None = None
+    max_cost: float | None = None
+    prices: dict[str, tuple[float, float]] = field(default_factory=dict)
+    safety: float = 0.85
+
+    def cost(self, tier: str, prompt_tokens: int, completion_tokens: int) -> float:
+        prompt_price, completion_price = self.prices.get(tier, (0.0, 0.0))
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+    def fits(self, tokens: int, cost: float, margin: float = 1.0) -> bool:
+        if self.max_tokens is not None and tokens > self.max_tokens * margin:
+            return False
+        if self.max_cost is not None and cost > self.max_cost * margin:
+            return False
+        return True
+
+    def describe(self) -> dict[str, object]:
+        return {"max_tokens": self.max_tokens, "max_cost": self.max_cost}
@@ -0,0 +1,205 @@
+"""
+Контрольные точки прогона суммаризатора в директории запуска.
+
+Каждая завершённая единица работы сразу пишется на диск, поэтому прогон,
+упавший на таймауте провайдера или убитый, продолжается с `resume=True` без
+повторной оплаты уже сделанных вызовов:
+
+    meta.json        отпечаток входа и настроек, статус прогона
+    splits.json      границы чанков после сплиттера
+    gists.jsonl      выжимки (ключ GistStore -> текст), дописываются по мере готовности
+    headings.jsonl   заголовки оглавления по разделам
+    topics.jsonl     темы чанков по разделам (хэш чанка -> тема)
+    sections/*.json  готовые разделы (NodeRecord) вместе с ключом раздела
+
+Ключ раздела — цепочка заголовков (как в `SummaryMemo`). Обрезанная последняя
+строка JSONL (процесс убит во время записи) при чтении пропускается.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from dataclasses import asdict
+from typing import Any
+
+from .incremental import NodeRecord, SummaryMemo
+
+logger = logging.getLogger(__name__)
+
+
+def _read_jsonl(path: str) -> list[dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    rows: list[dict[str, Any]] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                logger.warning("[CHECKPOINT] Пропускаю повреждённую строку в %s", path)
+    return rows
+
+
+def _write_json(path: str, data: Any) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class RunCheckpoint:
+    """
+    Директория запуска с артефактами по шагам.
+
+    Args:
+        run_dir: Путь к директории запуска
+        fingerprint: Отпечаток входного текста и настроек; при resume артефакты
+            берутся только если он совпадает с сохранённым
+        resume: Продолжить прерванный прогон; иначе директория очищается
+    """
+
+    def __init__(self, run_dir: str, fingerprint: str, resume: bool = False):
+        self.run_dir = os.path.abspath(run_dir)
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+
+        meta = self._read_meta()
+        if resume and meta.get("fingerprint") != fingerprint:
+            if meta:
+                logger.warning("[CHECKPOINT] Вход или настройки изменились — начинаю прогон заново: %s", self.run_dir)
+            resume = False
+        if not resume and os.path.isdir(self.run_dir):
+            for name in ("splits.json", "gists.jsonl", "headings.jsonl", "topics.jsonl"):
+                path = os.path.join(self.run_dir, name)
+                if os.path.exists(path):
+                    os.remove(path)
+            shutil.rmtree(os.path.join(self.run_dir, "sections"), ignore_errors=True)
+        os.makedirs(os.path.join(self.run_dir, "sections"), exist_ok=True)
+        self.resumed = resume
+
+        self.splits: list[tuple[int, int]] | None = None
+        self.gists: dict[str, str] = {}
+        self.headings: dict[str, list[str]] = {}
+        self.topics: dict[str, dict[str, str]] = {}
+        self.sections: dict[str, NodeRecord] = {}
+        if resume:
+            self._load()
+            logger.info(
+                "[CHECKPOINT] Продолжение прогона: чанки=%s, выжимок=%s, оглавлений=%s, готовых разделов=%s",
+                "да" if self.splits is not None else "нет",
+                len(self.gists),
+                len(self.headings),
+                len(self.sections),
+            )
+        self._write_meta("running")
+
+    @staticmethod
+    def make_fingerprint(input_text: str, settings: dict[str, Any]) -> str:
+        payload = json.dumps({"text": input_text, "settings": settings}, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.run_dir, name)
+
+    def _section_path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:24]
+        return os.path.join(self.run_dir, "sections", f"{digest}.json")
+
+    def _read_meta(self) -> dict[str, Any]:
+        try:
+            with open(self._path("meta.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self, status: str) -> None:
+        _write_json(self._path("meta.json"), {"fingerprint": self.fingerprint, "status": status})
+
+    def _load(self) -> None:
+        try:
+            with open(self._path("splits.json"), "r", encoding="utf-8") as f:
+                self.splits = [(int(s), int(e)) for s, e in json.load(f)]
+        except (OSError, ValueError, TypeError):
+            self.splits = None
+        for row in _read_jsonl(self._path("gists.jsonl")):
+            self.gists[row["key"]] = row["gist"]
+        for row in _read_jsonl(self._path("headings.jsonl")):
+            self.headings[row["node"]] = list(row["headers"])
+        for row in _read_jsonl(self._path("topics.jsonl")):
+            self.topics.setdefault(row["node"], {}).update(row["topics"])
+        sections_dir = self._path("sections")
+        for name in os.listdir(sections_dir) if os.path.isdir(sections_dir) else []:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(sections_dir, name), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.sections[data["node"]] = NodeRecord(**data["record"])
+            except (OSError, ValueError, KeyError, TypeError):
+                logger.warning("[CHECKPOINT] Пропускаю повреждённый раздел %s", name)
+
+    def _append(self, name: str, row: dict[str, Any]) -> None:
+        line = json.dumps(row, ensure_ascii=False)
+        with self._lock, open(self._path(name), "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+
+    # --- запись ---
+
+    def save_splits(self, offsets: list[tuple[int, int]]) -> None:
+        self.splits = list(offsets)
+        _write_json(self._path("splits.json"), [list(o) for o in offsets])
+
+    def save_gists(self, gists: dict[str, str]) -> None:
+        with self._lock:
+            fresh = {k: v for k, v in gists.items() if v and self.gists.get(k) != v}
+            self.gists.update(fresh)
+        for key, gist in fresh.items():
+            self._append("gists.jsonl", {"key": key, "gist": gist})
+
+    def save_headings(self, parent_headings: list[str], headers: list[str]) -> None:
+        key = SummaryMemo.node_key(parent_headings)
+        with self._lock:
+            self.headings[key] = list(headers)
+        self._append("headings.jsonl", {"node": key, "headers": headers})
+
+    def save_topics(self, parent_headings: list[str], topics: dict[str, str]) -> None:
+        if not topics:
+            return
+        key = SummaryMemo.node_key(parent_headings)
+        with self._lock:
+            self.topics.setdefault(key, {}).update(topics)
+        self._append("topics.jsonl", {"node": key, "topics": topics})
+
+    def save_section(self, parent_headings: list[str], node: NodeRecord) -> None:
+        key = SummaryMemo.node_key(parent_headings)
+        with self._lock:
+            self.sections[key] = node
+        _write_json(self._section_path(key), {"node": key, "record": asdict(node)})
+
+    def complete(self) -> None:
+        self._write_meta("complete")
+
+    # --- чтение при продолжении ---
+
+    def section(self, parent_headings: list[str], chunk_hashes: list[str]) -> NodeRecord | None:
+        node = self.sections.get(SummaryMemo.node_key(parent_headings))
+        return node if node is not None and node.chunks == chunk_hashes else None
+
+    def subtree(self, parent_headings: list[str]) -> dict[str, NodeRecord]:
+        key = SummaryMemo.node_key(parent_headings)
+        with self._lock:
+            return {k: v for k, v in self.sections.items() if k == key or k.startswith(key + "\n")}
+
+    def headers(self, parent_headings: list[str]) -> list[str] | None:
+        return self.headings.get(SummaryMemo.node_key(parent_headings))
+
+    def known_topics(self, parent_headings: list[str]) -> dict[str, str]:
+        return dict(self.topics.get(SummaryMemo.node_key(parent_headings), {}))
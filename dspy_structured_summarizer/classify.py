@@ -0,0 +1,198 @@
+"""
+Классификация чанков по заголовкам (шаг 4 `structure_and_summarize`).
+
+Режимы `TopicClassifier`:
+    "single"  — один вызов ChunkTopicSignature на чанк (исходное поведение)
+    "batch"   — BatchChunkTopicSignature на K чанков за вызов; ответ строго
+                выровнен по индексам, при некорректном ответе (ошибка, не та
+                длина) пачка делится пополам и запрашивается заново
+    "lexical" — без LLM: выжимки сопоставляются заголовкам по косинусной
+                близости tf-idf векторов основ слов или эмбеддингов (`embedder`)
+"""
+from __future__ import annotations
+
+import logging
+import re
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from typing import Any
+
+import dspy
+import numpy as np
+
+from module_semantic_parallel_splitter.cohesion import lexical_terms
+
+from .runtime import Slot, SummaryRuntime
+from .signatures import BatchChunkTopicSignature, ChunkTopicSignature
+
+logger = logging.getLogger(__name__)
+
+CLASSIFY_MODES = ("single", "batch", "lexical")
+CLASSIFY_INPUTS = ("chunk", "gist")
+
+# Эмбеддер: список текстов -> матрица (n, dim); подходит, например, dspy.Embedder
+Embedder = Callable[[list[str]], Any]
+
+
+def _normalize_topic(value: Any) -> str:
+    text = str(value or "").strip().strip("\"'`").strip()
+    text = re.sub(r"^\s*(\[\d+\]|\d+[\.\)])\s*", "", text)
+    return text.lstrip("#").strip().casefold()
+
+
+def match_topic(value: Any, headings: Sequence[str]) -> str | None:
+    """Сопоставляет ответ модели одному из заголовков (без учёта регистра, кавычек и нумерации)."""
+    if isinstance(value, str) and value in headings:
+        return value
+    wanted = _normalize_topic(value)
+    if not wanted:
+        return None
+    for heading in headings:
+        if _normalize_topic(heading) == wanted:
+            return heading
+    return None
+
+
+@dataclass
+class TopicClassifier:
+    """
+    Настройки шага классификации.
+
+    Args:
+        mode: "single", "batch" или "lexical"
+        batch_size: Сколько чанков классифицируется одним вызовом в режиме "batch"
+        classify_by: Что отправлять в LLM в режимах "single"/"batch": "chunk" (полный текст)
+            или "gist" (выжимка; пустая выжимка заменяется чанком)
+        embedder: Для режима "lexical" — функция эмбеддингов вместо tf-idf по основам слов
+        stem_length: Длина грубой основы слова для tf-idf
+    """
+
+    mode: str = "single"
+    batch_size: int = 8
+    classify_by: str = "chunk"
+    embedder: Embedder | None = None
+    stem_length: int = 5
+
+    def __post_init__(self) -> None:
+        if self.mode not in CLASSIFY_MODES:
+            raise ValueError(f"mode должен быть одним из {CLASSIFY_MODES}, получено {self.mode!r}")
+        if self.classify_by not in CLASSIFY_INPUTS:
+            raise ValueError(f"classify_by должен быть одним из {CLASSIFY_INPUTS}, получено {self.classify_by!r}")
+        self.batch_size = max(1, int(self.batch_size))
+
+    def classify(
+        self,
+        runtime: SummaryRuntime,
+        parent_headings: list[str],
+        headings: list[str],
+        chunks: list[str],
+        gists: list[str],
+        priority: Slot = (),
+    ) -> tuple[list[str | None], int]:
+        """
+        Возвращает тему для каждого чанка (None — не удалось определить) и число
+        последовательных раундов LLM-вызовов (для оценки критического пути).
+        `priority` — позиция раздела для очереди `SummaryRuntime`.
+        """
+        if not chunks:
+            return [], 0
+        if self.mode == "lexical":
+            return self._classify_lexical(headings, chunks, gists), 0
+
+        items = chunks
+        if self.classify_by == "gist":
+            items = [g if g and g.strip() else c for g, c in zip(gists, chunks)]
+        if self.mode == "batch":
+            return self._classify_batched(runtime, parent_headings, headings, items, priority)
+
+        inputs = [
+            {"parent_headings": parent_headings, "chunk": item, "content_headings": headings} for item in items
+        ]
+        preds = runtime.map(dspy.ChainOfThought(ChunkTopicSignature), inputs, priority, step="classify")
+        return [match_topic(getattr(p, "topic", None), headings) for p in preds], 1
+
+    def _classify_batched(
+        self,
+        runtime: SummaryRuntime,
+        parent_headings: list[str],
+        headings: list[str],
+        items: list[str],
+        priority: Slot = (),
+    ) -> tuple[list[str | None], int]:
+        predictor = dspy.ChainOfThought(BatchChunkTopicSignature)
+        topics: list[str | None] = [None] * len(items)
+        pending = [list(range(i, min(i + self.batch_size, len(items)))) for i in range(0, len(items), self.batch_size)]
+        rounds = 0
+
+        while pending:
+            rounds += 1
+            inputs = [
+                {
+                    "parent_headings": parent_headings,
+                    "chunks": [f"[{k + 1}] {items[idx]}" for k, idx in enumerate(batch)],
+                    "content_headings": headings,
+                }
+                for batch in pending
+            ]
+            preds = runtime.map(predictor, inputs, priority, step="classify")
+
+            retry: list[list[int]] = []
+            for batch, pred in zip(pending, preds):
+                raw = getattr(pred, "topics", None) if pred is not None else None
+                if not isinstance(raw, (list, tuple)) or len(raw) != len(batch):
+                    got = len(raw) if isinstance(raw, (list, tuple)) else "нет ответа"
+                    if len(batch) > 1:
+                        mid = len(batch) // 2
+                        logger.warning(
+                            "[BATCH_SPLIT] Некорректный ответ на пачку из %s чанков (%s) — делю на %s+%s",
+                            len(batch),
+                            got,
+                            mid,
+                            len(batch) - mid,
+                        )
+                        retry.extend([batch[:mid], batch[mid:]])
+                    else:
+                        logger.warning("[BATCH_FAIL] Не удалось классифицировать чанк %s (%s)", batch[0], got)
+                    continue
+                for idx, value in zip(batch, raw):
+                    topics[idx] = match_topic(value, headings)
+            pending = retry
+
+        return topics, rounds
+
+    def _classify_lexical(self, headings: list[str], chunks: list[str], gists: list[str]) -> list[str | None]:
+        items = [g if g and g.strip() else c for g, c in zip(gists, chunks)]
+        if self.embedder is not None:
+            vectors = np.asarray(self.embedder(list(headings) + items), dtype=float)
+            heading_vecs, item_vecs = vectors[: len(headings)], vectors[len(headings) :]
+        else:
+            heading_vecs, item_vecs = self._tfidf(headings, items)
+
+        heading_vecs = heading_vecs / np.maximum(np.linalg.norm(heading_vecs, axis=1, keepdims=True), 1e-12)
+        item_vecs = item_vecs / np.maximum(np.linalg.norm(item_vecs, axis=1, keepdims=True), 1e-12)
+        scores = item_vecs @ heading_vecs.T
+
+        topics: list[str | None] = []
+        previous: str | None = None
+        for row in scores:
+            if row.size and row.max() > 0:
+                previous = headings[int(row.argmax())]
+            # без общих слов чанк остаётся в теме предыдущего (документ идёт по порядку)
+            topics.append(previous)
+        return topics
+
+    def _tfidf(self, headings: list[str], items: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        docs = [lexical_terms(t, self.stem_length) for t in list(headings) + items]
+        vocab: dict[str, int] = {}
+        for doc in docs:
+            for term in doc:
+                vocab.setdefault(term, len(vocab))
+        counts = np.zeros((len(docs), max(1, len(vocab))))
+        for row, doc in enumerate(docs):
+            for term in doc:
+                counts[row, vocab[term]] += 1
+
+        df = (counts[len(headings) :] > 0).sum(axis=0)
+        idf = np.log((1 + len(items)) / (1 + df)) + 1.0
+        weighted = counts * idf
+        return weighted[: len(headings)], weighted[len(headings) :]
@@ -12,7 +12,10 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from module_semantic_parallel_splitter.config import configure_module_llm
 
-from .module import summarize_text
+from .budget import SummaryBudget
+from .classify import TopicClassifier
+from .module import iter_summarize_text, summarize_text
+from .tiers import ModelTiers
 
 
 def load_dataset_text(file_path: str, limit: int) -> str:
@@ -46,25 +49,84 @@ def main() -> int:
         help="Корневой заголовок для результата",
     )
     parser.add_argument("--max-chunk-size", type=int, default=3000)
-    parser.add_argument("--num-threads", type=int, default=4)
+    parser.add_argument(
+        "--max-chunk-tokens",
+        type=int,
+        default=None,
+        help="Размер чанков сплиттера в токенах (вместо --max-chunk-size)",
+    )
+    parser.add_argument(
+        "--num-threads",
+        type=lambda v: "auto" if v.strip().lower() == "auto" else int(v),
+        default=4,
+        help="Число потоков или auto (адаптивный лимит параллелизма LM)",
+    )
     parser.add_argument("--max-depth", type=int, default=3)
     parser.add_argument("--output-file", default="summary.md", help="Путь к файлу для сохранения результата")
     parser.add_argument("--min-chunk-len", type=int, default=100)
     parser.add_argument("--max-resplit-iters", type=int, default=3)
+    parser.add_argument("--cache", default=None, help="Путь к SQLite-кэшу ответов SemanticHalver")
+    parser.add_argument(
+        "--gist-context",
+        choices=["exact", "delta"],
+        default="exact",
+        help="exact — пересчёт выжимки при смене заголовков; delta — одна выжимка на чанк для всех уровней",
+    )
+    parser.add_argument(
+        "--classify-mode",
+        choices=["single", "batch", "lexical"],
+        default="single",
+        help="Классификация чанков: вызов на чанк, пачками по --classify-batch-size или локально без LLM",
+    )
+    parser.add_argument("--classify-batch-size", type=int, default=8)
+    parser.add_argument("--classify-by", choices=["chunk", "gist"], default="chunk")
+    parser.add_argument(
+        "--state",
+        default=None,
+        help="JSON-состояние прошлого прогона: пересчитываются только изменившиеся чанки и разделы",
+    )
+    parser.add_argument("--run-dir", default=None, help="Директория запуска с контрольными точками по шагам")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Продолжить прерванный прогон из --run-dir (тот же текст и настройки)",
+    )
+    parser.add_argument("--stream", action="store_true", help="Печатать разделы по мере готовности")
+    parser.add_argument(
+        "--fast-model",
+        default=None,
+        help="Модель для выжимок и классификации (оглавление и разделы — основная модель)",
+    )
+    parser.add_argument("--max-tokens", type=int, default=None, help="Бюджет токенов суммаризации")
+    parser.add_argument("--max-cost", type=float, default=None, help="Бюджет стоимости суммаризации, $")
+    parser.add_argument(
+        "--price",
+        default=None,
+        help="Цены за 1M токенов 'prompt,completion' (для --max-cost; одинаковые для всех моделей)",
+    )
     args = parser.parse_args()
 
-    configure_module_llm(use_global_config=True)
+    lm = configure_module_llm(use_global_config=True)
+    tiers = ModelTiers.fast_and_strong(lm.copy(model=args.fast_model), lm) if args.fast_model else None
+
+    budget = None
+    if args.max_tokens is not None or args.max_cost is not None:
+        prices = {}
+        if args.price:
+            prompt_price, completion_price = (float(x) for x in args.price.split(","))
+            prices = {tier: (prompt_price, completion_price) for tier in ("default", "fast", "strong")}
+        budget = SummaryBudget(max_tokens=args.max_tokens, max_cost=args.max_cost, prices=prices)
 
     input_text = load_dataset_text(args.chunks_file, args.limit)
     if not input_text.strip():
         print("Пустой текст для обработки.")
         return 1
 
-    summary = summarize_text(
-        input_text,
+    summarize_kwargs = dict(
         parent_heading=args.parent_heading,
         splitter_kwargs={
             "max_chunk_size": args.max_chunk_size,
+            "max_chunk_tokens": args.max_chunk_tokens,
             "num_threads": args.num_threads,
             "min_chunk_len": args.min_chunk_len,
             "max_resplit_iters": args.max_resplit_iters,
@@ -72,8 +134,26 @@ def main() -> int:
         num_threads=args.num_threads,
         max_depth=args.max_depth,
         output_path=args.output_file,
+        cache_path=args.cache,
+        gist_heading_context=args.gist_context,
+        classifier=TopicClassifier(
+            mode=args.classify_mode,
+            batch_size=args.classify_batch_size,
+            classify_by=args.classify_by,
+        ),
+        state_path=args.state,
+        run_dir=args.run_dir,
+        resume=args.resume,
+        tiers=tiers,
+        budget=budget,
     )
 
+    if args.stream:
+        for section in iter_summarize_text(input_text, **summarize_kwargs):
+            print(section, end="\n\n", flush=True)
+        return 0
+
+    summary = summarize_text(input_text, **summarize_kwargs)
     print(summary)
     return 0
 
@@ -0,0 +1,138 @@
+"""
+Мемоизация выжимок (GistSignature) между уровнями рекурсии суммаризатора.
+
+На каждом уровне `structure_and_summarize` выжимки нужны для тех же чанков, что
+и уровнем выше, — меняется только `parent_headings`. `GistStore` хранит выжимку
+по sha256 текста чанка (и цепочки заголовков), так что одинаковые запросы не
+пересчитываются.
+
+Режимы контекста заголовков:
+    "exact" (по умолчанию) — ключ по чанку и цепочке заголовков: выжимка на
+        каждом уровне учитывает свою цепочку заголовков, как без мемоизации;
+        не пересчитываются только одинаковые пары (чанк, заголовки).
+    "delta" — ключ только по чанку: выжимка, полученная на первом уровне, где
+        встретился чанк, переиспользуется глубже. Вызовов GistSignature —
+        по одному на чанк вместо одного на чанк и уровень, но выжимки вложенных
+        уровней не отражают их заголовки; контекст текущей секции добавляется
+        "дельтой" — шаги заголовков и классификации и так получают актуальные
+        `parent_headings` вместе с выжимками.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+from collections.abc import Callable, Sequence
+from concurrent.futures import Future
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+HEADING_CONTEXT_MODES = ("delta", "exact")
+
+
+class GistStore:
+    """Потокобезопасное хранилище выжимок чанков с дедупликацией одновременных запросов."""
+
+    def __init__(self, heading_context: str = "exact"):
+        if heading_context not in HEADING_CONTEXT_MODES:
+            raise ValueError(f"heading_context должен быть одним из {HEADING_CONTEXT_MODES}, получено {heading_context!r}")
+        self.heading_context = heading_context
+        self._lock = threading.Lock()
+        self._gists: dict[str, str] = {}
+        self._pending: dict[str, Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def chunk_key(chunk: str) -> str:
+        return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+    def key(self, chunk: str, parent_headings: Sequence[str]) -> str:
+        if self.heading_context == "delta":
+            return self.chunk_key(chunk)
+        payload = json.dumps({"chunk": chunk, "headings": list(parent_headings)}, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, chunk: str, parent_headings: Sequence[str] = ()) -> str | None:
+        with self._lock:
+            return self._gists.get(self.key(chunk, parent_headings))
+
+    def put(self, chunk: str, gist: str, parent_headings: Sequence[str] = ()) -> None:
+        with self._lock:
+            self._gists[self.key(chunk, parent_headings)] = gist
+
+    def snapshot(self) -> dict[str, str]:
+        with self._lock:
+            return dict(self._gists)
+
+    def update(self, gists: dict[str, str]) -> None:
+        """Добавляет готовые выжимки (например, из состояния прошлого прогона)."""
+        with self._lock:
+            self._gists.update(gists)
+
+    def resolve(
+        self,
+        parent_headings: Sequence[str],
+        chunks: Sequence[str],
+        produce: Callable[[list[dict[str, Any]]], list[Any]],
+    ) -> list[str]:
+        """
+        Возвращает выжимки для chunks (в том же порядке), вызывая `produce` только для отсутствующих.
+
+        `produce` получает список входов GistSignature и возвращает предсказания в том же
+        порядке (None — ошибка вызова). Неудачные выжимки не сохраняются и будут
+        запрошены повторно на следующем уровне; вместо них возвращается пустая строка.
+        """
+        keys = [self.key(c, parent_headings) for c in chunks]
+        waiting: dict[str, Future] = {}
+        owned: dict[str, Future] = {}
+        to_produce: list[tuple[str, str]] = []
+        with self._lock:
+            for key, chunk in zip(keys, chunks):
+                if key in self._gists or key in waiting or key in owned:
+                    self.hits += 1
+                    continue
+                if key in self._pending:
+                    # ту же выжимку прямо сейчас считает другая ветка рекурсии
+                    self.hits += 1
+                    waiting[key] = self._pending[key]
+                    continue
+                self.misses += 1
+                future: Future = Future()
+                self._pending[key] = future
+                owned[key] = future
+                to_produce.append((key, chunk))
+
+        if to_produce:
+            inputs = [{"parent_headings": list(parent_headings), "chunk": chunk} for _, chunk in to_produce]
+            try:
+                preds = produce(inputs)
+            except BaseException as e:
+                with self._lock:
+                    for key in owned:
+                        self._pending.pop(key, None)
+                for future in owned.values():
+                    future.set_exception(e)
+                raise
+            with self._lock:
+                for (key, _), pred in zip(to_produce, preds):
+                    gist = getattr(pred, "gist", None) if pred is not None else None
+                    if gist:
+                        self._gists[key] = str(gist)
+                    self._pending.pop(key, None)
+                    owned[key].set_result(str(gist or ""))
+
+        resolved: dict[str, str] = {key: future.result() for key, future in owned.items()}
+        for key, future in waiting.items():
+            try:
+                resolved[key] = future.result()
+            except Exception:
+                resolved[key] = ""
+        with self._lock:
+            return [resolved.get(key, self._gists.get(key, "")) for key in keys]
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._gists)}
@@ -0,0 +1,243 @@
+"""
+Состояние прошлого прогона для инкрементальной пересуммаризации.
+
+После прогона `summarize_text(..., state_path=...)` в JSON сохраняются границы
+чанков (с текстом и sha256), выжимки и для каждого раздела (узла рекурсии,
+ключ — цепочка заголовков) — хэши его чанков, заголовки оглавления, темы чанков
+и готовый markdown. При следующем прогоне по исправленному тексту:
+
+- неизменённые чанки находятся в новом тексте по порядку — каждый у прежнего
+  смещения с поправкой на сдвиг от правок выше, в окне `SEARCH_WINDOW` вокруг
+  него — и не делятся заново; сплиттер запускается только на промежутках
+  между ними;
+- выжимки берутся по хэшу чанка;
+- раздел с тем же составом чанков переиспользуется целиком вместе с поддеревом;
+- в изменившемся разделе сохраняются прежние заголовки (если изменилась не
+  слишком большая доля чанков) и темы известных чанков, классифицируются только
+  новые, а пересчитываются лишь подразделы, чей состав изменился.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+from .gists import GistStore
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class NodeRecord:
+    """
+    Результат одного раздела.
+
+    Args:
+        chunks: sha256 чанков раздела в порядке документа
+        output: Готовый markdown раздела (вместе с подразделами)
+        headers: Заголовки следующего уровня (пусто для базового случая)
+        topics: Тема каждого чанка по его хэшу
+    """
+
+    chunks: list[str]
+    output: str
+    headers: list[str] = field(default_factory=list)
+    topics: dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class ChunkRecord:
+    start: int
+    end: int
+    hash: str
+    text: str
+
+
+class SummaryMemo:
+    """
+    Прошлое состояние (только чтение) и новое состояние, собираемое во время прогона.
+
+    Args:
+        previous: Содержимое файла состояния прошлого прогона (или None)
+        settings: Параметры, от которых зависят разделы (глубина, режим классификации...);
+            при несовпадении с прошлым прогоном разделы не переиспользуются
+        max_changed_fraction: Максимальная доля новых чанков в разделе, при которой
+            сохраняются прежние заголовки оглавления
+    """
+
+    VERSION = 1
+    # на сколько символов от ожидаемого места ищется прошлый чанк
+    SEARCH_WINDOW = 4096
+    # поисков по всему остатку текста (после правки больше окна) — только для длинных уникальных чанков
+    MAX_RESYNCS = 8
+    RESYNC_MIN_CHARS = 200
+
+    def __init__(
+        self,
+        previous: dict[str, Any] | None = None,
+        settings: dict[str, Any] | None = None,
+        max_changed_fraction: float = 0.3,
+    ):
+        previous = previous or {}
+        self.settings = settings or {}
+        self.max_changed_fraction = max(0.0, float(max_changed_fraction))
+        self._lock = threading.Lock()
+
+        self.previous_chunks = [ChunkRecord(**c) for c in previous.get("chunks", [])]
+        self.previous_splitter = previous.get("splitter")
+        self.previous_gists: dict[str, str] = dict(previous.get("gists", {}))
+        self.previous_gist_context = previous.get("gist_heading_context")
+        self.previous_nodes: dict[str, NodeRecord] = {}
+        if previous.get("settings") == self.settings:
+            self.previous_nodes = {k: NodeRecord(**v) for k, v in previous.get("nodes", {}).items()}
+        elif previous:
+            logger.info("[MEMO] Настройки суммаризации изменились — разделы будут пересчитаны")
+
+        self.chunks: list[ChunkRecord] = []
+        self.nodes: dict[str, NodeRecord] = {}
+        self.reused_nodes = 0
+
+    @classmethod
+    def load(cls, path: str, **kwargs: Any) -> "SummaryMemo":
+        """Читает состояние; отсутствующий или несовместимый файл даёт пустое состояние."""
+        previous: dict[str, Any] | None = None
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == cls.VERSION:
+                    previous = data
+                else:
+                    logger.warning("[MEMO] Неподдерживаемая версия состояния в %s — полный пересчёт", path)
+            except (OSError, ValueError, TypeError) as e:
+                logger.warning("[MEMO] Не удалось прочитать состояние %s: %s — полный пересчёт", path, e)
+        return cls(previous, **kwargs)
+
+    def save(self, path: str, splitter: dict[str, Any], gists: GistStore) -> None:
+        """Атомарно записывает новое состояние (через временный файл)."""
+        snapshot = gists.snapshot()
+        if gists.heading_context == "delta":
+            # ключи выжимок — хэши чанков: оставляем только актуальные
+            live = {c.hash for c in self.chunks}
+            snapshot = {k: v for k, v in snapshot.items() if k in live}
+        with self._lock:
+            data = {
+                "version": self.VERSION,
+                "settings": self.settings,
+                "splitter": splitter,
+                "chunks": [asdict(c) for c in self.chunks],
+                "gist_heading_context": gists.heading_context,
+                "gists": snapshot,
+                "nodes": {k: asdict(v) for k, v in self.nodes.items()},
+            }
+        path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    # --- чанки ---
+
+    def diff_chunks(self, text: str, splitter: dict[str, Any]) -> list[tuple[int, int, bool]]:
+        """
+        Покрытие нового текста: (start, end, reused) по порядку.
+
+        reused=True — прошлый чанк, найденный в тексте без изменений; reused=False —
+        промежуток, который нужно разделить сплиттером заново (может быть пробельным).
+        """
+        if not self.previous_chunks or self.previous_splitter != splitter:
+            return [(0, len(text), False)]
+
+        counts = Counter(chunk.hash for chunk in self.previous_chunks)
+        plan: list[tuple[int, int, bool]] = []
+        cursor = 0
+        # сдвиг нового текста относительно прошлого у последнего найденного чанка
+        delta = 0
+        resyncs = 0
+        for chunk in self.previous_chunks:
+            pos = self._locate(text, chunk.text, chunk.start + delta, cursor)
+            if (
+                pos is None
+                and resyncs < self.MAX_RESYNCS
+                and counts[chunk.hash] == 1
+                and len(chunk.text) >= self.RESYNC_MIN_CHARS
+            ):
+                resyncs += 1
+                found = text.find(chunk.text, cursor)
+                pos = found if found >= 0 else None
+            if pos is None:
+                continue
+            if pos > cursor:
+                plan.append((cursor, pos, False))
+            plan.append((pos, pos + len(chunk.text), True))
+            cursor = pos + len(chunk.text)
+            delta = pos - chunk.start
+        if cursor < len(text):
+            plan.append((cursor, len(text), False))
+        return plan
+
+    def _locate(self, text: str, needle: str, expected: int, cursor: int) -> int | None:
+        """Вхождение `needle` не раньше `cursor`, ближайшее к `expected`, в окне `SEARCH_WINDOW`."""
+        if expected >= cursor and text.startswith(needle, expected):
+            return expected
+        lo = max(cursor, expected - self.SEARCH_WINDOW)
+        hi = min(len(text), expected + len(needle) + self.SEARCH_WINDOW)
+        best: int | None = None
+        pos = text.find(needle, lo, hi)
+        while pos >= 0:
+            if best is None or abs(pos - expected) < abs(best - expected):
+                best = pos
+            elif pos > expected:
+                # дальше вхождения только удаляются от ожидаемого места
+                break
+            pos = text.find(needle, pos + 1, hi)
+        return best
+
+    def set_chunks(self, text: str, offsets: list[tuple[int, int]]) -> None:
+        self.chunks = [
+            ChunkRecord(start, end, GistStore.chunk_key(text[start:end]), text[start:end]) for start, end in offsets
+        ]
+
+    def seed_gists(self, gists: GistStore) -> None:
+        """Переносит прошлые выжимки в хранилище (если совпадает режим контекста заголовков)."""
+        if self.previous_gists and self.previous_gist_context == gists.heading_context:
+            gists.update(self.previous_gists)
+
+    # --- разделы ---
+
+    @staticmethod
+    def node_key(parent_headings: list[str]) -> str:
+        return "\n".join(parent_headings)
+
+    def previous_node(self, parent_headings: list[str]) -> NodeRecord | None:
+        return self.previous_nodes.get(self.node_key(parent_headings))
+
+    def record(self, parent_headings: list[str], node: NodeRecord) -> None:
+        with self._lock:
+            self.nodes[self.node_key(parent_headings)] = node
+
+    def reuse_subtree(self, parent_headings: list[str]) -> None:
+        """Переносит в новое состояние раздел и все его подразделы из прошлого прогона."""
+        key = self.node_key(parent_headings)
+        with self._lock:
+            for k, node in self.previous_nodes.items():
+                if k == key or k.startswith(key + "\n"):
+                    self.nodes[k] = node
+            self.reused_nodes += 1
+
+    def adopt(self, nodes: dict[str, NodeRecord]) -> None:
+        """Добавляет в новое состояние готовые разделы (например, из контрольной точки)."""
+        with self._lock:
+            self.nodes.update(nodes)
+
+    def can_reuse_headers(self, previous: NodeRecord, chunk_hashes: list[str]) -> bool:
+        if not previous.headers or not chunk_hashes:
+            return False
+        known = set(previous.chunks)
+        changed = sum(1 for h in chunk_hashes if h not in known)
+        return changed / len(chunk_hashes) <= self.max_changed_fraction
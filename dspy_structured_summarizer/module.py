@@ -2,23 +2,39 @@
 
 from __future__ import annotations
 
+import contextvars
 import json
 import logging
 import os
+import queue
 import re
+import threading
+from contextlib import nullcontext
+from dataclasses import dataclass
+from functools import partial
+from collections.abc import Callable, Iterator
 from typing import Any
 
 import dotenv
 import dspy
 
-from module_semantic_parallel_splitter.module import SemanticParallelSplitter
+from module_semantic_parallel_splitter.cache import HalverCache
+from module_semantic_parallel_splitter.module import SemanticHalver, SemanticParallelSplitter
 
+from .budget import SummaryBudget
+from .checkpoint import RunCheckpoint
+from .classify import TopicClassifier
+from .gists import GistStore
+from .incremental import NodeRecord, SummaryMemo
+from .planner import SummaryPlanner, log_plan
+from .runtime import Slot, SummaryRuntime
 from .signatures import (
-    ChunkTopicSignature,
     ContentHeadingsSignature,
     GistSignature,
     SubsectionSignature,
 )
+from .streaming import SECTION_SEPARATOR, OrderedSectionBuffer
+from .tiers import ModelTiers
 
 logger = logging.getLogger(__name__)
 
@@ -77,7 +93,7 @@ def configure_module_llm(
     api_key: str | None = None,
     use_global_config: bool = True,
     **kwargs: Any,
-) -> dspy.LM:
+) -> dspy.BaseLM:
     """Настройка LLM для структурированного суммаризатора."""
 
     dotenv.load_dotenv()
@@ -105,7 +121,9 @@ def configure_module_llm(
             "или задайте глобальные `OPENROUTER_*` переменные и вызовите `configure_module_llm(use_global_config=True)`."
         )
 
-    lm = dspy.LM(model=model, api_base=api_base, api_key=api_key, **kwargs)
+    from config.registry import get_registry
+
+    lm = get_registry().register("structured_summarizer", model=model, api_base=api_base, api_key=api_key, **kwargs)
     dspy.configure(lm=lm)
     logger.info("Module LLM configured: %s", lm.model)
     return lm
@@ -127,41 +145,191 @@ def _normalize_headings(parent_headings: list[str] | None) -> list[str]:
 
 
 def _parallel_predict(
+    runtime: SummaryRuntime,
     predictor: dspy.Module,
     inputs_list: list[dict[str, Any]],
-    input_fields: list[str],
-    num_threads: int,
+    priority: Slot = (),
+    step: str = "",
 ) -> list[Any]:
     if not inputs_list:
         return []
+    return runtime.map(predictor, inputs_list, priority, step)
 
-    examples = [
-        dspy.Example(**inputs).with_inputs(*input_fields) for inputs in inputs_list
-    ]
-    exec_pairs = [(predictor, ex) for ex in examples]
-    parallel = dspy.Parallel(
-        num_threads=max(1, int(num_threads)),
-        max_errors=len(exec_pairs),
-        provide_traceback=True,
-    )
-    results = parallel(exec_pairs)
 
-    preds: list[Any] = []
-    for item in results:
-        if isinstance(item, tuple) and len(item) == 2:
-            preds.append(item[0])
-        else:
-            preds.append(item)
-    return preds
+def _write_subsection(
+    runtime: SummaryRuntime,
+    parent_headings: list[str],
+    chunks: list[str],
+    priority: Slot = (),
+) -> str:
+    return runtime.call(
+        dspy.ChainOfThought(SubsectionSignature),
+        priority=priority,
+        step="subsection",
+        parent_headings=parent_headings,
+        content_chunks=chunks,
+    ).subsection
+
+
+@dataclass
+class _RunContext:
+    """Общие для всех уровней рекурсии объекты одного прогона."""
+
+    runtime: SummaryRuntime
+    gists: GistStore
+    classifier: TopicClassifier
+    max_depth: int
+    memo: SummaryMemo | None = None
+    checkpoint: RunCheckpoint | None = None
+    sections: OrderedSectionBuffer | None = None
+    base_case_size: int = 4
+
+    def finish(self, slot: Slot, output: str) -> str:
+        """Раздел в позиции slot готов целиком — передаёт его в упорядоченный вывод."""
+        if self.sections is not None:
+            self.sections.resolve(slot, output)
+        return output
+
+    def remember(self, parent_headings: list[str], node: NodeRecord) -> None:
+        if self.memo is not None:
+            self.memo.record(parent_headings, node)
+        if self.checkpoint is not None:
+            self.checkpoint.save_section(parent_headings, node)
 
 
 def structure_and_summarize(
     parent_headings: list[str],
     chunks: list[str],
     *,
-    num_threads: int = 40,
+    num_threads: int | str = 40,
     max_depth: int = 3,
+    runtime: SummaryRuntime | None = None,
+    gists: GistStore | None = None,
+    classifier: TopicClassifier | None = None,
+    memo: SummaryMemo | None = None,
+    checkpoint: RunCheckpoint | None = None,
+    on_section: Callable[[str], None] | None = None,
+    tiers: ModelTiers | None = None,
+    base_case_size: int = 4,
+    budget: SummaryBudget | None = None,
 ) -> str:
+    """
+    Рекурсивно структурирует и суммирует чанки в markdown.
+
+    Соседние разделы обрабатываются параллельно; все LLM-вызовы всех уровней идут
+    через один `SummaryRuntime` с общим лимитом `num_threads`. Если runtime не
+    передан, он создаётся на время вызова. Статистика (число вызовов, длина
+    критического пути) пишется в лог и доступна в `runtime.stats`.
+
+    Выжимки чанков мемоизируются в `gists` (по умолчанию — новый `GistStore` на
+    вызов), поэтому одинаковые выжимки не пересчитываются. Режим
+    классификации чанков по заголовкам задаётся `classifier` (по умолчанию —
+    вызов LLM на каждый чанк). С `memo` разделы прошлого прогона с тем же
+    составом чанков переиспользуются, а результаты записываются в новое состояние.
+    С `checkpoint` каждый готовый шаг пишется в директорию запуска, а уже
+    сохранённые там выжимки, заголовки, темы и разделы не пересчитываются.
+
+    `on_section` получает фрагменты итогового markdown в порядке документа, как
+    только готовы все предшествующие разделы; склейка фрагментов через "\n\n"
+    совпадает с возвращаемым текстом.
+
+    `tiers` назначает шагам разные LM (используется при создании runtime; у
+    переданного runtime уровни задаются в его конструкторе).
+
+    Раздел из не более чем `base_case_size` чанков пишется одним вызовом без
+    разбиения. `budget` ограничивает фактический расход создаваемого runtime:
+    по его исчерпании новые вызовы не ставятся и прогон завершается
+    `BudgetExceededError` (подбор параметров под бюджет — `SummaryPlanner`).
+    """
+    gists = gists if gists is not None else GistStore()
+    classifier = classifier if classifier is not None else TopicClassifier()
+    if checkpoint is not None:
+        gists.update(checkpoint.gists)
+    sections = OrderedSectionBuffer(on_section) if on_section is not None else None
+    if runtime is not None:
+        ctx = _RunContext(runtime, gists, classifier, max_depth, memo, checkpoint, sections, base_case_size)
+        return _structure_with_context(ctx, parent_headings, chunks)
+    with SummaryRuntime(num_threads, tiers, budget) as own_runtime:
+        ctx = _RunContext(own_runtime, gists, classifier, max_depth, memo, checkpoint, sections, base_case_size)
+        return _structure_with_context(ctx, parent_headings, chunks)
+
+
+def _structure_with_context(ctx: _RunContext, parent_headings: list[str], chunks: list[str]) -> str:
+    runtime = ctx.runtime
+    try:
+        result, critical_path = _structure_and_summarize(ctx, parent_headings, chunks)
+    finally:
+        _log_spend(runtime)
+    runtime.stats.critical_path = max(runtime.stats.critical_path, critical_path)
+    logger.info(
+        "[STATS] Суммаризация: вызовов LLM=%s (ошибок %s), критический путь=%s раундов, "
+        "максимум одновременных вызовов=%s (лимит %s)",
+        runtime.stats.total_calls,
+        runtime.stats.failed_calls,
+        runtime.stats.critical_path,
+        runtime.stats.max_in_flight,
+        runtime.num_threads,
+    )
+    for model, metrics in sorted(runtime.concurrency_stats().items()):
+        logger.info(
+            "[CONCURRENCY] %s: лимит=%s (максимум одновременно %s), %.2f ответов/с, откатов=%s, перегрузок=%s",
+            model,
+            metrics["limit"],
+            metrics["max_in_flight"],
+            metrics["throughput"],
+            metrics["decreases"],
+            metrics["overloads"],
+        )
+    for tier, usage in sorted(runtime.stats.tiers.items()):
+        logger.info(
+            "[TIER] %s: вызовов=%s, prompt_tokens=%s, completion_tokens=%s",
+            tier,
+            usage["calls"],
+            usage["prompt_tokens"],
+            usage["completion_tokens"],
+        )
+    gist_stats = ctx.gists.stats()
+    logger.info(
+        "[GIST_STORE] Выжимки: посчитано=%s, переиспользовано=%s (режим %s)",
+        gist_stats["misses"],
+        gist_stats["hits"],
+        ctx.gists.heading_context,
+    )
+    if ctx.memo is not None:
+        logger.info("[MEMO] Переиспользовано разделов без изменений: %s", ctx.memo.reused_nodes)
+    return result
+
+
+def _log_spend(runtime: SummaryRuntime) -> None:
+    """Фактический расход против плана и бюджета."""
+    stats = runtime.stats
+    if runtime.budget is None and stats.plan is None:
+        return
+    planned = stats.plan or {}
+    logger.info(
+        "[BUDGET] Факт: вызовов=%s, токенов=%s, $%.4f; план: вызовов~%s, токенов~%s, $%.4f; бюджет: %s",
+        stats.total_calls,
+        stats.total_tokens,
+        stats.cost,
+        planned.get("calls", "-"),
+        planned.get("total_tokens", "-"),
+        planned.get("estimated_cost", 0.0),
+        runtime.budget.describe() if runtime.budget is not None else "-",
+    )
+
+
+def _structure_and_summarize(
+    ctx: _RunContext,
+    parent_headings: list[str],
+    chunks: list[str],
+    slot: Slot = (),
+) -> tuple[str, int]:
+    """
+    Возвращает markdown раздела и длину критического пути поддерева в раундах LLM-вызовов.
+
+    `slot` — позиция раздела в документе: приоритет его LLM-вызовов и место в упорядоченном выводе.
+    """
+    runtime = ctx.runtime
     logger.info(
         "Старт структурирования: chunks=%s, depth=%s",
         len(chunks or []),
@@ -172,39 +340,77 @@ def structure_and_summarize(
 
     if not chunks:
         logger.info("Пустые чанки — возвращаю только заголовки")
-        return "\n\n".join(parent_headings)
+        return ctx.finish(slot, "\n\n".join(parent_headings)), 0
+
+    hashes = [GistStore.chunk_key(c) for c in chunks]
+    previous = ctx.memo.previous_node(parent_headings) if ctx.memo is not None else None
+    if previous is not None and previous.chunks == hashes:
+        logger.info("[MEMO] Раздел '%s' не изменился — беру результат прошлого прогона", parent_headings[-1])
+        ctx.memo.reuse_subtree(parent_headings)
+        if ctx.checkpoint is not None:
+            ctx.checkpoint.save_section(parent_headings, previous)
+        return ctx.finish(slot, previous.output), 0
+    if ctx.checkpoint is not None:
+        done = ctx.checkpoint.section(parent_headings, hashes)
+        if done is not None:
+            logger.info("[CHECKPOINT] Раздел '%s' уже готов в директории запуска", parent_headings[-1])
+            if ctx.memo is not None:
+                ctx.memo.adopt(ctx.checkpoint.subtree(parent_headings))
+            return ctx.finish(slot, done.output), 0
 
     # 1) Базовый случай
-    if len(chunks) <= 4 or len(parent_headings) >= max_depth:
+    if len(chunks) <= ctx.base_case_size or len(parent_headings) >= ctx.max_depth:
         logger.info("Базовый случай — пишу раздел без разбиения")
-        return dspy.ChainOfThought(SubsectionSignature)(
-            parent_headings=parent_headings,
-            content_chunks=chunks,
-        ).subsection
+        output = _write_subsection(runtime, parent_headings, chunks, slot)
+        ctx.remember(parent_headings, NodeRecord(hashes, output))
+        return ctx.finish(slot, output), 1
 
     # 2) Выжимки по чанкам
     logger.info("Шаг 2: краткие выжимки по чанкам")
     produce_gist = dspy.Predict(GistSignature)
-    gist_inputs = [{"parent_headings": parent_headings, "chunk": c} for c in chunks]
-    chunk_gists = _parallel_predict(
-        produce_gist, gist_inputs, ["parent_headings", "chunk"], num_threads
-    )
-    gist_texts = [getattr(g, "gist", "") for g in chunk_gists]
+    gist_rounds: list[int] = []
+
+    def produce(inputs_list: list[dict[str, Any]]) -> list[Any]:
+        gist_rounds.append(1)
+        return _parallel_predict(runtime, produce_gist, inputs_list, slot, step="gist")
+
+    gist_texts = ctx.gists.resolve(parent_headings, chunks, produce)
+    if ctx.checkpoint is not None and gist_rounds:
+        ctx.checkpoint.save_gists(
+            {ctx.gists.key(c, parent_headings): g for c, g in zip(chunks, gist_texts)}
+        )
+    # раунд выжимок на критическом пути только если что-то действительно считалось
+    path = len(gist_rounds)
 
     # 3) Заголовки следующего уровня
-    logger.info("Шаг 3: генерация заголовков оглавления")
-    headers_result = dspy.ChainOfThought(ContentHeadingsSignature)(
-        parent_headings=parent_headings,
-        chunk_gists=gist_texts,
-    )
-    headers = _coerce_str_list(getattr(headers_result, "content_headings", None))
-    headers = [h.strip() for h in headers if isinstance(h, str) and h.strip()]
+    reuse_headers = previous is not None and ctx.memo.can_reuse_headers(previous, hashes)
+    saved_headers = ctx.checkpoint.headers(parent_headings) if ctx.checkpoint is not None else None
+    if saved_headers is not None:
+        logger.info("[CHECKPOINT] Шаг 3: заголовки раздела '%s' из директории запуска", parent_headings[-1])
+        headers = saved_headers
+    elif reuse_headers:
+        logger.info("[MEMO] Шаг 3: заголовки раздела '%s' из прошлого прогона", parent_headings[-1])
+        headers = list(previous.headers)
+    else:
+        logger.info("Шаг 3: генерация заголовков оглавления")
+        headers_result = runtime.call(
+            dspy.ChainOfThought(ContentHeadingsSignature),
+            priority=slot,
+            step="headings",
+            parent_headings=parent_headings,
+            chunk_gists=gist_texts,
+        )
+        headers = _coerce_str_list(getattr(headers_result, "content_headings", None))
+        headers = [h.strip() for h in headers if isinstance(h, str) and h.strip()]
+        path += 1
+        if ctx.checkpoint is not None:
+            ctx.checkpoint.save_headings(parent_headings, headers)
 
     if not headers:
         logger.info("Не удалось получить заголовки — fallback на прямое суммирование")
-        return dspy.ChainOfThought(SubsectionSignature)(
-            parent_headings=parent_headings, content_chunks=chunks
-        ).subsection
+        output = _write_subsection(runtime, parent_headings, chunks, slot)
+        ctx.remember(parent_headings, NodeRecord(hashes, output))
+        return ctx.finish(slot, output), path + 1
 
     # Если заголовков слишком мало — детерминированное разбиение по порядку чанков
     if len(headers) < 4 and len(chunks) >= 12:
@@ -215,61 +421,120 @@ def structure_and_summarize(
         )
         desired = min(10, max(4, (len(chunks) + 9) // 10))  # ~10 чанков на часть
         chunk_per_part = (len(chunks) + desired - 1) // desired
-        summarized_parts: list[str] = []
+        part_inputs: list[dict[str, Any]] = []
         for i in range(desired):
             part_chunks = chunks[i * chunk_per_part : (i + 1) * chunk_per_part]
             if not part_chunks:
                 continue
             heading = "#" * (len(parent_headings) + 1) + f" Часть {i+1}"
-            part = dspy.ChainOfThought(SubsectionSignature)(
-                parent_headings=parent_headings + [heading],
-                content_chunks=part_chunks,
-            ).subsection
-            summarized_parts.append(part)
-
-        return "\n\n".join([parent_headings[-1]] + summarized_parts)
-
-    # 4) Классификация чанков по темам
-    logger.info("Шаг 4: классификация чанков по заголовкам")
-    classify = dspy.ChainOfThought(ChunkTopicSignature)
-    classify_inputs = [
-        {"parent_headings": parent_headings, "chunk": c, "content_headings": headers}
-        for c in chunks
-    ]
-    topics = _parallel_predict(
-        classify,
-        classify_inputs,
-        ["parent_headings", "chunk", "content_headings"],
-        num_threads,
-    )
+            part_inputs.append(
+                {"parent_headings": parent_headings + [heading], "content_chunks": part_chunks}
+            )
+        parts = _parallel_predict(
+            runtime, dspy.ChainOfThought(SubsectionSignature), part_inputs, slot, step="subsection"
+        )
+        summarized_parts = [getattr(p, "subsection", "") or "" for p in parts]
+
+        output = "\n\n".join([parent_headings[-1]] + summarized_parts)
+        ctx.remember(parent_headings, NodeRecord(hashes, output, headers))
+        return ctx.finish(slot, output), path + 1
+
+    # 4) Классификация чанков по темам (при прежних заголовках — только новых чанков)
+    topics: list[str | None] = [None] * len(chunks)
+    known: dict[str, str] = dict(previous.topics) if reuse_headers else {}
+    if ctx.checkpoint is not None:
+        known.update(ctx.checkpoint.known_topics(parent_headings))
+    for i, h in enumerate(hashes):
+        if known.get(h) in headers:
+            topics[i] = known[h]
+    pending = [i for i, t in enumerate(topics) if t is None]
+    classify_rounds = 0
+    if pending:
+        logger.info(
+            "Шаг 4: классификация %s из %s чанков по заголовкам (режим %s)",
+            len(pending),
+            len(chunks),
+            ctx.classifier.mode,
+        )
+        classified, classify_rounds = ctx.classifier.classify(
+            runtime,
+            parent_headings,
+            headers,
+            [chunks[i] for i in pending],
+            [gist_texts[i] for i in pending],
+            priority=slot,
+        )
+        for i, topic in zip(pending, classified):
+            topics[i] = topic
+        if ctx.checkpoint is not None:
+            ctx.checkpoint.save_topics(
+                parent_headings, {hashes[i]: topic for i, topic in zip(pending, classified) if topic is not None}
+            )
 
     # 5) Группировка
     logger.info("Шаг 5: группировка чанков по разделам")
     sections: dict[str, list[str]] = {topic: [] for topic in headers}
-    for topic_pred, chunk in zip(topics, chunks):
-        topic = getattr(topic_pred, "topic", None)
+    assigned: dict[str, str] = {}
+    for topic, chunk, h in zip(topics, chunks, hashes):
         if topic not in sections:
             topic = headers[0]
         sections[topic].append(chunk)
+        assigned[h] = topic
 
-    # 6) Рекурсивное суммирование
+    # 6) Рекурсивное суммирование: соседние разделы — параллельно, порядок заголовков сохраняется
     logger.info("Шаг 6: рекурсивное суммирование секций")
     prefix = "#" * (len(parent_headings) + 1) + " "
-    summarized_sections: list[str] = []
-    for topic, section_chunks in sections.items():
-        if not section_chunks:
-            continue
-        summarized_sections.append(
-            structure_and_summarize(
-                parent_headings + [prefix + topic],
-                section_chunks,
-                num_threads=num_threads,
-                max_depth=max_depth,
-            )
-        )
+    non_empty = [(topic, section_chunks) for topic, section_chunks in sections.items() if section_chunks]
+    branches = [
+        partial(_structure_and_summarize, ctx, parent_headings + [prefix + topic], section_chunks, slot + (i,))
+        for i, (topic, section_chunks) in enumerate(non_empty)
+    ]
+    if ctx.sections is not None:
+        ctx.sections.expand(slot, parent_headings[-1], len(branches))
+    subtrees = runtime.run_branches(branches)
+    summarized_sections = [text for text, _ in subtrees]
+    subtree_path = max((sub_path for _, sub_path in subtrees), default=0)
 
     logger.info("Шаг 7: сбор итогового текста")
-    return "\n\n".join([parent_headings[-1]] + summarized_sections)
+    output = "\n\n".join([parent_headings[-1]] + summarized_sections)
+    ctx.remember(parent_headings, NodeRecord(hashes, output, headers, assigned))
+    # выжимки -> заголовки -> классификация -> самое длинное поддерево
+    return output, path + classify_rounds + subtree_path
+
+
+def _split_text(
+    splitter: SemanticParallelSplitter,
+    input_text: str,
+    splitter_kwargs: dict[str, Any],
+    memo: SummaryMemo | None,
+) -> list[tuple[int, int]]:
+    """Делит текст на чанки; с `memo` заново делятся только промежутки между неизменёнными чанками."""
+    plan = memo.diff_chunks(input_text, splitter_kwargs) if memo is not None else [(0, len(input_text), False)]
+    reused = sum(1 for _, _, kept in plan if kept)
+    if memo is not None and reused:
+        logger.info(
+            "[MEMO] Чанков без изменений: %s, промежутков для повторного деления: %s",
+            reused,
+            sum(1 for s, e, kept in plan if not kept and input_text[s:e].strip()),
+        )
+
+    offsets: list[tuple[int, int]] = []
+    for start, end, kept in plan:
+        if kept:
+            offsets.append((start, end))
+            continue
+        if not input_text[start:end].strip():
+            continue
+        split_result = splitter(input_text=input_text[start:end], **splitter_kwargs)
+        offsets.extend((start + s, start + e) for s, e in (getattr(split_result, "offsets", []) or []))
+        split_stats = getattr(split_result, "stats", {}) or {}
+        if splitter.halver.cache is not None:
+            logger.info(
+                "Кэш SemanticHalver: hits=%s, misses=%s",
+                split_stats.get("cache_hits", 0),
+                split_stats.get("cache_misses", 0),
+            )
+    return offsets
 
 
 def summarize_text(
@@ -277,27 +542,205 @@ def summarize_text(
     *,
     parent_heading: str = "Summary",
     splitter_kwargs: dict[str, Any] | None = None,
-    num_threads: int = 40,
+    num_threads: int | str = 40,
     max_depth: int = 3,
     output_path: str = "summary.md",
+    cache_path: str | None = None,
+    runtime: SummaryRuntime | None = None,
+    gist_heading_context: str = "exact",
+    classifier: TopicClassifier | None = None,
+    state_path: str | None = None,
+    run_dir: str | None = None,
+    resume: bool = False,
+    on_section: Callable[[str], None] | None = None,
+    tiers: ModelTiers | None = None,
+    budget: SummaryBudget | None = None,
+    planner: SummaryPlanner | None = None,
 ) -> str:
-    splitter = SemanticParallelSplitter()
+    """
+    Делит текст сплиттером, суммирует и записывает markdown в `output_path`.
+
+    С `state_path` прогон инкрементальный: состояние прошлого прогона (чанки,
+    выжимки, заголовки, темы, разделы) читается из файла, пересчитываются только
+    изменившиеся части, новое состояние записывается туда же.
+
+    С `run_dir` результаты каждого шага (чанки, выжимки, заголовки, темы, разделы)
+    сохраняются в директорию запуска по мере готовности; `resume=True` продолжает
+    прерванный прогон того же текста с теми же настройками с последней готовой
+    единицы работы.
+
+    Готовые разделы дописываются в `output_path + ".partial"` по мере готовности
+    в порядке документа (и передаются в `on_section`), так что частичный
+    результат виден до окончания прогона; `output_path` заменяется им только
+    после успешного прогона — прерванный прогон прежний результат не затирает.
+    См. также `iter_summarize_text`.
+
+    `gist_heading_context="delta"` переиспользует выжимку чанка на всех уровнях
+    рекурсии: меньше вызовов LLM, но выжимки вложенных уровней не учитывают их
+    заголовки; по умолчанию ("exact") выжимка считается для каждой цепочки
+    заголовков (см. `gists.GistStore`).
+
+    `tiers` назначает шагам суммаризации разные LM (сплиттер использует
+    глобальную LM); учёт вызовов и токенов по уровням пишется в лог.
+
+    `num_threads="auto"` — пул по верхней границе адаптивного контроллера
+    параллелизма LM (`config.concurrency`); число одновременных запросов к
+    провайдеру контроллер подбирает сам, метрики — в `runtime.stats.concurrency`.
+
+    С `budget` после деления текста `planner` (по умолчанию `SummaryPlanner()`)
+    оценивает расход по размерам чанков и подбирает глубину, порог базового
+    случая и режим классификации так, чтобы оценка уложилась в бюджет; во время
+    прогона фактический расход ограничен тем же бюджетом (деление текста
+    сплиттером в бюджет не входит). План и фактический расход — в `runtime.stats`.
+    """
+    halver_cache = HalverCache(cache_path) if cache_path else None
+    splitter = SemanticParallelSplitter(SemanticHalver(cache=halver_cache))
     splitter_kwargs = splitter_kwargs or {}
-    split_result = splitter(input_text=input_text, **splitter_kwargs)
-    chunks = getattr(split_result, "segments", []) or []
+    classifier = classifier if classifier is not None else TopicClassifier()
+    gists = GistStore(gist_heading_context)
+
+    memo: SummaryMemo | None = None
+    if state_path:
+        settings = {
+            "parent_heading": parent_heading,
+            "max_depth": max_depth,
+            "classifier": classifier.mode,
+            "tiers": tiers.describe() if tiers is not None else {},
+            "budget": budget.describe() if budget is not None else {},
+        }
+        memo = SummaryMemo.load(state_path, settings=settings)
+        memo.seed_gists(gists)
+
+    checkpoint: RunCheckpoint | None = None
+    if run_dir:
+        fingerprint = RunCheckpoint.make_fingerprint(
+            input_text,
+            {
+                "parent_heading": parent_heading,
+                "splitter": splitter_kwargs,
+                "max_depth": max_depth,
+                "gist_heading_context": gist_heading_context,
+                "classifier": [classifier.mode, classifier.batch_size, classifier.classify_by],
+                "tiers": tiers.describe() if tiers is not None else {},
+                "budget": budget.describe() if budget is not None else {},
+            },
+        )
+        checkpoint = RunCheckpoint(run_dir, fingerprint, resume=resume)
+
+    if checkpoint is not None and checkpoint.splits is not None:
+        logger.info("[CHECKPOINT] Чанки взяты из директории запуска: %s", len(checkpoint.splits))
+        offsets = checkpoint.splits
+    else:
+        offsets = _split_text(splitter, input_text, splitter_kwargs, memo)
+        if checkpoint is not None:
+            checkpoint.save_splits(offsets)
+    chunks = [input_text[s:e] for s, e in offsets]
+
+    base_case_size = 4
+    plan = None
+    if budget is not None:
+        planner = planner if planner is not None else SummaryPlanner()
+        plan = planner.plan(
+            chunks,
+            budget,
+            max_depth=max_depth,
+            base_case_size=base_case_size,
+            classifier=classifier,
+            tiers=tiers if runtime is None else runtime.tiers,
+            gists_once=gist_heading_context == "delta",
+        )
+        log_plan(plan)
+        max_depth, base_case_size, classifier = plan.max_depth, plan.base_case_size, plan.classifier
+    own_runtime = runtime is None and plan is not None
+    if own_runtime:
+        runtime = SummaryRuntime(num_threads, tiers, budget)
+    if runtime is not None and plan is not None:
+        if runtime.budget is None:
+            runtime.budget = budget
+        runtime.stats.plan = plan.as_dict()
 
     parent_headings = _normalize_headings([parent_heading])
-    result = structure_and_summarize(
-        parent_headings,
-        chunks,
-        num_threads=num_threads,
-        max_depth=max_depth,
-    )
-
     output_path = os.path.abspath(output_path)
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write(result)
+    partial_path = output_path + ".partial"
+    with open(partial_path, "w", encoding="utf-8") as f, runtime if own_runtime else nullcontext():
+        written = 0
+
+        def emit(section: str) -> None:
+            nonlocal written
+            if written:
+                f.write(SECTION_SEPARATOR)
+            f.write(section)
+            f.flush()
+            written += 1
+            if on_section is not None:
+                on_section(section)
+
+        result = structure_and_summarize(
+            parent_headings,
+            chunks,
+            num_threads=num_threads,
+            max_depth=max_depth,
+            runtime=runtime,
+            gists=gists,
+            classifier=classifier,
+            memo=memo,
+            checkpoint=checkpoint,
+            on_section=emit,
+            tiers=tiers,
+            base_case_size=base_case_size,
+            budget=budget,
+        )
+    os.replace(partial_path, output_path)
+
+    if memo is not None:
+        memo.set_chunks(input_text, offsets)
+        memo.save(state_path, splitter_kwargs, gists)
+        logger.info("Состояние для инкрементального прогона записано: %s", state_path)
+
+    if checkpoint is not None:
+        checkpoint.complete()
 
     logger.info("Результат записан в файл: %s", output_path)
     return result
+
+
+def iter_summarize_text(input_text: str, **kwargs: Any) -> Iterator[str]:
+    """
+    Генератор над `summarize_text`: отдаёт разделы итогового markdown в порядке
+    документа по мере готовности (файл `output_path + ".partial"` дописывается
+    параллельно).
+
+    Прогон идёт в фоновом потоке с текущими настройками DSPy (`dspy.context`);
+    исключение прогона пробрасывается из генератора после уже отданных разделов.
+    Переданный `on_section` тоже вызывается — в фоновом потоке, до того как
+    раздел отдан генератором.
+    """
+    sections: queue.Queue = queue.Queue()
+    finished = object()
+    errors: list[BaseException] = []
+    callback: Callable[[str], None] | None = kwargs.pop("on_section", None)
+
+    def on_section(text: str) -> None:
+        if callback is not None:
+            callback(text)
+        sections.put(text)
+
+    def run() -> None:
+        try:
+            summarize_text(input_text, on_section=on_section, **kwargs)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            sections.put(finished)
+
+    worker = threading.Thread(target=contextvars.copy_context().run, args=(run,), name="summarize-text", daemon=True)
+    worker.start()
+    while True:
+        item = sections.get()
+        if item is finished:
+            break
+        yield item
+    worker.join()
+    if errors:
+        raise errors[0]
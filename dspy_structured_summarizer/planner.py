@@ -0,0 +1,262 @@
+"""
+Планировщик стоимости `structure_and_summarize` до запуска.
+
+По размерам чанков (офлайн-оценка токенов) моделируется дерево рекурсии:
+выжимки (один раз на чанк при GistStore в режиме "delta"), оглавление,
+классификация и тексты разделов на каждом уровне. Накладные расходы промпта
+каждого шага берутся из инструкций и описаний полей его сигнатуры.
+
+Из кандидатов (от самого качественного к самому дешёвому) выбирается первый,
+чья оценка укладывается в `budget.safety` доли бюджета: сначала дешевеет
+классификация (пачки, затем лексический режим), потом растёт порог базового
+случая, и только затем уменьшается глубина.
+"""
+from __future__ import annotations
+
+import logging
+from collections.abc import Callable
+from dataclasses import asdict, dataclass, replace
+from typing import Any
+
+import dspy
+
+from module_semantic_parallel_splitter.tokens import TokenCounter, estimate_tokens
+
+from .budget import SummaryBudget
+from .classify import TopicClassifier
+from .signatures import (
+    BatchChunkTopicSignature,
+    ChunkTopicSignature,
+    ContentHeadingsSignature,
+    GistSignature,
+    SubsectionSignature,
+)
+from .tiers import DEFAULT_TIER, ModelTiers
+
+logger = logging.getLogger(__name__)
+
+# служебная разметка адаптера (заголовки полей, описание формата ответа)
+_ADAPTER_OVERHEAD = 150
+
+
+@dataclass
+class StepEstimate:
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    def add(self, prompt_tokens: int, completion_tokens: int, calls: int = 1) -> None:
+        self.calls += calls
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+@dataclass
+class SummaryPlan:
+    """Выбранные параметры прогона и оценка расхода по шагам."""
+
+    max_depth: int
+    base_case_size: int
+    classifier: TopicClassifier
+    steps: dict[str, StepEstimate]
+    estimated_cost: float = 0.0
+    fits: bool = True
+
+    @property
+    def calls(self) -> int:
+        return sum(s.calls for s in self.steps.values())
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(s.total_tokens for s in self.steps.values())
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "max_depth": self.max_depth,
+            "base_case_size": self.base_case_size,
+            "classifier": {
+                "mode": self.classifier.mode,
+                "batch_size": self.classifier.batch_size,
+                "classify_by": self.classifier.classify_by,
+            },
+            "calls": self.calls,
+            "total_tokens": self.total_tokens,
+            "estimated_cost": self.estimated_cost,
+            "fits": self.fits,
+            "steps": {name: asdict(s) for name, s in self.steps.items()},
+        }
+
+
+class SummaryPlanner:
+    """
+    Оценка расхода и подбор параметров под бюджет.
+
+    Args:
+        counter: Функция оценки токенов текста
+        fanout: Сколько разделов в среднем даёт оглавление одного уровня
+        gist_tokens: Длина одной выжимки
+        reasoning_tokens: Рассуждение ChainOfThought в ответе
+        heading_tokens: Длина одного заголовка
+        subsection_tokens: Длина текста раздела
+    """
+
+    def __init__(
+        self,
+        counter: TokenCounter | None = None,
+        fanout: int = 8,
+        gist_tokens: int = 120,
+        reasoning_tokens: int = 150,
+        heading_tokens: int = 8,
+        subsection_tokens: int = 900,
+    ):
+        self.counter = counter or estimate_tokens
+        self.fanout = max(2, int(fanout))
+        self.gist_tokens = gist_tokens
+        self.reasoning_tokens = reasoning_tokens
+        self.heading_tokens = heading_tokens
+        self.subsection_tokens = subsection_tokens
+        self._overheads = {
+            name: self._signature_overhead(sig)
+            for name, sig in (
+                ("gist", GistSignature),
+                ("headings", ContentHeadingsSignature),
+                ("classify", ChunkTopicSignature),
+                ("classify_batch", BatchChunkTopicSignature),
+                ("subsection", SubsectionSignature),
+            )
+        }
+
+    def _signature_overhead(self, signature: type[dspy.Signature]) -> int:
+        parts = [signature.instructions]
+        for name, field in signature.fields.items():
+            parts.append(name)
+            parts.append(str(field.json_schema_extra.get("desc", "")))
+        return self.counter("\n".join(parts)) + _ADAPTER_OVERHEAD
+
+    def estimate(
+        self,
+        chunk_tokens: list[int],
+        max_depth: int,
+        base_case_size: int,
+        classifier: TopicClassifier,
+        gists_once: bool = False,
+    ) -> dict[str, StepEstimate]:
+        """Оценка по шагам для чанков заданных размеров (в токенах)."""
+        steps = {name: StepEstimate() for name in ("gist", "headings", "classify", "subsection")}
+        headings_len = self.fanout * self.heading_tokens
+        ov = self._overheads
+
+        def visit(sizes: list[int], depth: int, gisted: bool) -> None:
+            # depth — длина цепочки заголовков, как len(parent_headings)
+            context = depth * self.heading_tokens
+            if len(sizes) <= base_case_size or depth >= max_depth:
+                steps["subsection"].add(
+                    ov["subsection"] + context + sum(sizes), self.reasoning_tokens + self.subsection_tokens
+                )
+                return
+            if not (gists_once and gisted):
+                for size in sizes:
+                    steps["gist"].add(ov["gist"] + context + size, self.gist_tokens)
+            steps["headings"].add(
+                ov["headings"] + context + len(sizes) * self.gist_tokens, self.reasoning_tokens + headings_len
+            )
+            if classifier.mode == "single":
+                for size in sizes:
+                    item = self.gist_tokens if classifier.classify_by == "gist" else size
+                    steps["classify"].add(
+                        ov["classify"] + context + headings_len + item, self.reasoning_tokens + self.heading_tokens
+                    )
+            elif classifier.mode == "batch":
+                for i in range(0, len(sizes), classifier.batch_size):
+                    batch = sizes[i : i + classifier.batch_size]
+                    items = len(batch) * self.gist_tokens if classifier.classify_by == "gist" else sum(batch)
+                    steps["classify"].add(
+                        ov["classify_batch"] + context + headings_len + items,
+                        self.reasoning_tokens + len(batch) * self.heading_tokens,
+                    )
+            # чанки расходятся по разделам примерно поровну, порядок сохраняется
+            groups = min(self.fanout, len(sizes))
+            per_group = (len(sizes) + groups - 1) // groups
+            for g in range(0, len(sizes), per_group):
+                visit(sizes[g : g + per_group], depth + 1, True)
+
+        if chunk_tokens:
+            visit(list(chunk_tokens), 1, False)
+        return steps
+
+    def _cost(
+        self,
+        steps: dict[str, StepEstimate],
+        budget: SummaryBudget,
+        tiers: ModelTiers | None,
+    ) -> float:
+        total = 0.0
+        for name, step in steps.items():
+            tier = tiers.tier_for(name) if tiers is not None else DEFAULT_TIER
+            total += budget.cost(tier, step.prompt_tokens, step.completion_tokens)
+        return total
+
+    def _candidates(self, max_depth: int, base_case_size: int, classifier: TopicClassifier):
+        cheaper = [classifier]
+        if classifier.mode != "lexical":
+            for size in (8, 16, 32):
+                if classifier.mode != "batch" or size > classifier.batch_size:
+                    cheaper.append(replace(classifier, mode="batch", batch_size=size, classify_by="gist"))
+            cheaper.append(replace(classifier, mode="lexical"))
+        for depth in range(max_depth, 0, -1):
+            for base in sorted({base_case_size, base_case_size * 2, base_case_size * 4}):
+                for clf in cheaper:
+                    yield depth, base, clf
+
+    def plan(
+        self,
+        chunks: list[str],
+        budget: SummaryBudget | None = None,
+        *,
+        max_depth: int = 3,
+        base_case_size: int = 4,
+        classifier: TopicClassifier | None = None,
+        tiers: ModelTiers | None = None,
+        gists_once: bool = False,
+    ) -> SummaryPlan:
+        """
+        Подбирает параметры под бюджет. Без бюджета возвращает оценку для исходных
+        параметров; если в бюджет не укладывается ни один кандидат, возвращает
+        самый дешёвый с `fits=False`.
+        """
+        classifier = classifier if classifier is not None else TopicClassifier()
+        sizes = [self.counter(c) for c in chunks]
+        cheapest: SummaryPlan | None = None
+        for depth, base, clf in self._candidates(max_depth, base_case_size, classifier):
+            steps = self.estimate(sizes, depth, base, clf, gists_once)
+            cost = self._cost(steps, budget, tiers) if budget is not None else 0.0
+            candidate = SummaryPlan(depth, base, clf, steps, cost)
+            if budget is None or budget.fits(candidate.total_tokens, cost, budget.safety):
+                return candidate
+            if cheapest is None or (candidate.total_tokens, cost) < (cheapest.total_tokens, cheapest.estimated_cost):
+                cheapest = candidate
+        assert cheapest is not None
+        cheapest.fits = False
+        logger.warning(
+            "[BUDGET] Ни один план не укладывается в бюджет %s — выбран самый дешёвый (~%s токенов)",
+            budget.describe() if budget is not None else {},
+            cheapest.total_tokens,
+        )
+        return cheapest
+
+
+def log_plan(plan: SummaryPlan, log: Callable[..., None] = logger.info) -> None:
+    log(
+        "[PLAN] глубина=%s, базовый случай<=%s чанков, классификация=%s/%s, ~%s вызовов, ~%s токенов, ~$%.4f",
+        plan.max_depth,
+        plan.base_case_size,
+        plan.classifier.mode,
+        plan.classifier.batch_size,
+        plan.calls,
+        plan.total_tokens,
+        plan.estimated_cost,
+    )
@@ -0,0 +1,319 @@
+"""
+Общий исполнитель LLM-вызовов для рекурсивного суммаризатора.
+
+Все уровни рекурсии `structure_and_summarize` отправляют вызовы предикторов в
+один пул с глобальным лимитом `num_threads`, поэтому параллельно обрабатываемые
+соседние подразделы не умножают число одновременных запросов к провайдеру.
+Оркестрация подразделов идёт в отдельном ограниченном пуле (`max_branches`
+потоков), потоки которого сами LLM не вызывают и только ждут результатов — это
+исключает взаимоблокировку пула LLM-вызовов. Если свободного потока оркестрации
+нет, подраздел обрабатывается в текущем потоке, поэтому число потоков не
+растёт с глубиной рекурсии, а ожидание места в пуле не может заблокировать прогон.
+
+Очередь пула приоритетная: приоритет — позиция раздела в документе (кортеж
+индексов от корня), поэтому при нехватке потоков первыми обслуживаются вызовы
+более ранних разделов и первый раздел готов примерно за время одного поддерева.
+
+С `ModelTiers` каждый вызов выполняется LM уровня, назначенного его шагу, а
+вызовы и токены (по данным usage провайдера) учитываются по уровням. С
+`SummaryBudget` новые и ещё не начатые вызовы отклоняются (`BudgetExceededError`),
+как только фактический расход достиг лимита; уже выполняющиеся вызовы завершаются.
+
+С `num_threads="auto"` размер пула берётся из адаптивного контроллера LM
+(`config.concurrency`): пул — верхняя граница, а число одновременных запросов
+к провайдеру подбирает контроллер. Его метрики — в `stats.concurrency`.
+Контроллер включается в реестре LM (`adaptive_concurrency=True`); без него
+"auto" — `DEFAULT_AUTO_THREADS` потоков.
+"""
+from __future__ import annotations
+
+import contextvars
+import itertools
+import logging
+import queue
+import threading
+from collections.abc import Callable, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Any, TypeVar
+
+import dspy
+from dspy.utils.usage_tracker import track_usage
+
+from config.concurrency import AdaptiveConcurrency, find_concurrency, resolve_num_threads
+
+from .budget import BudgetExceededError, SummaryBudget
+from .tiers import DEFAULT_TIER, ModelTiers
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# позиция раздела в документе: кортеж индексов от корня
+Slot = tuple[int, ...]
+
+
+@dataclass
+class SummaryStats:
+    """
+    Статистика одного прогона суммаризатора.
+
+    Args:
+        total_calls: Число вызовов предикторов (запросов к LLM без учёта ретраев адаптера)
+        failed_calls: Вызовы, завершившиеся исключением
+        critical_path: Длина критического пути в последовательных раундах LLM-вызовов —
+            нижняя граница времени прогона при неограниченном параллелизме
+        max_in_flight: Максимум одновременно выполнявшихся вызовов
+        tiers: Уровень модели -> {"calls", "prompt_tokens", "completion_tokens"}
+        cost: Фактическая стоимость по ценам бюджета (0, если цены не заданы)
+        plan: План прогона от `SummaryPlanner` (оценка по шагам), если он строился
+        concurrency: Модель -> метрики адаптивного контроллера параллелизма (лимит, пропускная способность)
+    """
+
+    total_calls: int = 0
+    failed_calls: int = 0
+    critical_path: int = 0
+    max_in_flight: int = 0
+    tiers: dict[str, dict[str, int]] = field(default_factory=dict)
+    cost: float = 0.0
+    plan: dict[str, Any] | None = None
+    concurrency: dict[str, dict[str, Any]] = field(default_factory=dict)
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(u["prompt_tokens"] + u["completion_tokens"] for u in self.tiers.values())
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "total_calls": self.total_calls,
+            "failed_calls": self.failed_calls,
+            "critical_path": self.critical_path,
+            "max_in_flight": self.max_in_flight,
+            "tiers": {name: dict(usage) for name, usage in self.tiers.items()},
+            "total_tokens": self.total_tokens,
+            "cost": self.cost,
+            "plan": self.plan,
+            "concurrency": {model: dict(metrics) for model, metrics in self.concurrency.items()},
+        }
+
+
+class SummaryRuntime:
+    """
+    Ограниченный пул LLM-вызовов, разделяемый всеми уровнями рекурсии.
+
+    Задачи выполняются в копии `contextvars`-контекста вызывающего потока, так что
+    `dspy.context(lm=...)` и прочие локальные настройки DSPy видны в рабочих потоках.
+
+    Args:
+        num_threads: Потоки LLM-вызовов (число или "auto", см. `config.concurrency`)
+        tiers: Назначение LM шагам
+        budget: Бюджет прогона
+        max_branches: Потоки оркестрации подразделов (по умолчанию — `num_threads`)
+    """
+
+    # приоритет стоп-сигнала больше любой позиции раздела
+    _STOP = (float("inf"),)
+
+    def __init__(
+        self,
+        num_threads: int | str = 40,
+        tiers: ModelTiers | None = None,
+        budget: SummaryBudget | None = None,
+        max_branches: int | None = None,
+    ):
+        tier_lms = list(tiers.tiers.values()) if tiers is not None else []
+        self.num_threads = resolve_num_threads(num_threads, dspy.settings.lm, *tier_lms)
+        self.tiers = tiers
+        self.budget = budget
+        self._controllers: dict[str, AdaptiveConcurrency] = {}
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._closed = False
+        self.stats = SummaryStats()
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"summarizer-llm-{i}", daemon=True)
+            for i in range(self.num_threads)
+        ]
+        for worker in self._workers:
+            worker.start()
+        self.max_branches = max(1, int(max_branches)) if max_branches is not None else self.num_threads
+        # слот берётся до постановки ветки в пул, поэтому задачи в очереди пула не ждут
+        self._branch_slots = threading.BoundedSemaphore(self.max_branches)
+        self._branch_pool = ThreadPoolExecutor(self.max_branches, thread_name_prefix="summarizer-branch")
+
+    def __enter__(self) -> "SummaryRuntime":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        """Дожидается уже поставленных вызовов и останавливает рабочие потоки."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for _ in self._workers:
+            self._queue.put((self._STOP, next(self._seq), None))
+        for worker in self._workers:
+            worker.join()
+        self._branch_pool.shutdown(wait=True)
+
+    def _worker(self) -> None:
+        while True:
+            _priority, _seq, task = self._queue.get()
+            if task is None:
+                return
+            future, ctx, predictor, inputs, step = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            if self.budget_exhausted():
+                # вызовы, поставленные до исчерпания бюджета, но ещё не начатые, не выполняются
+                future.set_exception(self._budget_error())
+                continue
+            try:
+                future.set_result(ctx.run(self._run, predictor, inputs, step))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def _run(self, predictor: Callable[..., Any], inputs: dict[str, Any], step: str) -> Any:
+        tier = self.tiers.tier_for(step) if self.tiers is not None else DEFAULT_TIER
+        lm = self.tiers.lm_for(step) if self.tiers is not None else None
+        active = lm if lm is not None else dspy.settings.lm
+        controller = find_concurrency(active)
+        with self._lock:
+            self.stats.total_calls += 1
+            self._in_flight += 1
+            self.stats.max_in_flight = max(self.stats.max_in_flight, self._in_flight)
+            if controller is not None:
+                self._controllers.setdefault(active.model, controller)
+        tracker = None
+        try:
+            with dspy.context(lm=lm) if lm is not None else nullcontext(), track_usage() as tracker:
+                return predictor(**inputs)
+        except Exception:
+            with self._lock:
+                self.stats.failed_calls += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._account(tier, tracker)
+
+    def _account(self, tier: str, tracker: Any) -> None:
+        usage = self.stats.tiers.setdefault(tier, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        usage["calls"] += 1
+        if tracker is None:
+            return
+        for entry in tracker.get_total_tokens().values():
+            prompt = int(entry.get("prompt_tokens") or 0)
+            completion = int(entry.get("completion_tokens") or 0)
+            usage["prompt_tokens"] += prompt
+            usage["completion_tokens"] += completion
+            if self.budget is not None:
+                self.stats.cost += self.budget.cost(tier, prompt, completion)
+
+    def concurrency_stats(self) -> dict[str, dict[str, Any]]:
+        """Метрики контроллеров параллелизма LM, через которые шли вызовы; сохраняются в `stats.concurrency`."""
+        with self._lock:
+            controllers = dict(self._controllers)
+        metrics = {model: controller.stats() for model, controller in controllers.items()}
+        with self._lock:
+            self.stats.concurrency = metrics
+        return metrics
+
+    def budget_exhausted(self) -> bool:
+        if self.budget is None:
+            return False
+        with self._lock:
+            return not self.budget.fits(self.stats.total_tokens, self.stats.cost)
+
+    def _budget_error(self) -> BudgetExceededError:
+        return BudgetExceededError(
+            f"Бюджет исчерпан: токенов={self.stats.total_tokens}, стоимость={self.stats.cost:.4f}"
+        )
+
+    def submit(
+        self,
+        predictor: Callable[..., Any],
+        inputs: dict[str, Any],
+        priority: Slot = (),
+        step: str = "",
+    ) -> Future:
+        """Ставит вызов в очередь; `step` определяет уровень модели (см. `ModelTiers`)."""
+        if self._closed:
+            raise RuntimeError("SummaryRuntime остановлен")
+        if self.budget_exhausted():
+            raise self._budget_error()
+        future: Future = Future()
+        task = (future, contextvars.copy_context(), predictor, inputs, step)
+        self._queue.put((priority, next(self._seq), task))
+        return future
+
+    def call(self, predictor: Callable[..., Any], *, priority: Slot = (), step: str = "", **inputs: Any) -> Any:
+        """Один вызов предиктора через общий пул (исключения пробрасываются)."""
+        return self.submit(predictor, inputs, priority, step).result()
+
+    def map(
+        self,
+        predictor: Callable[..., Any],
+        inputs_list: Sequence[dict[str, Any]],
+        priority: Slot = (),
+        step: str = "",
+    ) -> list[Any]:
+        """
+        Вызовы предиктора для всех входов; порядок результатов совпадает с порядком входов.
+
+        Как и `dspy.Parallel(max_errors=len(...))`, ошибка отдельного вызова не прерывает
+        остальные: на её месте возвращается None. Исчерпание бюджета пробрасывается.
+        """
+        futures = [self.submit(predictor, inputs, priority, step) for inputs in inputs_list]
+        results: list[Any] = []
+        for i, future in enumerate(futures):
+            try:
+                results.append(future.result())
+            except BudgetExceededError:
+                raise
+            except Exception as e:
+                logger.warning("[LLM_ERROR] Вызов %s/%s завершился ошибкой: %s", i + 1, len(futures), e, exc_info=True)
+                results.append(None)
+        return results
+
+    def run_branches(self, branches: Sequence[Callable[[], T]]) -> list[T]:
+        """
+        Выполняет независимые подзадачи (поддеревья) параллельно, сохраняя порядок результатов.
+
+        Ветки уходят в ограниченный пул оркестрации, пока в нём есть свободные потоки;
+        остальные (и всегда последняя) выполняются в текущем потоке. LLM-вызовы всех
+        веток проходят через общий ограниченный пул.
+        """
+        if len(branches) <= 1:
+            return [b() for b in branches]
+
+        futures: list[Future | None] = []
+        for branch in branches[:-1]:
+            if not self._branch_slots.acquire(blocking=False):
+                futures.append(None)
+                continue
+            ctx = contextvars.copy_context()
+
+            def target(branch=branch, ctx=ctx) -> T:
+                try:
+                    return ctx.run(branch)
+                finally:
+                    self._branch_slots.release()
+
+            try:
+                futures.append(self._branch_pool.submit(target))
+            except RuntimeError:
+                # пул уже остановлен — ветка выполняется здесь
+                self._branch_slots.release()
+                futures.append(None)
+
+        inline = {i: branches[i]() for i, future in enumerate(futures) if future is None}
+        last = branches[-1]()
+        results = [inline[i] if future is None else future.result() for i, future in enumerate(futures)]
+        return results + [last]
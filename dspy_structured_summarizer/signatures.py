@@ -54,6 +54,24 @@ class ChunkTopicSignature(dspy.Signature):
     topic = dspy.OutputField(desc="Одна тема из списка content_headings.")
 
 
+class BatchChunkTopicSignature(dspy.Signature):
+    """
+    Классифицировать несколько чанков по темам за один вызов.
+
+    Требования:
+    - chunks — пронумерованный список ([1], [2], ...); верни topics ТОЙ ЖЕ длины и в том же порядке
+    - topics[i] — РОВНО одна тема из content_headings (строгое совпадение) для чанка [i+1]
+    - не пропускай, не объединяй и не добавляй элементы; номера в ответ не включай
+    """
+
+    parent_headings = dspy.InputField(desc="Текущая цепочка заголовков секции.")
+    chunks: list[str] = dspy.InputField(desc="Пронумерованный список чанков (или их выжимок).")
+    content_headings = dspy.InputField(desc="Список допустимых тем для выбора.")
+    topics: list[str] = dspy.OutputField(
+        desc="Список тем той же длины, что chunks: i-й элемент — тема из content_headings для i-го чанка."
+    )
+
+
 class SubsectionSignature(dspy.Signature):
     """
     Суммаризовать список чанков в Markdown-раздел.
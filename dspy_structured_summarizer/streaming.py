@@ -0,0 +1,65 @@
+"""
+Упорядоченная выдача готовых разделов по мере завершения.
+
+Итоговый markdown — обход дерева разделов в прямом порядке: заголовок раздела,
+затем его подразделы. Позиция раздела — кортеж индексов от корня (`()` — корень,
+`(0, 2)` — третий подраздел первого раздела), поэтому порядок документа совпадает
+с лексикографическим порядком позиций.
+
+`OrderedSectionBuffer` принимает завершения в любом порядке и отдаёт фрагменты
+в `emit`, как только готовы все предшествующие в документе. Фрагменты, склеенные
+через "\\n\\n", дают ровно тот же текст, что возвращает `structure_and_summarize`.
+"""
+from __future__ import annotations
+
+import threading
+from collections.abc import Callable
+
+from .runtime import Slot
+
+SECTION_SEPARATOR = "\n\n"
+
+
+class OrderedSectionBuffer:
+    """Буфер завершений с курсором обхода дерева в прямом порядке."""
+
+    def __init__(self, emit: Callable[[str], None]):
+        self._emit = emit
+        self._lock = threading.Lock()
+        # позиция -> готовый текст (лист) или (заголовок, число подразделов)
+        self._done: dict[Slot, str | tuple[str, int]] = {}
+        self._stack: list[Slot] = [()]
+        self.emitted = 0
+
+    def resolve(self, slot: Slot, text: str) -> None:
+        """Раздел в позиции slot готов целиком."""
+        with self._lock:
+            self._done[slot] = text
+            self._advance()
+
+    def expand(self, slot: Slot, heading: str, children: int) -> None:
+        """Раздел в позиции slot раскрыт: известен заголовок и число подразделов."""
+        with self._lock:
+            self._done[slot] = (heading, children)
+            self._advance()
+
+    @property
+    def finished(self) -> bool:
+        with self._lock:
+            return not self._stack
+
+    def _advance(self) -> None:
+        stack = self._stack
+        while stack and stack[-1] in self._done:
+            slot = stack.pop()
+            entry = self._done.pop(slot)
+            if isinstance(entry, str):
+                self._write(entry)
+                continue
+            heading, children = entry
+            self._write(heading)
+            stack.extend(slot + (i,) for i in reversed(range(children)))
+
+    def _write(self, text: str) -> None:
+        self.emitted += 1
+        self._emit(text)
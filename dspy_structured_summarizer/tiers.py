@@ -0,0 +1,60 @@
+"""
+Разные LM для разных шагов суммаризатора.
+
+Массовые дешёвые вызовы (выжимки, классификация) можно отправлять в быструю
+маленькую модель, а немногочисленные, но критичные для качества (оглавление,
+тексты разделов) — в сильную. `SummaryRuntime` выполняет каждый вызов в
+`dspy.context(lm=...)` уровня, назначенного шагу, и ведёт учёт вызовов и
+токенов по уровням.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any
+
+import dspy
+
+STEPS = ("gist", "headings", "classify", "subsection")
+
+DEFAULT_TIER = "default"
+
+
+@dataclass
+class ModelTiers:
+    """
+    Назначение LM шагам суммаризатора.
+
+    Args:
+        tiers: Имя уровня -> LM (например, {"fast": ..., "strong": ...})
+        steps: Шаг ("gist", "headings", "classify", "subsection") -> имя уровня;
+            шаги без назначения используют глобально настроенную LM
+    """
+
+    tiers: dict[str, dspy.BaseLM]
+    steps: dict[str, str] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        for step, tier in self.steps.items():
+            if step not in STEPS:
+                raise ValueError(f"Неизвестный шаг {step!r}; допустимые: {STEPS}")
+            if tier not in self.tiers:
+                raise ValueError(f"Шаг {step!r} ссылается на неизвестный уровень {tier!r}")
+
+    @classmethod
+    def fast_and_strong(cls, fast: dspy.BaseLM, strong: dspy.BaseLM) -> "ModelTiers":
+        """Выжимки и классификация — быстрая модель, оглавление и разделы — сильная."""
+        return cls(
+            tiers={"fast": fast, "strong": strong},
+            steps={"gist": "fast", "classify": "fast", "headings": "strong", "subsection": "strong"},
+        )
+
+    def tier_for(self, step: str) -> str:
+        return self.steps.get(step, DEFAULT_TIER)
+
+    def lm_for(self, step: str) -> dspy.BaseLM | None:
+        tier = self.steps.get(step)
+        return self.tiers[tier] if tier is not None else None
+
+    def describe(self) -> dict[str, Any]:
+        """Шаг -> модель; входит в отпечаток настроек для кэшей и контрольных точек."""
+        return {step: getattr(self.lm_for(step), "model", None) for step in STEPS if step in self.steps}
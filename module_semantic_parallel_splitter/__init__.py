@@ -2,7 +2,11 @@
 Модуль для семантической сегментации текста на параллельные блоки
 """
 from .module import SemanticParallelSplitter, SemanticHalver
-from .signatures import SemanticSplitSignature, SemanticHalverSignature
+from .cache import HalverCache
+from .cohesion import CascadeHalver, LexicalCohesionHalver, STOP_WORDS, lexical_terms
+from .spans import TextSpan
+from .tokens import ChunkBudget, estimate_tokens, litellm_token_counter
+from .signatures import SemanticSplitSignature, SemanticHalverSignature, SemanticBoundarySignature
 from .optimize import optimize, SemanticHalverMetric, load_dataset, save_optimized_module, load_optimized_module, create_reflection_lm
 from .metrics import SemanticSplitMetric
 from .config import configure_module_llm
@@ -10,8 +14,18 @@ from .config import configure_module_llm
 __all__ = [
     "SemanticParallelSplitter",
     "SemanticHalver",
+    "HalverCache",
+    "LexicalCohesionHalver",
+    "CascadeHalver",
+    "STOP_WORDS",
+    "lexical_terms",
+    "TextSpan",
+    "ChunkBudget",
+    "estimate_tokens",
+    "litellm_token_counter",
     "SemanticSplitSignature",
     "SemanticHalverSignature",
+    "SemanticBoundarySignature",
     "optimize",
     "SemanticHalverMetric",
     "load_dataset",
@@ -0,0 +1,152 @@
+"""
+Линейный по времени поиск якорного выравнивания для TextMatcher.
+
+Заменяет `difflib.SequenceMatcher.find_longest_match` (квадратичный в худшем
+случае) и regex с группой `\\s*` на каждое слово: k-граммы исходного текста
+индексируются хэш-таблицей (с шагом k), затем кандидат сканируется один раз, совпадающие
+k-граммы склеиваются в «прогоны» по диагоналям, а прогоны — в цепочку,
+заякоренную у начала текста. Небольшие расхождения (опечатки, пропущенное
+слово) разрывают прогон, но не цепочку.
+"""
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class MatchRun:
+    """Точное совпадение: a[a_start:a_start+size] == b[b_start:b_start+size]."""
+
+    a_start: int
+    b_start: int
+    size: int
+
+    @property
+    def a_end(self) -> int:
+        return self.a_start + self.size
+
+    @property
+    def b_end(self) -> int:
+        return self.b_start + self.size
+
+    @property
+    def diagonal(self) -> int:
+        return self.a_start - self.b_start
+
+
+@dataclass(frozen=True)
+class PrefixAlignment:
+    """Результат выравнивания кандидата относительно начала текста."""
+
+    a_start: int
+    a_end: int
+    b_end: int
+    matched: int
+    runs: int
+
+
+class AnchorAligner:
+    """
+    Поиск совпадений через индекс k-грамм.
+
+    Args:
+        k: Длина k-граммы (минимальная длина точного совпадения)
+        max_occurrences: Сколько вхождений одной k-граммы индексировать
+            (частые k-граммы не дают информации и делают поиск квадратичным)
+        max_drift: Допустимый сдвиг диагонали между соседними прогонами цепочки
+    """
+
+    def __init__(self, k: int = 12, max_occurrences: int = 8, max_drift: int = 40):
+        self.k = max(1, int(k))
+        self.max_occurrences = max(1, int(max_occurrences))
+        self.max_drift = max(0, int(max_drift))
+
+    def _index(self, a: str) -> dict[str, list[int]]:
+        # k-граммы берутся с шагом k: индекс в k раз меньше, а любое совпадение
+        # длиной >= 2k-1 всё равно содержит хотя бы одну проиндексированную k-грамму.
+        k = self.k
+        index: dict[str, list[int]] = {}
+        for i in range(0, len(a) - k + 1, k):
+            positions = index.setdefault(a[i : i + k], [])
+            if len(positions) < self.max_occurrences:
+                positions.append(i)
+        return index
+
+    def _make_run(self, a: str, b: str, a_start: int, b_start: int, size: int) -> MatchRun:
+        """Расширяет прогон посимвольно влево/вправо до максимального точного совпадения."""
+        k = self.k
+        steps = 0
+        while steps < k and a_start > 0 and b_start > 0 and a[a_start - 1] == b[b_start - 1]:
+            a_start -= 1
+            b_start -= 1
+            size += 1
+            steps += 1
+        steps = 0
+        while steps < k and a_start + size < len(a) and b_start + size < len(b) and a[a_start + size] == b[b_start + size]:
+            size += 1
+            steps += 1
+        return MatchRun(a_start, b_start, size)
+
+    def find_runs(self, a: str, b: str) -> list[MatchRun]:
+        """Максимальные по диагонали точные совпадения (длиной >= 2k-1 гарантированно), отсортированные по b_start."""
+        k = self.k
+        if len(a) < k or len(b) < k:
+            return []
+
+        index = self._index(a)
+        # diagonal -> [a_start, b_start, last_j]
+        active: dict[int, list[int]] = {}
+        runs: list[MatchRun] = []
+
+        for j in range(len(b) - k + 1):
+            positions = index.get(b[j : j + k])
+            if not positions:
+                continue
+            for p in positions:
+                diag = p - j
+                run = active.get(diag)
+                if run is not None and run[2] == j - k:
+                    run[2] = j
+                    continue
+                if run is not None:
+                    runs.append(self._make_run(a, b, run[0], run[1], run[2] - run[1] + k))
+                active[diag] = [p, j, j]
+
+        for run in active.values():
+            runs.append(self._make_run(a, b, run[0], run[1], run[2] - run[1] + k))
+
+        runs.sort(key=lambda r: (r.b_start, -r.size))
+        return runs
+
+    def align_prefix(self, a: str, b: str, max_start: int = 20) -> PrefixAlignment | None:
+        """
+        Выравнивает начало `b` на начало `a`.
+
+        Цепочка начинается с прогона, стартующего в `a` не дальше max_start, и
+        жадно продолжается прогонами, идущими дальше по обеим строкам с близкой
+        диагональю. Возвращает позицию конца совпавшей части в `a`.
+        """
+        runs = self.find_runs(a, b)
+        starts = [r for r in runs if r.a_start <= max_start]
+        if not starts:
+            return None
+
+        first = min(starts, key=lambda r: (r.b_start, -r.size))
+        a_end, b_end, diag = first.a_end, first.b_end, first.diagonal
+        matched, count = first.size, 1
+
+        for run in runs:
+            if run.b_end <= b_end or run.a_end <= a_end:
+                continue
+            if abs(run.diagonal - diag) > self.max_drift:
+                continue
+            if run.b_start < b_end or run.a_start < a_end:
+                # частичное перекрытие: засчитываем только новый хвост
+                overlap = max(b_end - run.b_start, a_end - run.a_start)
+                if overlap >= run.size:
+                    continue
+                matched += run.size - overlap
+            else:
+                matched += run.size
+            a_end, b_end, diag = run.a_end, run.b_end, run.diagonal
+            count += 1
+
+        return PrefixAlignment(a_start=first.a_start, a_end=a_end, b_end=b_end, matched=matched, runs=count)
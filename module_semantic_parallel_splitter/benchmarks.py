@@ -0,0 +1,239 @@
+"""
+Микробенчмарки CPU-части модуля семантической сегментации (без LLM).
+
+Запуск:
+    python -m module_semantic_parallel_splitter.benchmarks matcher --limit 100
+    python -m module_semantic_parallel_splitter.benchmarks matcher --limit 10 --merge 10
+    python -m module_semantic_parallel_splitter.benchmarks constraints --segments 10000 50000 --max-segments 20
+"""
+import argparse
+import difflib
+import json
+import os
+import random
+import re
+import statistics
+import time
+
+from .alignment import AnchorAligner
+from .constraints import merge_shortest_pairs
+from .spans import TextSpan
+from .utils import NormalizedText, TextMatcher
+
+DEFAULT_CHUNKS_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "datasets",
+    "splitting datasets",
+    "chunks.json",
+)
+
+
+def _legacy_fuzzy_prefix(full_text: str, candidate_block: str) -> int:
+    """Прежняя стратегия 4: difflib.SequenceMatcher по префиксу кандидата."""
+    cand_prefix = candidate_block[: min(800, len(candidate_block))]
+    matcher = difflib.SequenceMatcher(None, full_text, cand_prefix)
+    match = matcher.find_longest_match(0, len(full_text), 0, len(cand_prefix))
+    if match.size >= 180:
+        cover_full = match.size / max(len(full_text), 1)
+        cover_cand = match.size / max(len(cand_prefix), 1)
+        if match.a <= 20 and (cover_cand >= 0.70 or cover_full >= 0.80):
+            return max(1, min(len(full_text) - 1, match.a + match.size))
+    return 0
+
+
+def _legacy_fuzzy_words(full_text: str, candidate_block: str) -> int:
+    """Прежняя стратегия 6: regex с `\\s*` между всеми словами кандидата."""
+    words = [re.escape(w) for w in candidate_block.split()]
+    if not words:
+        return 0
+    match = re.search(r"\s*".join(words), full_text)
+    return match.end() if match else 0
+
+
+def _aligner_fuzzy_prefix(full_text: str, candidate_block: str, aligner: AnchorAligner) -> int:
+    """Новая стратегия 4: якорное выравнивание по k-граммам на нормализованном тексте."""
+    full_norm = NormalizedText(full_text)
+    cand_prefix = NormalizedText(candidate_block).text
+    alignment = aligner.align_prefix(full_norm.text, cand_prefix)
+    if alignment is None or alignment.matched < 180:
+        return 0
+    cover_full = alignment.matched / max(len(full_norm), 1)
+    cover_cand = alignment.matched / max(len(cand_prefix), 1)
+    if cover_cand >= 0.70 or cover_full >= 0.80:
+        return max(1, min(len(full_text) - 1, full_norm.to_source_end(alignment.a_end)))
+    return 0
+
+
+def _compact_fuzzy_words(full_text: str, candidate_block: str) -> int:
+    """Новая стратегия 6: поиск без пробелов с картой смещений."""
+    full_norm = NormalizedText(full_text)
+    cand_compact = NormalizedText(candidate_block).compact
+    if not cand_compact:
+        return 0
+    idx = full_norm.compact.find(cand_compact)
+    return full_norm.compact_to_source_end(idx + len(cand_compact)) if idx != -1 else 0
+
+
+def _perturb(text: str, rng: random.Random) -> str:
+    """Имитирует типичные искажения LLM: пробелы вместо переводов строк, тире, редкие опечатки."""
+    text = text.replace("\n", " ").replace(" - ", " — ")
+    chars = list(text)
+    for i in range(0, len(chars), 150):
+        j = min(len(chars) - 1, i + rng.randrange(150))
+        if chars[j].isalpha():
+            chars[j] = "ё" if chars[j] != "ё" else "е"
+    return "".join(chars)
+
+
+def build_matcher_cases(
+    chunks_file: str, limit: int, merge: int = 1, seed: int = 0
+) -> list[tuple[str, str, str, int]]:
+    """
+    Строит случаи (вид, full_text, candidate_block, ожидаемый индекс) из chunks.json.
+
+    Виды: "exact" — точный префикс, "perturbed" — префикс с искажениями,
+    "overflow" — префикс + «продолжение» из следующего чанка.
+    `merge` склеивает подряд идущие чанки, имитируя увеличенный max_chunk_size.
+    """
+    with open(chunks_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    raw = [item.get("text", "") for item in data[: limit * max(1, merge)] if item.get("text")]
+    texts = ["\n".join(raw[i : i + merge]) for i in range(0, len(raw), max(1, merge))]
+
+    rng = random.Random(seed)
+    cases: list[tuple[str, str, str, int]] = []
+    for i, text in enumerate(texts):
+        boundaries = [m.end() for m in re.finditer(r"[.!?…](?=\s)", text)]
+        mid = min(boundaries, key=lambda b: abs(b - len(text) // 2)) if boundaries else len(text) // 2
+        prefix = text[:mid]
+        cases.append(("exact", text, prefix, mid))
+        cases.append(("perturbed", text, _perturb(prefix, rng), mid))
+        tail = texts[(i + 1) % len(texts)][:1500]
+        cases.append(("overflow", text, _perturb(text, rng) + " " + tail, len(text.rstrip())))
+    return cases
+
+
+def _time_calls(fn, cases, repeat: int) -> tuple[float, list[int]]:
+    results: list[int] = []
+    timings: list[float] = []
+    for _ in range(max(1, repeat)):
+        results = []
+        started = time.perf_counter()
+        for _kind, full_text, candidate, _expected in cases:
+            results.append(fn(full_text, candidate))
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), results
+
+
+def bench_matcher(chunks_file: str, limit: int, repeat: int, merge: int = 1) -> None:
+    cases = build_matcher_cases(chunks_file, limit, merge=merge)
+    aligner = AnchorAligner()
+    avg_len = statistics.mean(len(case[1]) for case in cases) if cases else 0
+    print(f"📂 {chunks_file}: {len(cases)} случаев (limit={limit}, merge={merge}, ср. длина={avg_len:.0f}, repeat={repeat})")
+
+    variants = {
+        "legacy prefix (difflib)": _legacy_fuzzy_prefix,
+        "anchor prefix (k-gram)": lambda full, cand: _aligner_fuzzy_prefix(full, cand, aligner),
+        "legacy words (regex \\s*)": _legacy_fuzzy_words,
+        "compact words (find)": _compact_fuzzy_words,
+        "find_split_index (cascade)": TextMatcher.find_split_index,
+    }
+
+    print(f"\n{'вариант':<30} {'время, с':>10} {'мкс/вызов':>10} {'найдено':>10}")
+    found_by_variant: dict[str, list[int]] = {}
+    for name, fn in variants.items():
+        seconds, results = _time_calls(fn, cases, repeat)
+        found_by_variant[name] = results
+        per_call = seconds / max(len(cases), 1) * 1e6
+        found = sum(1 for r in results if r > 0)
+        print(f"{name:<30} {seconds:>10.3f} {per_call:>10.0f} {found:>6}/{len(cases):<4}")
+
+    print("\n🎯 Точность границы по видам (|idx - ожидаемый| <= 2 символа):")
+    for kind in ("exact", "perturbed", "overflow"):
+        idx = [i for i, case in enumerate(cases) if case[0] == kind]
+        row = []
+        for name in ("legacy prefix (difflib)", "anchor prefix (k-gram)", "find_split_index (cascade)"):
+            hits = sum(1 for i in idx if abs(found_by_variant[name][i] - cases[i][3]) <= 2)
+            row.append(f"{name.split(' (')[0]}={hits}/{len(idx)}")
+        print(f"   {kind:<10} " + ", ".join(row))
+
+
+def _legacy_merge_shortest_pairs(segments: list[TextSpan], max_segments: int) -> list[TextSpan]:
+    """Прежний цикл max_segments: полный перебор пар и пересборка списка на каждое слияние."""
+    cleaned = list(segments)
+    while len(cleaned) > max_segments and len(cleaned) >= 2:
+        best_i = 0
+        best_len = len(cleaned[0]) + len(cleaned[1])
+        for i in range(len(cleaned) - 1):
+            pair_len = len(cleaned[i]) + len(cleaned[i + 1])
+            if pair_len < best_len:
+                best_len = pair_len
+                best_i = i
+        merged_pair = cleaned[best_i].merge(cleaned[best_i + 1])
+        cleaned = cleaned[:best_i] + [merged_pair] + cleaned[best_i + 2 :]
+    return cleaned
+
+
+def build_segment_spans(count: int, seed: int = 0) -> list[TextSpan]:
+    """Синтетические сегменты одного буфера: длины 50..3000 символов, разделены пробелами/абзацами."""
+    rng = random.Random(seed)
+    lengths = [rng.randint(50, 3000) for _ in range(count)]
+    source = "\n\n".join("x" * n for n in lengths)
+    spans: list[TextSpan] = []
+    pos = 0
+    for n in lengths:
+        spans.append(TextSpan(source, pos, pos + n))
+        pos += n + 2
+    return spans
+
+
+def bench_constraints(counts: list[int], max_segments: int, repeat: int, legacy_limit: int) -> None:
+    print(f"max_segments={max_segments}, repeat={repeat} (legacy только для n <= {legacy_limit})")
+    print(f"\n{'сегментов':>10} {'heap, с':>10} {'legacy, с':>10} {'ускорение':>10} {'совпадает':>10}")
+    for count in counts:
+        spans = build_segment_spans(count)
+        timings: list[float] = []
+        result: list[TextSpan] = []
+        for _ in range(max(1, repeat)):
+            started = time.perf_counter()
+            result = merge_shortest_pairs(spans, max_segments)
+            timings.append(time.perf_counter() - started)
+        heap_seconds = statistics.median(timings)
+
+        legacy_cell, speedup_cell, same_cell = "—", "—", "—"
+        if count <= legacy_limit:
+            started = time.perf_counter()
+            legacy = _legacy_merge_shortest_pairs(spans, max_segments)
+            legacy_seconds = time.perf_counter() - started
+            legacy_cell = f"{legacy_seconds:.3f}"
+            speedup_cell = f"x{legacy_seconds / max(heap_seconds, 1e-9):.0f}"
+            same_cell = "да" if legacy == result else "НЕТ"
+        print(f"{count:>10} {heap_seconds:>10.3f} {legacy_cell:>10} {speedup_cell:>10} {same_cell:>10}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="CPU microbenchmarks for module_semantic_parallel_splitter")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p_matcher = sub.add_parser("matcher", help="TextMatcher fuzzy strategies: difflib/regex vs k-gram anchors")
+    p_matcher.add_argument("--chunks-file", default=DEFAULT_CHUNKS_FILE)
+    p_matcher.add_argument("--limit", type=int, default=100)
+    p_matcher.add_argument("--repeat", type=int, default=3)
+    p_matcher.add_argument("--merge", type=int, default=1, help="Склеивать N соседних чанков (длинные чанки)")
+
+    p_constraints = sub.add_parser("constraints", help="max_segments merging: heap + linked list vs quadratic loop")
+    p_constraints.add_argument("--segments", type=int, nargs="+", default=[10_000, 50_000, 100_000])
+    p_constraints.add_argument("--max-segments", type=int, default=20)
+    p_constraints.add_argument("--repeat", type=int, default=3)
+    p_constraints.add_argument("--legacy-limit", type=int, default=10_000, help="Не запускать прежний цикл для больших n")
+
+    args = parser.parse_args()
+    if args.bench == "matcher":
+        bench_matcher(args.chunks_file, args.limit, args.repeat, merge=args.merge)
+    elif args.bench == "constraints":
+        bench_constraints(args.segments, args.max_segments, args.repeat, args.legacy_limit)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,156 @@
+"""
+Персистентный content-addressed кэш предсказаний SemanticHalver.
+
+Ключ — sha256 от текста чанка, состояния программы (инструкции/демо из
+скомпилированного промпта), модели и параметров генерации LM, поэтому кэш
+автоматически инвалидируется при смене модели или переоптимизации промпта.
+Ключ API, endpoint и прочие транспортные настройки в ключ не входят: смена
+ключа или прокси для той же модели кэш не сбрасывает.
+Хранилище — SQLite с LRU-вытеснением по суммарному размеру записей.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# параметры LM, влияющие на ответ модели (остальные kwargs — ключ, endpoint, ретраи — в ключ кэша не входят)
+GENERATION_PARAMS = (
+    "temperature",
+    "max_tokens",
+    "max_completion_tokens",
+    "top_p",
+    "top_k",
+    "n",
+    "stop",
+    "seed",
+    "presence_penalty",
+    "frequency_penalty",
+    "reasoning_effort",
+)
+
+
+class HalverCache:
+    """SQLite-кэш ответов LLM для SemanticHalver с LRU-вытеснением по размеру."""
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024):
+        """
+        Args:
+            path: Путь к файлу SQLite (директория создаётся при необходимости)
+            max_bytes: Максимальный суммарный размер сохранённых ответов
+        """
+        self.path = os.path.abspath(path)
+        self.max_bytes = max(0, int(max_bytes))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+        self._conn.commit()
+
+        row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        self._total_bytes = int(row[0])
+        self.hits = 0
+        self.misses = 0
+
+    def __deepcopy__(self, memo: dict) -> "HalverCache":
+        # dspy копирует модули при оптимизации — кэш должен оставаться общим
+        return self
+
+    @staticmethod
+    def model_identity(lm: Any) -> dict[str, Any]:
+        """Модель и параметры генерации LM для ключа кэша (без учётных данных и транспорта)."""
+        kwargs = getattr(lm, "kwargs", None) or {}
+        params = {
+            name: kwargs[name]
+            for name in GENERATION_PARAMS
+            if kwargs.get(name) is not None and isinstance(kwargs[name], (str, int, float, bool, list, tuple))
+        }
+        return {"model": getattr(lm, "model", None), "params": params}
+
+    @staticmethod
+    def make_key(text: str, program_state: Any, model: Any) -> str:
+        """Строит ключ из текста чанка, состояния программы и идентификатора модели."""
+        payload = json.dumps(
+            {"text": text, "program": program_state, "model": model},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+
+        try:
+            return json.loads(row[0])
+        except json.JSONDecodeError:
+            logger.warning(f"[CACHE_CORRUPT] не удалось разобрать запись {key[:12]}…")
+            return None
+
+    def put(self, key: str, value: dict[str, Any]) -> None:
+        data = json.dumps(value, ensure_ascii=False, default=str)
+        size = len(data.encode("utf-8"))
+        if self.max_bytes and size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                (key, data, size, time.time()),
+            )
+            self._total_bytes += size - (int(old[0]) if old else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """Удаляет давно не использованные записи, пока размер не уложится в лимит."""
+        if not self.max_bytes:
+            return
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute("SELECT key, size FROM entries ORDER BY accessed ASC LIMIT 64").fetchall()
+            if not rows:
+                self._total_bytes = 0
+                return
+            for key, size in rows:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._total_bytes -= int(size)
+                if self._total_bytes <= self.max_bytes:
+                    break
+            logger.debug(f"[CACHE_EVICT] размер кэша {self._total_bytes} байт")
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": int(entries), "bytes": self._total_bytes}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+            self._total_bytes = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
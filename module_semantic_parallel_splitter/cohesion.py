@@ -0,0 +1,311 @@
+"""
+Локальный (без LLM) выбор точки разреза по лексической связности — в духе TextTiling.
+
+Текст режется на единицы по границам предложений/строк (`BoundaryMarker`), для
+каждой единицы строится вектор термов (грубые основы слов), и для каждой границы
+считается косинусная близость окон слева и справа (NumPy, через кумулятивные
+суммы). Граница с самой глубокой «впадиной» близости — точка смены темы.
+
+`LexicalCohesionHalver` — замена SemanticHalver с тем же контрактом
+`(prediction, trace)`; `CascadeHalver` комбинирует его с LLM: как префильтр
+(в LLM уходят только неоднозначные чанки) или как запасной вариант при
+ошибках, исчерпании бюджета вызовов или rate limit.
+"""
+import logging
+import re
+import threading
+import time
+from typing import Any
+
+import dspy
+import numpy as np
+
+from .module import SemanticHalver
+from .utils import BoundaryIndex, BoundaryMarker
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"[^\W\d_]{3,}")
+# служебные слова есть по обе стороны любой границы и только размывают близость
+STOP_WORDS = frozenset(
+    """
+    the and that this with have for not are was were you your they them their there what when which
+    who will would can could should about from into just like then than also been being its it's our
+    out all any some one two more most very really know think going get got yeah okay right thing things
+    это как что так для его она они оно был была были было быть тот эта эти тем чем при над под без
+    или уже еще ещё вот там тут где когда если чтобы потому тоже только очень может можно нужно надо
+    себя свой своя свои наш наша наши ваш ваша ваши мне меня нас вас вам них ним нее неё него которые
+    который которая которое также даже просто вообще какой какая какие такой такая такие всё все всех
+    """.split()
+)
+
+
+def lexical_terms(text: str, stem_length: int = 6) -> list[str]:
+    """Значимые слова текста (от 3 букв, без `STOP_WORDS`), обрезанные до `stem_length` символов."""
+    return [w[:stem_length] for w in _WORD_RE.findall(text.lower()) if w not in STOP_WORDS]
+
+
+class LexicalCohesionHalver(dspy.Module):
+    """
+    Деление текста на два блока по минимуму лексической связности.
+
+    Args:
+        window: Сколько значимых слов (минимум) берётся в окно с каждой стороны
+        stem_length: До скольких символов обрезаются слова (грубый стемминг)
+        min_fraction: Граница не ближе этой доли текста к его краям
+        position_weight: Штраф за удаление от середины текста
+        min_depth: Глубина впадины, ниже которой уверенность считается нулевой
+    """
+
+    def __init__(
+        self,
+        window: int = 60,
+        stem_length: int = 6,
+        min_fraction: float = 0.2,
+        position_weight: float = 0.1,
+        min_depth: float = 0.05,
+    ):
+        super().__init__()
+        self.window = max(1, int(window))
+        self.stem_length = max(1, int(stem_length))
+        self.min_fraction = min(0.45, max(0.0, float(min_fraction)))
+        self.position_weight = max(0.0, float(position_weight))
+        self.min_depth = max(0.0, float(min_depth))
+        # совместимость с SemanticHalver (демо и статистика сплиттера читают halver.cache)
+        self.cache = None
+
+    def _terms(self, unit: str) -> list[str]:
+        return lexical_terms(unit, self.stem_length)
+
+    def _gap_similarity(self, units: list[str]) -> np.ndarray:
+        """Косинусная близость окон слева/справа для каждой границы между единицами."""
+        vocab: dict[str, int] = {}
+        rows: list[int] = []
+        cols: list[int] = []
+        for i, unit in enumerate(units):
+            for term in self._terms(unit):
+                rows.append(i)
+                cols.append(vocab.setdefault(term, len(vocab)))
+
+        m = len(units)
+        sizes = np.bincount(np.asarray(rows, dtype=np.int64), minlength=m) if rows else np.zeros(m, dtype=np.int64)
+        counts = np.zeros((m, max(1, len(vocab))), dtype=np.float64)
+        if rows:
+            np.add.at(counts, (np.asarray(rows), np.asarray(cols)), 1.0)
+
+        # idf внутри чанка: термы, встречающиеся во всех единицах, не несут сигнала
+        df = np.count_nonzero(counts, axis=0)
+        counts *= np.log((m + 1) / (df + 1)) + 1e-3
+
+        cum = np.vstack([np.zeros((1, counts.shape[1])), np.cumsum(counts, axis=0)])
+        # окна растут до `window` значимых слов с каждой стороны (единицы разной длины)
+        words = np.concatenate([[0], np.cumsum(sizes)])
+        gaps = np.arange(1, m)
+        lo = np.maximum(0, np.searchsorted(words, words[gaps] - self.window, side="right") - 1)
+        hi = np.minimum(m, np.searchsorted(words, words[gaps] + self.window, side="left"))
+        left = cum[gaps] - cum[lo]
+        right = cum[hi] - cum[gaps]
+        norms = np.linalg.norm(left, axis=1) * np.linalg.norm(right, axis=1)
+        sim = np.einsum("ij,ij->i", left, right) / np.maximum(norms, 1e-12)
+        if len(sim) >= 3:
+            # сглаживание скользящим средним (как в TextTiling), края — без изменений
+            sim[1:-1] = np.convolve(sim, np.ones(3) / 3, mode="valid")
+        return sim
+
+    @staticmethod
+    def _depth_scores(sim: np.ndarray) -> np.ndarray:
+        """Глубина впадины (TextTiling): подъём до ближайших пиков слева и справа."""
+        n = len(sim)
+        depth = np.zeros(n)
+        for i in range(n):
+            left = i
+            while left > 0 and sim[left - 1] >= sim[left]:
+                left -= 1
+            right = i
+            while right < n - 1 and sim[right + 1] >= sim[right]:
+                right += 1
+            depth[i] = (sim[left] - sim[i]) + (sim[right] - sim[i])
+        return depth
+
+    def score_boundaries(self, text: str) -> tuple[list[int], np.ndarray, np.ndarray]:
+        """
+        Возвращает (позиции границ, глубины впадин, итоговые оценки с учётом позиции).
+
+        Позиции — индексы конца первой части, как в BoundaryMarker.
+        """
+        n = len(text)
+        bounds = BoundaryMarker.find_boundaries(text, max_markers=0)
+        if not bounds:
+            return [], np.zeros(0), np.zeros(0)
+
+        edges = [0, *bounds, n]
+        units = [text[edges[i] : edges[i + 1]] for i in range(len(edges) - 1)]
+        depth = self._depth_scores(self._gap_similarity(units))
+
+        positions = np.asarray(bounds, dtype=np.float64) / max(n, 1)
+        scores = depth - self.position_weight * np.abs(positions - 0.5)
+        outside = (positions < self.min_fraction) | (positions > 1.0 - self.min_fraction)
+        if not outside.all():
+            scores[outside] = -np.inf
+        return bounds, depth, scores
+
+    def forward(self, text: str, boundary_index: BoundaryIndex | None = None) -> tuple[dspy.Prediction, Any]:
+        """
+        Делит текст на два блока без вызова LLM.
+
+        Returns:
+            (dspy.Prediction, None) с полями first_block, split_index, error,
+            а также confidence (0..1: насколько лучшая граница выделяется среди
+            остальных) и method="lexical". `boundary_index` принимается для
+            совместимости с SemanticHalver.
+        """
+        if not text or not isinstance(text, str):
+            return self._result("", 0, 0.0, "[EMPTY_INPUT] текст пустой или не является строкой")
+
+        text = text.strip()
+        if len(text) < 50:
+            return self._result(text, len(text), 1.0)
+
+        bounds, depth, scores = self.score_boundaries(text)
+        if not bounds:
+            logger.debug("[NO_BOUNDARIES] лексический halver: в тексте нет границ предложений")
+            return self._result("", 0, 0.0, "[NO_BOUNDARIES] в тексте не найдено границ предложений")
+
+        order = np.argsort(-scores, kind="stable")
+        best = int(order[0])
+        split_index = bounds[best]
+        best_depth = float(depth[best])
+        confidence = 0.0
+        if best_depth >= self.min_depth:
+            # насколько лучшая граница выделяется на фоне следующей по оценке
+            runner_up = 0.0
+            if len(order) > 1 and np.isfinite(scores[order[1]]):
+                runner_up = max(0.0, float(scores[order[1]]))
+            confidence = float(np.clip((scores[best] - runner_up) / max(float(scores[best]), 1e-12), 0.0, 1.0))
+
+        logger.debug(f"[LEXICAL_SPLIT] split_index={split_index}, depth={best_depth:.3f}, confidence={confidence:.2f}")
+        return self._result(text[:split_index], split_index, confidence)
+
+    @staticmethod
+    def _result(
+        first_block: str, split_index: int, confidence: float, error: str | None = None
+    ) -> tuple[dspy.Prediction, Any]:
+        prediction = dspy.Prediction(
+            first_block=first_block,
+            split_index=split_index,
+            error=error,
+            confidence=confidence,
+            method="lexical",
+        )
+        return prediction, None
+
+
+class _CascadeCounters:
+    """Общие для копий модуля счётчики и состояние бюджета (dspy копирует модули)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {"lexical": 0, "llm": 0, "fallback": 0}
+        self.llm_calls = 0
+        self.blocked_until = 0.0
+
+    def __deepcopy__(self, memo: dict) -> "_CascadeCounters":
+        return self
+
+
+class CascadeHalver(dspy.Module):
+    """
+    Комбинация лексического halver и LLM.
+
+    Стратегии:
+    - "prefilter": сначала локальная оценка; в LLM уходят только чанки с
+      уверенностью ниже min_confidence;
+    - "fallback": всегда LLM, локальная оценка — только если LLM недоступен.
+
+    В обеих стратегиях лексический ответ используется, если LLM вернул ошибку,
+    исчерпан бюджет `max_llm_calls` или недавно был rate limit (LLM не
+    вызывается `rate_limit_cooldown` секунд).
+    """
+
+    STRATEGIES = ("prefilter", "fallback")
+
+    def __init__(
+        self,
+        llm_halver: SemanticHalver | None = None,
+        lexical: LexicalCohesionHalver | None = None,
+        strategy: str = "prefilter",
+        min_confidence: float = 0.4,
+        max_llm_calls: int | None = None,
+        rate_limit_cooldown: float = 60.0,
+    ):
+        super().__init__()
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Неизвестная стратегия CascadeHalver: {strategy!r} (ожидается одна из {self.STRATEGIES})")
+        self.llm_halver = llm_halver or SemanticHalver()
+        self.lexical = lexical or LexicalCohesionHalver()
+        self.strategy = strategy
+        self.min_confidence = float(min_confidence)
+        self.max_llm_calls = max_llm_calls
+        self.rate_limit_cooldown = max(0.0, float(rate_limit_cooldown))
+        self._counters = _CascadeCounters()
+
+    @property
+    def cache(self):
+        return getattr(self.llm_halver, "cache", None)
+
+    def counts(self) -> dict[str, int]:
+        """Сколько чанков решено локально / через LLM / локально из-за недоступности LLM."""
+        with self._counters.lock:
+            return {**self._counters.counts, "llm_calls": self._counters.llm_calls}
+
+    def _count(self, key: str) -> None:
+        with self._counters.lock:
+            self._counters.counts[key] += 1
+
+    def _acquire_llm(self) -> bool:
+        """Резервирует вызов LLM, если не исчерпан бюджет и нет паузы после rate limit."""
+        with self._counters.lock:
+            if time.monotonic() < self._counters.blocked_until:
+                return False
+            if self.max_llm_calls is not None and self._counters.llm_calls >= self.max_llm_calls:
+                return False
+            self._counters.llm_calls += 1
+            return True
+
+    def forward(self, text: str, boundary_index: BoundaryIndex | None = None) -> tuple[dspy.Prediction, Any]:
+        lexical_pred = None
+        if self.strategy == "prefilter":
+            lexical_pred, _ = self.lexical(text=text, boundary_index=boundary_index)
+            if lexical_pred.split_index > 0 and lexical_pred.confidence >= self.min_confidence:
+                self._count("lexical")
+                return lexical_pred, None
+
+        if not self._acquire_llm():
+            logger.info("[LLM_UNAVAILABLE] бюджет вызовов исчерпан или пауза после rate limit — лексический разрез")
+            return self._fallback(text, boundary_index, lexical_pred)
+
+        prediction, trace = self.llm_halver(text=text, boundary_index=boundary_index)
+        error = getattr(prediction, "error", None) or ""
+        if error.startswith("[RATE_LIMIT]") and self.rate_limit_cooldown > 0:
+            with self._counters.lock:
+                self._counters.blocked_until = time.monotonic() + self.rate_limit_cooldown
+            logger.warning(f"[RATE_LIMIT] LLM не вызывается {self.rate_limit_cooldown:.0f} с")
+
+        if getattr(prediction, "split_index", 0) > 0:
+            self._count("llm")
+            prediction.method = "llm"
+            return prediction, trace
+
+        # LLM не дал разреза (ошибка или ответ не сопоставился с текстом)
+        fallback, _ = self._fallback(text, boundary_index, lexical_pred)
+        if fallback.split_index > 0:
+            return fallback, None
+        return prediction, trace
+
+    def _fallback(
+        self, text: str, boundary_index: BoundaryIndex | None, lexical_pred: dspy.Prediction | None
+    ) -> tuple[dspy.Prediction, Any]:
+        if lexical_pred is None:
+            lexical_pred, _ = self.lexical(text=text, boundary_index=boundary_index)
+        self._count("fallback")
+        return lexical_pred, None
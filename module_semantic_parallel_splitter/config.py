@@ -49,7 +49,11 @@ def configure_module_llm(
             "или задайте глобальные `OPENROUTER_*` переменные и вызовите `configure_module_llm(use_global_config=True)`."
         )
 
-    lm = dspy.LM(
+    from config.registry import get_registry
+
+    # клиент общий для процесса: те же параметры у сплиттера и суммаризатора дают один клиент и один лимит
+    lm = get_registry().register(
+        "semantic_splitter",
         model=model,
         api_base=api_base,
         api_key=api_key,
@@ -0,0 +1,81 @@
+"""
+Ограничения на число и длину сегментов (без LLM).
+
+`merge_shortest_pairs` — приоритетная очередь по длине соседних пар плюс
+двусвязный список сегментов с ленивой инвалидацией устаревших записей кучи:
+O(n log n) вместо пересканирования всех пар и пересборки списка на каждое слияние.
+"""
+import heapq
+
+from .spans import TextSpan
+
+
+def merge_short_segments(segments: list[TextSpan], min_segment_length: int) -> list[TextSpan]:
+    """Сливает сегменты короче min_segment_length со следующими (за один проход)."""
+    merged: list[TextSpan] = []
+    buf: TextSpan | None = None
+    for s in segments:
+        if buf is None:
+            buf = s
+            continue
+        if len(buf) < min_segment_length:
+            buf = buf.merge(s)
+        else:
+            merged.append(buf)
+            buf = s
+    if buf is not None:
+        merged.append(buf)
+    return merged
+
+
+def merge_shortest_pairs(segments: list[TextSpan], max_segments: int) -> list[TextSpan]:
+    """
+    Сливает самые короткие соседние пары, пока сегментов больше max_segments.
+
+    Порядок слияний совпадает с наивным алгоритмом: на каждом шаге берётся пара
+    с минимальной суммарной длиной, при равенстве — самая левая. Запись кучи
+    (длина пары, левый узел, версии обоих узлов) считается устаревшей, если
+    один из узлов с тех пор слился или был поглощён.
+    """
+    n = len(segments)
+    if max_segments <= 0 or n <= max_segments:
+        return list(segments)
+
+    spans = list(segments)
+    # узлы списка — исходные позиции; номер левого узла сохраняет порядок в тексте
+    prev = list(range(-1, n - 1))
+    nxt = list(range(1, n + 1))
+    nxt[-1] = -1
+    version = [0] * n
+
+    heap = [(len(spans[i]) + len(spans[i + 1]), i, 0, 0) for i in range(n - 1)]
+    heapq.heapify(heap)
+
+    count = n
+    while count > max_segments and heap:
+        _cost, i, version_i, version_j = heapq.heappop(heap)
+        j = nxt[i]
+        if j == -1 or version[i] != version_i or version[j] != version_j:
+            continue
+
+        spans[i] = spans[i].merge(spans[j])
+        version[i] += 1
+        version[j] = -1  # поглощённый узел: все его записи в куче устарели
+        k = nxt[j]
+        nxt[i] = k
+        if k != -1:
+            prev[k] = i
+        count -= 1
+
+        p = prev[i]
+        if p != -1:
+            heapq.heappush(heap, (len(spans[p]) + len(spans[i]), p, version[p], version[i]))
+        if k != -1:
+            heapq.heappush(heap, (len(spans[i]) + len(spans[k]), i, version[i], version[k]))
+
+    out: list[TextSpan] = []
+    node = 0  # первый узел может только поглощать соседей справа
+    while node != -1:
+        out.append(spans[node])
+        node = nxt[node]
+    return out
@@ -13,7 +13,9 @@ import dspy
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from module_semantic_parallel_splitter.config import configure_module_llm
+from module_semantic_parallel_splitter.cache import HalverCache
 from module_semantic_parallel_splitter.module import SemanticHalver
+from module_semantic_parallel_splitter.cohesion import CascadeHalver, LexicalCohesionHalver
 
 
 def setup_logging():
@@ -208,6 +210,65 @@ def load_chunks(chunks_file: str, limit: int):
     return texts, names
 
 
+def build_halver(args, mode):
+    """Создаёт SemanticHalver нужного режима (с оптимизированным промптом и кэшем, если заданы)."""
+    if mode == "lexical":
+        print("ℹ️  Лексический halver без LLM")
+        return LexicalCohesionHalver()
+    if mode == "cascade":
+        print("ℹ️  Каскад: лексический префильтр, неоднозначные чанки — в LLM")
+        return CascadeHalver(build_halver(args, "echo"))
+
+    halver = None
+    if args.optimized and mode == "echo":
+        from module_semantic_parallel_splitter.optimize import load_optimized_module
+        opt_path = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "artifacts",
+            "semantic_halver_optimized.json"
+        )
+        if os.path.exists(opt_path):
+            halver = load_optimized_module(SemanticHalver, opt_path)
+        else:
+            print(f"⚠️  Оптимизированный модуль не найден по пути: {opt_path}")
+            print("   Используем базовый модуль.")
+    elif args.optimized:
+        print("⚠️  Оптимизированный артефакт есть только для режима echo — используем базовый модуль.")
+
+    if halver is None:
+        print("ℹ️  Используем базовый (не оптимизированный) модуль")
+        halver = SemanticHalver(mode=mode)
+
+    if args.cache:
+        halver.cache = HalverCache(args.cache)
+        print(f"🗄️  Кэш предсказаний: {args.cache}")
+    return halver
+
+
+def run_parallel(halver, texts, threads):
+    """Запускает halver параллельно по всем текстам, возвращает (predictions, seconds)."""
+    # dspy.Parallel - это executor, а не обёртка.
+    # Модуль передаётся в каждой паре (module, example)
+    parallel_executor = dspy.Parallel(num_threads=threads, provide_traceback=True)
+
+    print(f"\n🚀 Запуск параллельного выполнения...")
+
+    start_time = time.time()
+
+    # Создаём пары (module, example) для каждого текста
+    # Важно: используем .with_inputs() для указания input полей
+    examples = [dspy.Example(text=t).with_inputs('text') for t in texts]
+    exec_pairs = [(halver, ex) for ex in examples]
+
+    # Выполняем параллельно
+    results = parallel_executor(exec_pairs)
+
+    duration = time.time() - start_time
+
+    # Распаковываем (prediction, trace) пары
+    return [r for r, _ in results], duration
+
+
 def parse_args():
     repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     default_chunks = os.path.join(repo_root, "datasets", "splitting datasets", "chunks.json")
@@ -218,6 +279,16 @@ def parse_args():
     parser.add_argument("--limit", type=int, default=20)
     parser.add_argument("--threads", type=int, default=30)
     parser.add_argument("--optimized", action="store_true", help="Use optimized module from artifacts")
+    parser.add_argument("--cache", default=None, help="Path to the SQLite cache of SemanticHalver predictions")
+    parser.add_argument(
+        "--halver-mode",
+        choices=["echo", "boundary", "lexical", "cascade", "both"],
+        default="echo",
+        help=(
+            "echo: LLM returns the first block; boundary: LLM returns a boundary id; "
+            "lexical: local cohesion scorer, no LLM; cascade: lexical prefilter + echo LLM; both: benchmark echo and boundary"
+        ),
+    )
     return parser.parse_args()
 
 
@@ -256,47 +327,44 @@ def main():
         print(f"   - Философия: {batch_size // 4} экземпляров")
         print(f"   - Фармакология: {batch_size // 4} экземпляров")
 
-    # Создаём модуль и Parallel executor
-    if args.optimized:
-        from module_semantic_parallel_splitter.optimize import load_optimized_module
-        opt_path = os.path.join(
-            os.path.dirname(os.path.abspath(__file__)),
-            "artifacts",
-            "semantic_halver_optimized.json"
+    modes = ["echo", "boundary"] if args.halver_mode == "both" else [args.halver_mode]
+    summary_rows = []
+    for mode in modes:
+        print(f"\n🧩 Режим SemanticHalver: {mode}")
+        halver = build_halver(args, mode)
+        results, duration = run_parallel(halver, texts, args.threads)
+
+        # Выводим результаты
+        print_parallel_results(results, text_names, time.time() - duration, batch=texts)
+
+        if halver.cache is not None:
+            cache_stats = halver.cache.stats()
+            print(f"\n🗄️  Кэш: hits={cache_stats['hits']}, misses={cache_stats['misses']}, записей={cache_stats['entries']}")
+        if isinstance(halver, CascadeHalver):
+            print(f"\n🔀 Каскад: {halver.counts()}")
+
+        output_field = "boundary_id" if mode == "boundary" else "first_block"
+        output_chars = [len(str(getattr(r, output_field, "") or "")) for r in results]
+        summary_rows.append(
+            {
+                "mode": mode,
+                "seconds": duration,
+                "split": sum(1 for r in results if r.split_index > 0),
+                "total": len(results),
+                "avg_output_chars": sum(output_chars) / len(output_chars) if output_chars else 0.0,
+            }
         )
-        if os.path.exists(opt_path):
-            halver = load_optimized_module(SemanticHalver, opt_path)
-        else:
-            print(f"⚠️  Оптимизированный модуль не найден по пути: {opt_path}")
-            print("   Используем базовый модуль.")
-            halver = SemanticHalver()
-    else:
-        print("ℹ️  Используем базовый (не оптимизированный) модуль")
-        halver = SemanticHalver()
-
-    # dspy.Parallel - это executor, а не обёртка.
-    # Модуль передаётся в каждой паре (module, example)
-    parallel_executor = dspy.Parallel(num_threads=args.threads, provide_traceback=True)
-
-    print(f"\n🚀 Запуск параллельного выполнения...")
-
-    start_time = time.time()
-
-    # Создаём пары (module, example) для каждого текста
-    # Важно: используем .with_inputs() для указания input полей
-    examples = [dspy.Example(text=t).with_inputs('text') for t in texts]
-    exec_pairs = [(halver, ex) for ex in examples]
-
-    # Выполняем параллельно
-    results = parallel_executor(exec_pairs)
-
-    duration = time.time() - start_time
-
-    # Распаковываем (prediction, trace) пары
-    results = [r for r, _ in results]
 
-    # Выводим результаты
-    print_parallel_results(results, text_names, start_time, batch=texts)
+    if len(summary_rows) > 1:
+        print("\n" + "=" * 70)
+        print("⚖️  СРАВНЕНИЕ РЕЖИМОВ")
+        print("=" * 70)
+        print(f"{'режим':<10} {'время, с':>10} {'успешно':>10} {'ср. длина ответа':>18}")
+        for row in summary_rows:
+            print(
+                f"{row['mode']:<10} {row['seconds']:>10.2f} {row['split']:>5}/{row['total']:<4} "
+                f"{row['avg_output_chars']:>18.0f}"
+            )
 
     print("\n" + "=" * 70)
     print("✅ Тест завершён")
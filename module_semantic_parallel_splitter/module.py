@@ -2,32 +2,57 @@
 Модуль семантической сегментации текста на параллельные блоки
 """
 
+import json
 import logging
 import re
-from dataclasses import asdict, dataclass
-from typing import Any
+import time
+from collections.abc import Iterable, Iterator
+from dataclasses import asdict, dataclass, field
+from functools import partial
+from typing import IO, Any
 
 import dspy
 from requests.exceptions import RequestException
 
-from .signatures import SemanticHalverSignature
-from .utils import TextMatcher
+from config.concurrency import resolve_num_threads
+
+from .cache import HalverCache
+from .constraints import merge_short_segments, merge_shortest_pairs
+from .signatures import SemanticBoundarySignature, SemanticHalverSignature
+from .spans import TextSpan
+from .tokens import ChunkBudget, TokenCounter, estimate_tokens
+from .utils import BoundaryIndex, BoundaryMarker, TextMatcher
 
 logger = logging.getLogger(__name__)
 
+# DSPyTimeoutError есть не во всех версиях dspy
+_NETWORK_ERRORS = (RequestException, TimeoutError) + tuple(
+    e for e in (getattr(dspy.utils, "DSPyTimeoutError", None),) if isinstance(e, type)
+)
+
 
 @dataclass
 class ChunkSplit:
-    """Результат разделения одного чанка на две части."""
+    """Результат разделения одного чанка на две части (фрагменты исходного буфера)."""
 
-    first_half: str
-    second_half: str
+    first: TextSpan
+    second: TextSpan | None
     split_index: int
     failure_reason: str | None = None
+    # ответ halver взят из кэша (True) или получен от LLM (False); None — кэш не участвовал
+    cache_hit: bool | None = None
+
+    @property
+    def first_half(self) -> str:
+        return self.first.text
+
+    @property
+    def second_half(self) -> str:
+        return self.second.text if self.second is not None else ""
 
     @property
     def is_split(self) -> bool:
-        return bool(self.second_half)
+        return self.second is not None and len(self.second) > 0
 
 
 @dataclass
@@ -41,23 +66,81 @@ class ProcessingStats:
     avg_chunk_size: float
     max_chunk_size: int
     min_chunk_size: int
+    cache_hits: int = 0
+    cache_misses: int = 0
+    # по одной записи на волну повторного деления: {"chunks", "split", "seconds", "cache_hits", "cache_misses"}
+    resplit_waves: list[dict[str, Any]] = field(default_factory=list)
+    # размер самого большого сегмента в токенах (только в режиме max_chunk_tokens)
+    max_chunk_tokens: int = 0
 
 
 class SemanticHalver(dspy.Module):
-    """DSPy модуль для смыслового разделения текста на две части."""
+    """
+    DSPy модуль для смыслового разделения текста на две части.
+
+    Режимы:
+    - "echo" (по умолчанию): LLM возвращает текст первого блока целиком,
+      индекс разреза ищется через TextMatcher;
+    - "boundary": в тексте нумеруются границы предложений/абзацев, LLM возвращает
+      только номер границы — выходных токенов на порядок меньше, индекс точный.
+    """
+
+    MODES = ("echo", "boundary")
 
-    def __init__(self):
+    def __init__(self, cache: HalverCache | None = None, mode: str = "echo"):
         super().__init__()
-        # Predict обеспечивает более высокую скорость работы
-        self.halver = dspy.Predict(SemanticHalverSignature)
+        if mode not in self.MODES:
+            raise ValueError(f"Неизвестный режим SemanticHalver: {mode!r} (ожидается один из {self.MODES})")
+        self.mode = mode
+        # Predict обеспечивает более высокую скорость работы.
+        # Предиктор создаётся только для выбранного режима, чтобы сохранённые
+        # артефакты оптимизации разных режимов не смешивались.
+        if mode == "boundary":
+            self.boundary_halver = dspy.Predict(SemanticBoundarySignature)
+        else:
+            self.halver = dspy.Predict(SemanticHalverSignature)
         self.matcher = TextMatcher()
+        self.cache = cache
 
-    def forward(self, text: str) -> tuple[dspy.Prediction, Any]:
+    @property
+    def predictor(self) -> dspy.Predict:
+        return self.boundary_halver if self.mode == "boundary" else self.halver
+
+    def _cache_key(self, inputs: dict[str, str]) -> str:
+        """Ключ кэша: входы предиктора + режим и состояние промпта + модель и параметры генерации LM."""
+        lm = getattr(self.predictor, "lm", None) or dspy.settings.lm
+        model = HalverCache.model_identity(lm)
+        program = {"mode": self.mode, "state": self.predictor.dump_state()}
+        return HalverCache.make_key(json.dumps(inputs, sort_keys=True, ensure_ascii=False), program, model)
+
+    def _predict(self, **inputs: str) -> dspy.Prediction:
+        """Вызов LLM через персистентный кэш (если он подключён)."""
+        if self.cache is None:
+            return self.predictor(**inputs)
+
+        key = self._cache_key(inputs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            logger.debug("[CACHE_HIT] ответ halver взят из кэша")
+            prediction = dspy.Prediction(**cached)
+            # признак попадания едет с ответом: счётчики кэша общие для всех вызовов сплиттера
+            prediction._cache_hit = True
+            return prediction
+
+        prediction = self.predictor(**inputs)
+        output_field = "boundary_id" if self.mode == "boundary" else "first_block"
+        self.cache.put(key, {output_field: getattr(prediction, output_field, None)})
+        prediction._cache_hit = False
+        return prediction
+
+    def forward(self, text: str, boundary_index: BoundaryIndex | None = None) -> tuple[dspy.Prediction, Any]:
         """
         Выполняет семантическое разделение текста на два блока.
 
         Args:
             text: Исходный текст для разделения
+            boundary_index: Индекс границ для text (обычно вид на индекс документа);
+                если не задан, TextMatcher построит его по text
 
         Returns:
             dspy.Prediction с полями:
@@ -69,7 +152,11 @@ class SemanticHalver(dspy.Module):
         if not text or not isinstance(text, str):
             return self._handle_error("EMPTY_INPUT", "текст пустой или не является строкой", logging.WARNING)
 
-        text = text.strip()
+        stripped = text.strip()
+        if boundary_index is not None:
+            lead = len(text) - len(text.lstrip())
+            boundary_index = boundary_index.view(lead, lead + len(stripped))
+        text = stripped
         if len(text) < 50:
             logger.info(f"[TOO_SHORT] текст слишком короткий (len={len(text)}), возвращаем без изменений")
             return (
@@ -81,35 +168,32 @@ class SemanticHalver(dspy.Module):
                 None,
             )
 
+        boundaries: list[int] = []
+        if self.mode == "boundary":
+            numbered_text, boundaries = BoundaryMarker.number_boundaries(text)
+            if not boundaries:
+                return self._handle_error("NO_BOUNDARIES", "в тексте не найдено границ предложений", logging.WARNING)
+            inputs = {"numbered_text": numbered_text}
+        else:
+            inputs = {"text": text}
+
         # 2. Вызов LLM
         try:
-            prediction = self.halver(text=text)
-        except (RequestException, TimeoutError, dspy.utils.DSPyTimeoutError) as e:
+            prediction = self._predict(**inputs)
+        except _NETWORK_ERRORS as e:
             return self._handle_error("NETWORK_OR_TIMEOUT", str(e))
         except Exception as e:
+            if "RateLimit" in type(e).__name__:
+                # litellm.RateLimitError и аналоги провайдеров
+                return self._handle_error("RATE_LIMIT", f"{type(e).__name__}: {e}")
             return self._handle_error("UNEXPECTED", f"{type(e).__name__}: {e}")
 
-        # 3. Извлечение и нормализация результата
-        first_block = getattr(prediction, "first_block", "")
-        if first_block is None:
-            first_block = ""
-        elif not isinstance(first_block, str):
-            first_block = str(first_block)
-
-        first_block = first_block.strip()
-
-        # 4. Сопоставление с исходным текстом
-        split_index = 0
-        if not first_block:
-            logger.warning("[EMPTY_BLOCK] LLM вернул пустой first_block")
+        # 3-4. Извлечение результата и сопоставление с исходным текстом
+        if self.mode == "boundary":
+            split_index = self._split_index_from_boundary(prediction, boundaries)
+            prediction.first_block = text[:split_index] if split_index > 0 else ""
         else:
-            # Даже если LLM вернул слишком большой блок (иногда он «продолжает» дальше границ чанка),
-            # пытаемся сопоставить и/или применить fallback-стратегии в TextMatcher.
-            if len(first_block) >= len(text):
-                logger.warning(
-                    f"[BLOCK_TOO_LARGE] first_block (len={len(first_block)}) >= исходного текста; пробуем matcher/fallback"
-                )
-            split_index = self.matcher.find_split_index(text, first_block)
+            split_index = self._split_index_from_echo(prediction, text, boundary_index)
 
         # 5. Финальная валидация индекса
         if split_index >= len(text):
@@ -125,6 +209,40 @@ class SemanticHalver(dspy.Module):
         # dspy.Parallel ожидает пару (prediction, trace)
         return prediction, None
 
+    def _split_index_from_echo(
+        self, prediction: dspy.Prediction, text: str, boundary_index: BoundaryIndex | None = None
+    ) -> int:
+        """Режим echo: ищем возвращённый first_block в исходном тексте."""
+        first_block = getattr(prediction, "first_block", "")
+        if first_block is None:
+            first_block = ""
+        elif not isinstance(first_block, str):
+            first_block = str(first_block)
+
+        first_block = first_block.strip()
+
+        if not first_block:
+            logger.warning("[EMPTY_BLOCK] LLM вернул пустой first_block")
+            return 0
+
+        # Даже если LLM вернул слишком большой блок (иногда он «продолжает» дальше границ чанка),
+        # пытаемся сопоставить и/или применить fallback-стратегии в TextMatcher.
+        if len(first_block) >= len(text):
+            logger.warning(
+                f"[BLOCK_TOO_LARGE] first_block (len={len(first_block)}) >= исходного текста; пробуем matcher/fallback"
+            )
+        return self.matcher.find_split_index(text, first_block, index=boundary_index)
+
+    @staticmethod
+    def _split_index_from_boundary(prediction: dspy.Prediction, boundaries: list[int]) -> int:
+        """Режим boundary: номер метки напрямую отображается в индекс разреза."""
+        raw = getattr(prediction, "boundary_id", None)
+        boundary_id = BoundaryMarker.parse_boundary_id(raw)
+        if boundary_id is None or not (1 <= boundary_id <= len(boundaries)):
+            logger.warning(f"[BAD_BOUNDARY_ID] LLM вернул некорректный номер границы: {raw!r}")
+            return 0
+        return boundaries[boundary_id - 1]
+
     def _handle_error(self, code: str, message: str, level: int = logging.ERROR) -> tuple[dspy.Prediction, Any]:
         """Вспомогательный метод для единообразной обработки ошибок."""
         full_msg = f"[{code}] {message}"
@@ -148,13 +266,40 @@ class SemanticParallelSplitter(dspy.Module):
     2) Параллельный SemanticHalver для каждого чанка
     3) Склейка second(i)+first(i+1)
     4) Повторное деление чанков > max_chunk_size (с ограничением итераций)
+
+    Внутри все стадии работают с фрагментами (`TextSpan`) одного неизменяемого
+    буфера: строки материализуются только для вызова LLM и в результате, а
+    исходные пробелы между частями сохраняются. Вместе с `segments` возвращаются
+    `offsets` — пары (start, end) в исходном тексте.
+
+    Размер чанков задаётся в символах (`max_chunk_size`/`min_chunk_len`) или в
+    токенах (`max_chunk_tokens`/`min_chunk_tokens`, стоимость считает
+    `token_counter`); в токенном режиме ни один запрос к LLM не превышает
+    `max_request_tokens` — слишком большие чанки делятся локально.
+
+    Для больших документов есть потоковый режим `iter_segments`: текст читается
+    инкрементально, в памяти держится только окно из `num_threads` чанков.
     """
 
     _SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?。\u3002\uFF01\uFF1F])\s+(?=[A-ZА-ЯЁa-zа-яё])")
 
-    def __init__(self, halver: SemanticHalver | None = None):
+    def __init__(self, halver: SemanticHalver | None = None, token_counter: TokenCounter | None = None):
+        """
+        Args:
+            halver: Модуль деления чанка пополам (по умолчанию SemanticHalver)
+            token_counter: Функция стоимости текста в токенах для режима
+                `max_chunk_tokens` (по умолчанию офлайн-оценка estimate_tokens)
+        """
         super().__init__()
         self.halver = halver or SemanticHalver()
+        self.token_counter = token_counter or estimate_tokens
+
+    @classmethod
+    def _resolve_num_threads(cls, value: Any) -> int:
+        """Число потоков; "auto" — верхняя граница адаптивного лимита LM (см. `config.concurrency`)."""
+        if isinstance(value, str) and value.strip().lower() == "auto":
+            return resolve_num_threads("auto")
+        return cls._coerce_int(value) or 4
 
     @staticmethod
     def _coerce_int(value: Any) -> int | None:
@@ -175,58 +320,210 @@ class SemanticParallelSplitter(dspy.Module):
         except Exception:
             return None
 
-    def _split_into_sentence_chunks(self, text: str, max_chunk_size: int) -> list[str]:
-        text = (text or "").strip()
-        if not text:
+    def _make_budget(
+        self,
+        max_chunk_size: int | str,
+        min_chunk_len: int | str,
+        max_chunk_tokens: int | str | None,
+        min_chunk_tokens: int | str | None,
+        max_request_tokens: int | str | None,
+    ) -> ChunkBudget:
+        """Лимиты размера чанков: в токенах, если задан max_chunk_tokens, иначе в символах."""
+        max_chunk_tokens_i = self._coerce_int(max_chunk_tokens)
+        if max_chunk_tokens_i and max_chunk_tokens_i > 0:
+            return ChunkBudget.tokens(
+                max_chunk_tokens_i,
+                min_chunk_tokens=self._coerce_int(min_chunk_tokens) or 0,
+                counter=self.token_counter,
+                max_request_tokens=self._coerce_int(max_request_tokens),
+            )
+        return ChunkBudget.chars(
+            self._coerce_int(max_chunk_size) or 3000,
+            self._coerce_int(min_chunk_len) or 100,
+        )
+
+    def _split_into_sentence_spans(self, doc: TextSpan, budget: ChunkBudget) -> list[TextSpan]:
+        """Упаковывает предложения фрагмента `doc` в чанки размером не больше budget.max_size."""
+        doc = doc.strip()
+        if not len(doc):
             return []
-        if max_chunk_size <= 0 or len(text) <= max_chunk_size:
-            return [text]
+        if budget.max_size <= 0 or budget.size(doc) <= budget.max_size:
+            return [doc]
+
+        chunks: list[TextSpan] = []
+        current: TextSpan | None = None
+        current_size = 0
+        sentence_start = doc.start
+
+        def sentences() -> Iterator[TextSpan]:
+            nonlocal sentence_start
+            for m in self._SENTENCE_SPLIT_RE.finditer(doc.source, doc.start, doc.end):
+                yield TextSpan(doc.source, sentence_start, m.start(), doc.base, doc.index)
+                sentence_start = m.end()
+            yield TextSpan(doc.source, sentence_start, doc.end, doc.base, doc.index)
+
+        for sentence in sentences():
+            if not len(sentence):
+                continue
+            sentence_size = budget.size(sentence)
+            if budget.max_request is not None and sentence_size > budget.max_request:
+                # предложение не помещается даже в запрос — режем по пробелам
+                if current is not None:
+                    chunks.append(current)
+                    current = None
+                chunks.extend(self._cut_to_size(sentence, budget, budget.max_size))
+                continue
 
-        sentences = [s.strip() for s in self._SENTENCE_SPLIT_RE.split(text) if s and s.strip()]
-        if not sentences:
-            return [text]
+            # чанк растёт вместе с исходными пробелами между предложениями
+            if current is None:
+                current, current_size = sentence, sentence_size
+                continue
+            candidate = current.merge(sentence)
+            # в символах размер склейки точный, в токенах — сумма по предложениям
+            candidate_size = current_size + sentence_size if budget.in_tokens else len(candidate)
+            if candidate_size <= budget.max_size:
+                current, current_size = candidate, candidate_size
+                continue
 
-        chunks: list[str] = []
-        current = ""
+            chunks.append(current)
+            # Если предложение само по себе больше max_chunk_size, оставляем как есть
+            current, current_size = sentence, sentence_size
 
-        for sentence in sentences:
-            candidate = (current + " " + sentence).strip() if current else sentence
-            if len(candidate) <= max_chunk_size:
-                current = candidate
-                continue
+        if current is not None:
+            chunks.append(current)
 
-            if current:
-                chunks.append(current.strip())
+        return chunks or [doc]
 
-            # Если предложение само по себе больше max_chunk_size, оставляем как есть
-            current = sentence
+    @staticmethod
+    def _cut_to_size(span: TextSpan, budget: ChunkBudget, limit: int) -> list[TextSpan]:
+        """Жёстко режет фрагмент по пробелам на части размером не больше limit."""
+        parts: list[TextSpan] = []
+        rest = span.strip()
+        while len(rest):
+            if budget.size(rest) <= limit:
+                parts.append(rest)
+                break
+            cut = budget.cut_prefix(rest, limit)
+            head = rest.slice(0, cut).strip()
+            if len(head):
+                parts.append(head)
+            rest = rest.slice(cut).strip()
+        return parts
 
-        if current:
-            chunks.append(current.strip())
+    @staticmethod
+    def _read_stream(stream: str | IO[str] | Iterable[str], read_size: int) -> Iterator[str]:
+        """Приводит вход потокового режима к итератору кусков текста."""
+        if isinstance(stream, str):
+            for i in range(0, len(stream), read_size):
+                yield stream[i : i + read_size]
+            return
+        if hasattr(stream, "read"):
+            yield from iter(partial(stream.read, read_size), "")
+            return
+        yield from stream
+
+    def _iter_sentence_spans(self, pieces: Iterable[str], budget: ChunkBudget) -> Iterator[TextSpan]:
+        """
+        Потоковый аналог `_split_into_sentence_spans`.
+
+        В буфере держится ~2 чанка (`budget.window_chars` символов): всё, что левее
+        последней границы предложения, упаковывается в чанки, последний (возможно
+        неполный) чанк остаётся в буфере. Если границ предложений нет совсем,
+        буфер режется по пробелу, чтобы память оставалась ограниченной.
+        Отданные фрагменты ссылаются на ту версию буфера, из которой получены;
+        `base` — смещение буфера от начала потока.
+        """
+        if budget.max_size <= 0:
+            text = "".join(pieces)
+            yield from self._split_into_sentence_spans(TextSpan.of(text), budget)
+            return
+
+        window = budget.window_chars
+        buf = ""
+        base = 0
+        for piece in pieces:
+            if not piece:
+                continue
+            buf += piece
+            while len(buf) > window:
+                boundary = None
+                for m in self._SENTENCE_SPLIT_RE.finditer(buf):
+                    boundary = m
+                chunks = (
+                    self._split_into_sentence_spans(TextSpan(buf, 0, boundary.start(), base), budget)
+                    if boundary
+                    else []
+                )
+                if len(chunks) >= 2:
+                    yield from chunks[:-1]
+                    cut = chunks[-1].start
+                else:
+                    # Нет прогресса по предложениям — жёсткий разрез по ближайшему пробелу/переводу строки
+                    cut = budget.cut_prefix(TextSpan(buf, 0, len(buf), base), budget.max_size)
+                    head = TextSpan(buf, 0, cut, base).strip()
+                    if len(head):
+                        yield head
+                buf = buf[cut:]
+                base += cut
 
-        return chunks or [text]
+        yield from self._split_into_sentence_spans(TextSpan(buf, 0, len(buf), base), budget)
 
-    def _split_chunk_semantically(self, chunk: str, min_chunk_len: int) -> ChunkSplit:
-        if not chunk:
-            return ChunkSplit(first_half="", second_half="", split_index=0, failure_reason="Пустой чанк")
-        if min_chunk_len > 0 and len(chunk) < min_chunk_len:
+    @staticmethod
+    def _split_without_llm(chunk: TextSpan, budget: ChunkBudget) -> ChunkSplit | None:
+        """
+        Решение по чанку без вызова LLM: пустой/слишком короткий чанк не делится,
+        чанк больше лимита запроса делится локально. None — чанк нужно отдать halver.
+        """
+        if not len(chunk):
+            return ChunkSplit(first=chunk, second=None, split_index=0, failure_reason="Пустой чанк")
+        if budget.min_size > 0 and budget.size(chunk) < budget.min_size:
+            unit = "токенов" if budget.in_tokens else "символов"
             return ChunkSplit(
-                first_half=chunk,
-                second_half="",
+                first=chunk,
+                second=None,
                 split_index=0,
-                failure_reason=f"Чанк слишком короткий (<{min_chunk_len} символов)",
+                failure_reason=f"Чанк слишком короткий (<{budget.min_size} {unit})",
             )
+        if budget.exceeds_request(chunk):
+            return SemanticParallelSplitter._split_locally(chunk, budget)
+        return None
 
-        try:
-            pred, _trace = self.halver(text=chunk)
-        except Exception as e:
-            return ChunkSplit(
-                first_half=chunk,
-                second_half="",
-                split_index=0,
-                failure_reason=f"Ошибка вызова halver: {type(e).__name__}: {e}",
-            )
+    @staticmethod
+    def _split_locally(chunk: TextSpan, budget: ChunkBudget) -> ChunkSplit:
+        """Делит чанк пополам по стоимости у ближайшей границы предложения/строки/пробела."""
+        text = chunk.text
+        index = chunk.boundary_index()
+        target = budget.cut_prefix(chunk, budget.size(chunk) // 2)
+        split_idx = (
+            TextMatcher._fallback_sentence(text, target, index)
+            or TextMatcher._fallback_structural(text, target, index)
+            or TextMatcher._fallback_hard(text, target, index)
+        )
+        logger.info(
+            f"[REQUEST_TOO_LARGE] чанк ({budget.size(chunk)} > {budget.max_request}) делится локально: "
+            f"split_index={split_idx}"
+        )
+        first = chunk.slice(0, split_idx).strip()
+        second = chunk.slice(split_idx).strip()
+        if not (len(first) and len(second)):
+            return ChunkSplit(first=chunk, second=None, split_index=0, failure_reason="Не удалось разделить локально")
+        return ChunkSplit(first=first, second=second, split_index=split_idx)
+
+    @classmethod
+    def _split_from_prediction(cls, chunk: TextSpan, pred: Any, failure_reason: str) -> ChunkSplit:
+        split = cls._split_at_predicted_index(chunk, pred, failure_reason)
+        split.cache_hit = getattr(pred, "_cache_hit", None)
+        return split
+
+    @staticmethod
+    def _cache_counts(splits: list[ChunkSplit]) -> tuple[int, int]:
+        """Попадания и промахи кэша halver среди результатов (hits, misses)."""
+        hits = sum(1 for s in splits if s.cache_hit is True)
+        misses = sum(1 for s in splits if s.cache_hit is False)
+        return hits, misses
 
+    @staticmethod
+    def _split_at_predicted_index(chunk: TextSpan, pred: Any, failure_reason: str) -> ChunkSplit:
         split_idx = getattr(pred, "split_index", 0)
         try:
             split_idx = int(split_idx)
@@ -235,193 +532,279 @@ class SemanticParallelSplitter(dspy.Module):
 
         if not (0 < split_idx < len(chunk)):
             return ChunkSplit(
-                first_half=chunk,
-                second_half="",
+                first=chunk,
+                second=None,
                 split_index=0,
-                failure_reason=f"Некорректный split_index={split_idx}",
+                failure_reason=f"{failure_reason}: split_index={split_idx}",
             )
 
-        first_half = chunk[:split_idx].strip()
-        second_half = chunk[split_idx:].strip()
-
-        if not second_half:
+        first = chunk.slice(0, split_idx).strip()
+        second = chunk.slice(split_idx).strip()
+        if not len(second):
             return ChunkSplit(
-                first_half=chunk,
-                second_half="",
+                first=chunk,
+                second=None,
                 split_index=0,
                 failure_reason=f"Вторая часть пуста после split_index={split_idx}",
             )
+        return ChunkSplit(first=first, second=second, split_index=split_idx)
 
-        return ChunkSplit(first_half=first_half, second_half=second_half, split_index=split_idx)
+    def _split_chunk_semantically(self, chunk: TextSpan, budget: ChunkBudget) -> ChunkSplit:
+        decided = self._split_without_llm(chunk, budget)
+        if decided is not None:
+            return decided
 
-    def _split_chunks_parallel(self, chunks: list[str], num_threads: int, min_chunk_len: int) -> list[ChunkSplit]:
+        try:
+            pred, _trace = self.halver(text=chunk.text, boundary_index=chunk.boundary_index())
+        except Exception as e:
+            return ChunkSplit(
+                first=chunk,
+                second=None,
+                split_index=0,
+                failure_reason=f"Ошибка вызова halver: {type(e).__name__}: {e}",
+            )
+
+        return self._split_from_prediction(chunk, pred, "Некорректный split_index")
+
+    def _split_chunks_parallel(self, chunks: list[TextSpan], num_threads: int, budget: ChunkBudget) -> list[ChunkSplit]:
         if not chunks:
             return []
 
-        examples = [dspy.Example(text=c).with_inputs("text") for c in chunks]
+        # короткие и слишком большие для запроса чанки решаются без LLM
+        splits: list[ChunkSplit | None] = [self._split_without_llm(c, budget) for c in chunks]
+        pending = [i for i, r in enumerate(splits) if r is None]
+        if not pending:
+            return splits
+
+        # строки чанков материализуются только здесь — для вызова LLM;
+        # индекс границ передаётся видом на индекс исходного буфера
+        examples = [
+            dspy.Example(text=chunks[i].text, boundary_index=chunks[i].boundary_index()).with_inputs(
+                "text", "boundary_index"
+            )
+            for i in pending
+        ]
         exec_pairs = [(self.halver, ex) for ex in examples]
 
-        parallel = dspy.Parallel(num_threads=max(1, int(num_threads)), max_errors=len(chunks), provide_traceback=True)
+        parallel = dspy.Parallel(num_threads=max(1, int(num_threads)), max_errors=len(pending), provide_traceback=True)
         try:
             results = parallel(exec_pairs)
         except Exception as e:
             details = f"{type(e).__name__}: {e}"
-            out: list[ChunkSplit] = []
-            for c in chunks:
-                r = self._split_chunk_semantically(c, min_chunk_len=min_chunk_len)
+            for i in pending:
+                r = self._split_chunk_semantically(chunks[i], budget)
                 if not r.is_split:
                     r.failure_reason = (r.failure_reason or "Не удалось разделить") + f" | parallel failed: {details}"
-                out.append(r)
-            return out
-
-        preds: list[Any] = []
-        for item in results:
-            if isinstance(item, tuple) and len(item) == 2:
-                preds.append(item[0])
-            else:
-                preds.append(item)
-
-        splits: list[ChunkSplit] = []
-        for chunk, pred in zip(chunks, preds):
-            if min_chunk_len > 0 and len(chunk) < min_chunk_len:
-                splits.append(
-                    ChunkSplit(
-                        first_half=chunk,
-                        second_half="",
-                        split_index=0,
-                        failure_reason=f"Чанк слишком короткий (<{min_chunk_len} символов)",
-                    )
-                )
-                continue
+                splits[i] = r
+            return splits
 
-            split_idx = getattr(pred, "split_index", 0)
-            try:
-                split_idx = int(split_idx)
-            except Exception:
-                split_idx = 0
-
-            if 0 < split_idx < len(chunk):
-                first_half = chunk[:split_idx].strip()
-                second_half = chunk[split_idx:].strip()
-                if second_half:
-                    splits.append(ChunkSplit(first_half=first_half, second_half=second_half, split_index=split_idx))
-                    continue
-
-            splits.append(
-                ChunkSplit(
-                    first_half=chunk,
-                    second_half="",
-                    split_index=0,
-                    failure_reason=f"Не удалось разделить параллельно: split_index={split_idx}",
-                )
-            )
+        for i, item in zip(pending, results):
+            pred = item[0] if isinstance(item, tuple) and len(item) == 2 else item
+            splits[i] = self._split_from_prediction(chunks[i], pred, "Не удалось разделить параллельно")
 
         return splits
 
     @staticmethod
-    def _merge_adjacent_halves(splits: list[ChunkSplit]) -> list[str]:
+    def _join_halves(second: TextSpan | None, first: TextSpan | None) -> TextSpan | None:
+        """Склейка second(i)+first(i+1) вместе с исходными пробелами между ними."""
+        if second is not None and len(second) and first is not None and len(first):
+            return second.merge(first)
+        if second is not None and len(second):
+            return second
+        if first is not None and len(first):
+            return first
+        return None
+
+    @classmethod
+    def _merge_adjacent_halves(cls, splits: list[ChunkSplit]) -> list[TextSpan]:
         if not splits:
             return []
 
-        merged: list[str] = []
-
-        if splits[0].first_half:
-            merged.append(splits[0].first_half)
-
+        merged: list[TextSpan | None] = [cls._join_halves(None, splits[0].first)]
         for i in range(len(splits) - 1):
-            current_second = splits[i].second_half
-            next_first = splits[i + 1].first_half
-
-            if current_second and next_first:
-                merged.append(f"{current_second} {next_first}".strip())
-            elif current_second:
-                merged.append(current_second)
-            elif next_first:
-                merged.append(next_first)
-
-        if splits[-1].second_half and not splits[-1].second_half.isspace():
-            merged.append(splits[-1].second_half)
+            merged.append(cls._join_halves(splits[i].second, splits[i + 1].first))
+        merged.append(cls._join_halves(splits[-1].second, None))
 
-        return [c for c in merged if c and c.strip()]
+        return [c for c in merged if c is not None and not c.is_blank()]
 
     def _resplit_large_chunks(
         self,
-        chunks: list[str],
-        max_chunk_size: int,
-        min_chunk_len: int,
+        chunks: list[TextSpan],
+        budget: ChunkBudget,
         max_iters: int,
-    ) -> list[str]:
+        num_threads: int = 4,
+        waves: list[dict[str, Any]] | None = None,
+    ) -> list[TextSpan]:
+        """
+        Повторно делит чанки размером больше budget.max_size.
+
+        На каждой итерации все слишком большие чанки отправляются одной
+        параллельной волной через `_split_chunks_parallel`. Если передан `waves`,
+        в него дописывается статистика по каждой волне.
+        """
         if not chunks:
             return []
-        if max_chunk_size <= 0:
+        if budget.max_size <= 0:
             return chunks
 
         out = chunks[:]
         for _ in range(max(0, int(max_iters))):
-            changed = False
-            next_out: list[str] = []
+            oversized = [i for i, chunk in enumerate(out) if budget.size(chunk) > budget.max_size]
+            if not oversized:
+                break
 
-            for chunk in out:
-                if len(chunk) <= max_chunk_size:
-                    next_out.append(chunk)
-                    continue
+            started = time.perf_counter()
+            splits = self._split_chunks_parallel(
+                [out[i] for i in oversized],
+                num_threads=num_threads,
+                budget=budget,
+            )
+            by_index = dict(zip(oversized, splits))
 
-                split_result = self._split_chunk_semantically(chunk, min_chunk_len=min_chunk_len)
-                if split_result.is_split:
+            changed = False
+            next_out: list[TextSpan] = []
+            for i, chunk in enumerate(out):
+                split_result = by_index.get(i)
+                if split_result is not None and split_result.is_split:
                     # прогресс: обе части должны быть короче исходного чанка
-                    if len(split_result.first_half) < len(chunk) and len(split_result.second_half) < len(chunk):
-                        next_out.append(split_result.first_half)
-                        next_out.append(split_result.second_half)
+                    if len(split_result.first) < len(chunk) and len(split_result.second) < len(chunk):
+                        next_out.append(split_result.first)
+                        next_out.append(split_result.second)
                         changed = True
                         continue
 
                 next_out.append(chunk)
 
+            if waves is not None:
+                hits, misses = self._cache_counts(splits)
+                waves.append(
+                    {
+                        "chunks": len(oversized),
+                        "split": sum(1 for r in splits if r.is_split),
+                        "seconds": round(time.perf_counter() - started, 3),
+                        "cache_hits": hits,
+                        "cache_misses": misses,
+                    }
+                )
+
             out = next_out
             if not changed:
                 break
 
-        return [c for c in out if c and c.strip()]
+        return [c for c in out if not c.is_blank()]
 
     @staticmethod
-    def _apply_constraints(segments: list[str], max_segments: int | None, min_segment_length: int | None) -> list[str]:
-        cleaned = [s.strip() for s in (segments or []) if s and s.strip()]
+    def _apply_constraints(
+        segments: list[TextSpan], max_segments: int | None, min_segment_length: int | None
+    ) -> list[TextSpan]:
+        cleaned = [s.strip() for s in (segments or [])]
+        cleaned = [s for s in cleaned if len(s)]
         if not cleaned:
             return []
 
         # min_segment_length: сливаем короткие сегменты со следующими
         if min_segment_length is not None and min_segment_length > 0:
-            merged: list[str] = []
-            buf = ""
-            for s in cleaned:
-                if not buf:
-                    buf = s
-                    continue
-                if len(buf) < min_segment_length:
-                    buf = f"{buf} {s}".strip()
-                else:
-                    merged.append(buf)
-                    buf = s
-            if buf:
-                merged.append(buf)
-            cleaned = merged
+            cleaned = merge_short_segments(cleaned, int(min_segment_length))
 
-        # max_segments: сливаем самые короткие соседние пары
+        # max_segments: сливаем самые короткие соседние пары (куча + связный список, O(n log n))
         if max_segments is not None and max_segments > 0:
-            max_segments = int(max_segments)
-            while len(cleaned) > max_segments and len(cleaned) >= 2:
-                best_i = 0
-                best_len = len(cleaned[0]) + len(cleaned[1])
-                for i in range(len(cleaned) - 1):
-                    pair_len = len(cleaned[i]) + len(cleaned[i + 1])
-                    if pair_len < best_len:
-                        best_len = pair_len
-                        best_i = i
-                merged_pair = f"{cleaned[best_i]} {cleaned[best_i + 1]}".strip()
-                cleaned = cleaned[:best_i] + [merged_pair] + cleaned[best_i + 2 :]
+            cleaned = merge_shortest_pairs(cleaned, int(max_segments))
 
         return cleaned
 
+    def iter_segments(
+        self,
+        stream: str | IO[str] | Iterable[str],
+        min_segment_length: int | str | None = None,
+        max_chunk_size: int | str = 3000,
+        num_threads: int | str = 4,
+        min_chunk_len: int | str = 100,
+        max_resplit_iters: int | str = 3,
+        read_size: int = 64 * 1024,
+        with_offsets: bool = False,
+        max_chunk_tokens: int | str | None = None,
+        min_chunk_tokens: int | str | None = None,
+        max_request_tokens: int | str | None = None,
+    ) -> Iterator[str] | Iterator[tuple[str, int, int]]:
+        """
+        Потоковая сегментация с ограниченным потреблением памяти.
+
+        Вход читается инкрементально (строка, файловый объект или итерируемое
+        кусков текста). Чанки обрабатываются окнами по `num_threads` штук; сегмент
+        second(i)+first(i+1) отдаётся сразу после того, как готов halving чанка i+1.
+        `max_segments` в потоковом режиме не поддерживается: для него нужен весь документ.
+
+        Yields:
+            Готовые сегменты в порядке следования в тексте; при `with_offsets=True` —
+            кортежи (segment, start, end) со смещениями от начала потока.
+        """
+        min_segment_length_i = self._coerce_int(min_segment_length)
+        num_threads_i = self._resolve_num_threads(num_threads)
+        max_resplit_iters_i = self._coerce_int(max_resplit_iters) or 3
+        budget = self._make_budget(
+            max_chunk_size, min_chunk_len, max_chunk_tokens, min_chunk_tokens, max_request_tokens
+        )
+
+        pieces = self._read_stream(stream, max(1, int(read_size)))
+        chunks = self._iter_sentence_spans(pieces, budget)
+
+        def finalize(segment: TextSpan) -> Iterator[TextSpan]:
+            yield from self._resplit_large_chunks(
+                [segment],
+                budget=budget,
+                max_iters=max_resplit_iters_i,
+                num_threads=num_threads_i,
+            )
+
+        def merged_segments() -> Iterator[TextSpan]:
+            tail: TextSpan | None = None
+            started = False
+            window: list[TextSpan] = []
+
+            def flush() -> Iterator[TextSpan]:
+                nonlocal tail, started
+                splits = self._split_chunks_parallel(window, num_threads=num_threads_i, budget=budget)
+                window.clear()
+                for split in splits:
+                    # та же логика, что и в _merge_adjacent_halves, но по одному чанку
+                    segment = self._join_halves(tail if started else None, split.first)
+                    started = True
+                    if segment is not None and not segment.is_blank():
+                        yield from finalize(segment)
+                    tail = split.second
+
+            for chunk in chunks:
+                window.append(chunk)
+                if len(window) >= num_threads_i:
+                    yield from flush()
+            if window:
+                yield from flush()
+            if tail is not None and not tail.is_blank():
+                yield from finalize(tail)
+
+        def segments() -> Iterator[TextSpan]:
+            # min_segment_length: сливаем короткие сегменты со следующими (как в _apply_constraints)
+            buf: TextSpan | None = None
+            for segment in merged_segments():
+                segment = segment.strip()
+                if not len(segment):
+                    continue
+                if not min_segment_length_i or min_segment_length_i <= 0:
+                    yield segment
+                    continue
+                if buf is None:
+                    buf = segment
+                elif len(buf) < min_segment_length_i:
+                    buf = buf.merge(segment)
+                else:
+                    yield buf
+                    buf = segment
+            if buf is not None:
+                yield buf
+
+        for span in segments():
+            yield (span.text, span.doc_start, span.doc_end) if with_offsets else span.text
+
     def forward(
         self,
         input_text: str | None = None,
@@ -431,17 +814,37 @@ class SemanticParallelSplitter(dspy.Module):
         num_threads: int | str = 4,
         min_chunk_len: int | str = 100,
         max_resplit_iters: int | str = 3,
+        max_chunk_tokens: int | str | None = None,
+        min_chunk_tokens: int | str | None = None,
+        max_request_tokens: int | str | None = None,
     ) -> dspy.Prediction:
-        text = (input_text or "").strip()
+        """
+        Сегментирует текст.
+
+        Размер чанков задаётся в символах (`max_chunk_size`, `min_chunk_len`) или,
+        если передан `max_chunk_tokens`, в токенах (`min_chunk_tokens`,
+        `max_request_tokens` — жёсткий лимит текста одного запроса к LLM,
+        по умолчанию 2 * max_chunk_tokens).
+
+        `num_threads="auto"` — пул по верхней границе адаптивного лимита
+        параллелизма LM; сколько запросов реально идёт одновременно, решает
+        контроллер (`config.concurrency`).
+
+        Returns:
+            dspy.Prediction с полями segments, offsets (пары (start, end) в
+            input_text) и stats.
+        """
+        source = input_text or ""
 
         max_segments_i = self._coerce_int(max_segments)
         min_segment_length_i = self._coerce_int(min_segment_length)
-        max_chunk_size_i = self._coerce_int(max_chunk_size) or 3000
-        num_threads_i = self._coerce_int(num_threads) or 4
-        min_chunk_len_i = self._coerce_int(min_chunk_len) or 100
+        num_threads_i = self._resolve_num_threads(num_threads)
         max_resplit_iters_i = self._coerce_int(max_resplit_iters) or 3
+        budget = self._make_budget(
+            max_chunk_size, min_chunk_len, max_chunk_tokens, min_chunk_tokens, max_request_tokens
+        )
 
-        if not text:
+        if not source.strip():
             empty_stats = ProcessingStats(
                 initial_chunks=0,
                 successfully_split=0,
@@ -451,28 +854,34 @@ class SemanticParallelSplitter(dspy.Module):
                 max_chunk_size=0,
                 min_chunk_size=0,
             )
-            return dspy.Prediction(segments=[], stats=asdict(empty_stats))
+            return dspy.Prediction(segments=[], offsets=[], stats=asdict(empty_stats))
+
+        # Документ — единственный буфер; границы индексируются один раз,
+        # все чанки получают виды на этот индекс (fallback-стратегии TextMatcher)
+        doc = TextSpan.of(source, index=BoundaryIndex(source)).strip()
 
         # 1) pre-split по предложениям
-        initial_chunks = self._split_into_sentence_chunks(text, max_chunk_size=max_chunk_size_i)
+        initial_chunks = self._split_into_sentence_spans(doc, budget)
 
         # 2) параллельный halving
         splits = self._split_chunks_parallel(
             initial_chunks,
             num_threads=num_threads_i,
-            min_chunk_len=min_chunk_len_i,
+            budget=budget,
         )
         successfully_split = sum(1 for s in splits if s.is_split)
 
         # 3) merge halves
         merged_chunks = self._merge_adjacent_halves(splits)
 
-        # 4) resplit oversized
+        # 4) resplit oversized (параллельными волнами)
+        resplit_waves: list[dict[str, Any]] = []
         final_chunks = self._resplit_large_chunks(
             merged_chunks,
-            max_chunk_size=max_chunk_size_i,
-            min_chunk_len=min_chunk_len_i,
+            budget=budget,
             max_iters=max_resplit_iters_i,
+            num_threads=num_threads_i,
+            waves=resplit_waves,
         )
 
         # 5) ограничения
@@ -482,6 +891,11 @@ class SemanticParallelSplitter(dspy.Module):
             min_segment_length=min_segment_length_i,
         )
 
+        # попадания кэша считаются по ответам этого вызова, а не по общим счётчикам HalverCache
+        cache_hits, cache_misses = self._cache_counts(splits)
+        cache_hits += sum(wave["cache_hits"] for wave in resplit_waves)
+        cache_misses += sum(wave["cache_misses"] for wave in resplit_waves)
+
         sizes = [len(c) for c in final_chunks]
         stats = ProcessingStats(
             initial_chunks=len(initial_chunks),
@@ -491,6 +905,15 @@ class SemanticParallelSplitter(dspy.Module):
             avg_chunk_size=(sum(sizes) / len(sizes)) if sizes else 0.0,
             max_chunk_size=max(sizes) if sizes else 0,
             min_chunk_size=min(sizes) if sizes else 0,
+            cache_hits=cache_hits,
+            cache_misses=cache_misses,
+            resplit_waves=resplit_waves,
+            max_chunk_tokens=max((budget.size(c) for c in final_chunks), default=0) if budget.in_tokens else 0,
         )
 
-        return dspy.Prediction(segments=final_chunks, stats=asdict(stats))
+        # строки материализуются только на выходе
+        return dspy.Prediction(
+            segments=[c.text for c in final_chunks],
+            offsets=[(c.doc_start, c.doc_end) for c in final_chunks],
+            stats=asdict(stats),
+        )
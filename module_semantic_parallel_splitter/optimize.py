@@ -4,6 +4,7 @@
 import os
 import json
 import dspy
+from config.concurrency import resolve_num_threads
 from .module import SemanticHalver
 from .config import configure_module_llm
 
@@ -250,7 +251,8 @@ def optimize(
         optimizer_type: Тип оптимизатора ('gepa', 'mipro', 'bootstrap')
         metric: Метрика для оценки (если None, используется SemanticHalverMetric)
         **kwargs: Дополнительные параметры для оптимизатора
-                  Для GEPA: auto="light"|"medium"|"heavy", num_threads, valset
+                  Для GEPA: auto="light"|"medium"|"heavy", num_threads (число или "auto" —
+                  по адаптивному лимиту параллелизма LM), valset
         valset_ratio: Доля данных для валидации, если valset не передан
 
     Returns:
@@ -282,7 +284,7 @@ def optimize(
 
         # Извлекаем параметры GEPA
         auto = kwargs.pop('auto', 'light')
-        num_threads = kwargs.pop('num_threads', 4)
+        num_threads = resolve_num_threads(kwargs.pop('num_threads', 4), dspy.settings.lm, reflection_lm)
 
         optimizer = dspy.GEPA(
             metric=metric,
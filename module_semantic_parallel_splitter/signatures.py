@@ -59,4 +59,20 @@ class SemanticHalverSignature(dspy.Signature):
     text = dspy.InputField(desc="Полный текст для анализа и разделения на куски.")
     first_block = dspy.OutputField(
         desc="Первый смысловой кусок из текста - точная подстрока без изменений."
-    )
\ No newline at end of file
+    )
+
+class SemanticBoundarySignature(dspy.Signature):
+    """
+    Определи, где заканчивается первый смысловой кусок текста.
+
+    В тексте после каждой возможной границы (конец предложения или абзаца) стоит метка вида [[N]].
+    Найди первый логически завершенный смысловой блок с самого начала текста: байку, кейс,
+    законченную мысль. Не обрывай логические цепочки.
+
+    Важно:
+    - Верни ТОЛЬКО номер метки N, на которой заканчивается первый смысловой кусок
+    - Не переписывай и не цитируй текст
+    """
+
+    numbered_text = dspy.InputField(desc="Текст с пронумерованными границами [[N]] между предложениями/абзацами.")
+    boundary_id = dspy.OutputField(desc="Номер метки [[N]], на которой заканчивается первый смысловой кусок (только число).")
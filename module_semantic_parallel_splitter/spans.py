@@ -0,0 +1,104 @@
+"""
+Span-представление чанков: смещения в неизменяемом исходном буфере вместо копий строк.
+"""
+from dataclasses import dataclass, field
+
+from .utils import BoundaryIndex
+
+
+@dataclass(frozen=True)
+class TextSpan:
+    """
+    Фрагмент [start:end) строки `source`.
+
+    `base` — смещение source[0] в исходном документе (в потоковом режиме буфер
+    содержит только окно документа). `index` — индекс границ для `source`,
+    общий для всех фрагментов одного буфера. Строка материализуется только
+    при обращении к `text`.
+    """
+
+    source: str = field(repr=False, compare=False)
+    start: int
+    end: int
+    base: int = 0
+    index: BoundaryIndex | None = field(default=None, repr=False, compare=False)
+
+    @classmethod
+    def of(cls, text: str, base: int = 0, index: BoundaryIndex | None = None) -> "TextSpan":
+        text = text or ""
+        return cls(text, 0, len(text), base, index)
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    @property
+    def text(self) -> str:
+        return self.source[self.start : self.end]
+
+    @property
+    def doc_start(self) -> int:
+        return self.base + self.start
+
+    @property
+    def doc_end(self) -> int:
+        return self.base + self.end
+
+    def is_blank(self) -> bool:
+        return len(self.strip()) == 0
+
+    def _replace(self, start: int, end: int) -> "TextSpan":
+        return TextSpan(self.source, start, end, self.base, self.index)
+
+    def strip(self) -> "TextSpan":
+        """Сужает фрагмент, отбрасывая пробельные символы по краям (без копирования)."""
+        src, start, end = self.source, self.start, self.end
+        while start < end and src[start].isspace():
+            start += 1
+        while end > start and src[end - 1].isspace():
+            end -= 1
+        if start == self.start and end == self.end:
+            return self
+        return self._replace(start, end)
+
+    def slice(self, start: int, end: int | None = None) -> "TextSpan":
+        """Подфрагмент в локальных координатах (как срез строки text[start:end])."""
+        n = len(self)
+        end = n if end is None else end
+        start = max(0, min(n, start))
+        end = max(start, min(n, end))
+        return self._replace(self.start + start, self.start + end)
+
+    def boundary_index(self) -> BoundaryIndex | None:
+        """Вид на индекс границ буфера, соответствующий этому фрагменту."""
+        if self.index is None:
+            return None
+        return self.index.view(self.start, self.end)
+
+    def merge(self, other: "TextSpan") -> "TextSpan":
+        """
+        Объединяет соседние фрагменты вместе с исходными пробелами между ними.
+
+        Фрагменты одного буфера склеиваются без копирования. В потоковом режиме
+        фрагменты могут ссылаться на разные версии буфера — тогда используется
+        буфер, покрывающий весь диапазон, либо склейка материализуется в новую
+        строку (промежуток берётся из того буфера, который его содержит).
+        """
+        if other.doc_start < self.doc_end:
+            raise ValueError("TextSpan.merge: фрагменты перекрываются или идут не по порядку")
+        if other.source is self.source and other.base == self.base:
+            return self._replace(self.start, other.end)
+
+        if other.base <= self.doc_start:
+            return TextSpan(other.source, self.doc_start - other.base, other.end, other.base, other.index)
+        self_limit = self.base + len(self.source)
+        if self_limit >= other.doc_end:
+            return self._replace(self.start, other.doc_end - self.base)
+
+        if other.base <= self.doc_end:
+            gap = other.source[self.doc_end - other.base : other.start]
+        elif self_limit >= other.doc_start:
+            gap = self.source[self.end : other.doc_start - self.base]
+        else:
+            raise ValueError("TextSpan.merge: между фрагментами есть непокрытый промежуток")
+        merged = self.text + gap + other.text
+        return TextSpan(merged, 0, len(merged), self.doc_start)
@@ -0,0 +1,137 @@
+"""
+Размер чанков в токенах вместо символов.
+
+Символьные лимиты дают очень разный размер промпта для русского и английского
+текста. Здесь — подключаемая функция стоимости (`TokenCounter`), быстрая офлайн-
+оценка по умолчанию и `ChunkBudget`, через который сплиттер упаковывает чанки
+и проверяет лимит запроса к LLM.
+"""
+import re
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from .spans import TextSpan
+
+TokenCounter = Callable[[str], int]
+
+_LATIN_RE = re.compile(r"[A-Za-z]+")
+_CYRILLIC_RE = re.compile(r"[Ѐ-ӿ]+")
+_DIGITS_RE = re.compile(r"\d+")
+_OTHER_RE = re.compile(r"[^\sA-Za-zЀ-ӿ\d]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Быстрая офлайн-оценка числа токенов (BPE-токенизаторы семейств GPT/Claude/Qwen).
+
+    Латинские слова — ~4 символа на токен, кириллица и числа — ~3, прочие
+    непробельные символы (пунктуация, эмодзи, CJK) — по токену на символ.
+    Округление вверх на каждое слово делает оценку слегка завышенной.
+    """
+    if not text:
+        return 0
+    return (
+        sum((len(w) + 3) // 4 for w in _LATIN_RE.findall(text))
+        + sum((len(w) + 2) // 3 for w in _CYRILLIC_RE.findall(text))
+        + sum((len(w) + 2) // 3 for w in _DIGITS_RE.findall(text))
+        + len(_OTHER_RE.findall(text))
+    )
+
+
+def litellm_token_counter(model: str) -> TokenCounter:
+    """Точный счётчик токенов для модели через litellm (ставится вместе с dspy)."""
+    import litellm
+
+    def count(text: str) -> int:
+        return int(litellm.token_counter(model=model, text=text))
+
+    return count
+
+
+@dataclass(frozen=True)
+class ChunkBudget:
+    """
+    Лимиты размера чанков в единицах `counter` (символы, если counter не задан).
+
+    Args:
+        max_size: Целевой максимальный размер чанка (упаковка и повторное деление)
+        min_size: Чанки меньше этого размера не отправляются в halver
+        counter: Функция стоимости текста; None — длина в символах
+        max_request: Жёсткий лимит на текст одного запроса к LLM (без инструкций
+            промпта); чанки больше лимита делятся локально, без вызова LLM
+    """
+
+    max_size: int
+    min_size: int = 0
+    counter: TokenCounter | None = None
+    max_request: int | None = None
+
+    # Сколько символов в среднем приходится на единицу стоимости с запасом —
+    # используется только для размера окна потокового буфера
+    _CHARS_PER_TOKEN = 8
+
+    @classmethod
+    def chars(cls, max_chunk_size: int, min_chunk_len: int = 0) -> "ChunkBudget":
+        return cls(max_size=max_chunk_size, min_size=min_chunk_len)
+
+    @classmethod
+    def tokens(
+        cls,
+        max_chunk_tokens: int,
+        min_chunk_tokens: int = 0,
+        counter: TokenCounter | None = None,
+        max_request_tokens: int | None = None,
+    ) -> "ChunkBudget":
+        """
+        Бюджет в токенах. По умолчанию лимит запроса — 2 * max_chunk_tokens:
+        склейка second(i)+first(i+1) не превышает двух чанков.
+        """
+        return cls(
+            max_size=max_chunk_tokens,
+            min_size=min_chunk_tokens,
+            counter=counter or estimate_tokens,
+            max_request=max_request_tokens or 2 * max_chunk_tokens,
+        )
+
+    @property
+    def in_tokens(self) -> bool:
+        return self.counter is not None
+
+    @property
+    def window_chars(self) -> int:
+        """Размер окна потокового буфера в символах (~2 чанка)."""
+        return 2 * self.max_size * (self._CHARS_PER_TOKEN if self.in_tokens else 1)
+
+    def size(self, span: TextSpan) -> int:
+        return self.counter(span.text) if self.counter is not None else len(span)
+
+    def exceeds_request(self, span: TextSpan) -> bool:
+        return self.max_request is not None and self.size(span) > self.max_request
+
+    def cut_prefix(self, span: TextSpan, limit: int) -> int:
+        """
+        Локальный индекс разреза: самый длинный префикс span размером <= limit,
+        отступивший к последнему пробелу/переводу строки (если он есть).
+        """
+        n = len(span)
+        if limit <= 0 or n == 0:
+            return 0
+        if self.counter is None:
+            cut = min(n, limit)
+        else:
+            # бинарный поиск по длине префикса: стоимость монотонна по длине
+            lo, hi = 0, n
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if self.counter(span.source[span.start : span.start + mid]) <= limit:
+                    lo = mid
+                else:
+                    hi = mid - 1
+            cut = max(1, lo)
+        if cut >= n:
+            return n
+        space = max(
+            span.source.rfind(" ", span.start, span.start + cut),
+            span.source.rfind("\n", span.start, span.start + cut),
+        )
+        return space - span.start if space > span.start else cut
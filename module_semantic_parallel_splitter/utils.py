@@ -1,35 +1,244 @@
 """
 Вспомогательные утилиты для модуля семантического разделения.
 """
+import bisect
 import re
-import difflib
 import logging
+from array import array
+
+from .alignment import AnchorAligner
 
 logger = logging.getLogger(__name__)
 
+
+class BoundaryMarker:
+    """Нумерация возможных границ разреза для режима `boundary` в SemanticHalver."""
+
+    _SENTENCE_END_RE = re.compile(r"[.!?…]+[\"'»”)\]]*(?=\s)")
+    _LINE_END_RE = re.compile(r"\S(?=[ \t]*\n)")
+
+    @staticmethod
+    def find_boundaries(text: str, max_markers: int = 80) -> list[int]:
+        """
+        Возвращает отсортированные позиции границ (индекс конца первой части).
+
+        Границы — концы предложений и непустых строк, кроме самого конца текста.
+        Если кандидатов больше max_markers, берётся равномерная выборка.
+        """
+        n = len(text)
+        positions = {m.end() for m in BoundaryMarker._SENTENCE_END_RE.finditer(text)}
+        positions.update(m.end() for m in BoundaryMarker._LINE_END_RE.finditer(text))
+        boundaries = sorted(p for p in positions if 0 < p < n and text[p:].strip())
+        if max_markers > 0 and len(boundaries) > max_markers:
+            step = len(boundaries) / max_markers
+            boundaries = [boundaries[int(i * step)] for i in range(max_markers)]
+        return boundaries
+
+    @staticmethod
+    def number_boundaries(text: str, max_markers: int = 80) -> tuple[str, list[int]]:
+        """
+        Вставляет метки [[N]] после каждой границы.
+
+        Returns:
+            (размеченный текст, позиции границ в исходном тексте; метка N -> boundaries[N-1])
+        """
+        boundaries = BoundaryMarker.find_boundaries(text, max_markers=max_markers)
+        parts: list[str] = []
+        prev = 0
+        for i, pos in enumerate(boundaries, start=1):
+            parts.append(text[prev:pos])
+            parts.append(f" [[{i}]]")
+            prev = pos
+        parts.append(text[prev:])
+        return "".join(parts), boundaries
+
+    @staticmethod
+    def parse_boundary_id(value: object) -> int | None:
+        """Достаёт номер метки из ответа LLM ("12", "[[12]]", "Метка 12")."""
+        if value is None:
+            return None
+        if isinstance(value, int):
+            return value
+        m = re.search(r"\d+", str(value))
+        return int(m.group()) if m else None
+
+
+class NormalizedText:
+    """
+    Нормализованная форма текста с отображением позиций обратно в исходник.
+
+    Нормализация:
+    - приводит разные тире к обычному дефису
+    - унифицирует кавычки
+    - схлопывает пробелы/переводы строк в один пробел и обрезает края
+
+    Замены символов 1:1, поэтому смещение между нормализованной и исходной позицией
+    меняется только на пробельных пробегах длиной >= 2. Они запоминаются за один
+    линейный проход, а позиции отображаются через `bisect` за O(log n).
+    """
+
+    __slots__ = ("source", "text", "_lead", "_breaks", "_deltas", "_compact", "_space_adj")
+
+    _CHAR_MAP = {
+        "—": "-",
+        "–": "-",
+        "−": "-",
+        "“": '"',
+        "”": '"',
+        "„": '"',
+        "’": "'",
+        "‘": "'",
+    }
+    _MULTI_SPACE_RE = re.compile(r"\s{2,}")
+    _SPACE_RE = re.compile(r"\s+")
+
+    def __init__(self, source: str):
+        self.source = source or ""
+        translated = self.source
+        for src_char, dst_char in self._CHAR_MAP.items():
+            translated = translated.replace(src_char, dst_char)
+
+        body = translated.lstrip()
+        self._lead = len(translated) - len(body)
+        body = body.rstrip()
+
+        # _breaks[k] — первая нормализованная позиция после k-го длинного пробега,
+        # _deltas[k] — сколько символов выкинуто до неё
+        breaks: list[int] = []
+        deltas: list[int] = []
+        removed = 0
+        for m in self._MULTI_SPACE_RE.finditer(body):
+            start, end = m.span()
+            breaks.append(start - removed + 1)
+            removed += end - start - 1
+            deltas.append(removed)
+        self._breaks = breaks
+        self._deltas = deltas
+        self.text = self._SPACE_RE.sub(" ", body)
+        self._compact: str | None = None
+        self._space_adj: list[int] | None = None
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    def to_source(self, norm_index: int) -> int:
+        """Индекс в исходном тексте символа, из которого получен norm_index-й символ."""
+        k = bisect.bisect_right(self._breaks, norm_index) - 1
+        return norm_index + self._lead + (self._deltas[k] if k >= 0 else 0)
+
+    def to_source_start(self, norm_index: int) -> int:
+        """Позиция начала в исходном тексте для индекса нормализованного текста."""
+        if norm_index >= len(self.text):
+            return len(self.source)
+        return self.to_source(max(0, norm_index))
+
+    def to_source_end(self, norm_end: int) -> int:
+        """Исключающая граница в исходном тексте для конца совпадения `norm_end`."""
+        if norm_end <= 0:
+            return 0
+        return self.to_source(min(norm_end, len(self.text)) - 1) + 1
+
+    @property
+    def compact(self) -> str:
+        """Нормализованный текст без пробелов."""
+        if self._compact is None:
+            self._compact = self.text.replace(" ", "")
+        return self._compact
+
+    def compact_to_source_end(self, compact_end: int) -> int:
+        """Исключающая граница в исходном тексте для конца совпадения в `compact`."""
+        if compact_end <= 0:
+            return 0
+        if self._space_adj is None:
+            # для k-го пробела: сколько непробельных символов стоит перед ним
+            self._space_adj = [m.start() - k for k, m in enumerate(re.finditer(" ", self.text))]
+        c = compact_end - 1
+        norm_index = c + bisect.bisect_right(self._space_adj, c)
+        return self.to_source(norm_index) + 1
+
+
+class BoundaryIndex:
+    """
+    Предвычисленные границы документа для fallback-стратегий TextMatcher.
+
+    Для документа один раз строятся отсортированные массивы позиций:
+    - "paragraph": концы `\\n{2,}`
+    - "line": концы каждого `\\n`
+    - "sentence": концы `[.!?…](?:\\s+|$)`
+    - "space": позиции пробелов/табов
+
+    Чанк документа представляется видом (`view`) на те же массивы со смещением,
+    поэтому поиск ближайшей границы — это `bisect`, O(log n), без повторных regex.
+    """
+
+    __slots__ = ("text", "start", "end", "_arrays")
+
+    _PATTERNS = {
+        "paragraph": (re.compile(r"\n{2,}"), True),
+        "line": (re.compile(r"\n"), True),
+        "sentence": (re.compile(r"[.!?…](?:\s+|$)"), True),
+        "space": (re.compile(r"[ \t]"), False),
+    }
+
+    def __init__(self, text: str, arrays: dict[str, array] | None = None, start: int = 0, end: int | None = None):
+        self.text = text
+        self.start = start
+        self.end = len(text) if end is None else end
+        if arrays is None:
+            arrays = {}
+            for kind, (pattern, use_end) in self._PATTERNS.items():
+                arrays[kind] = array("q", (m.end() if use_end else m.start() for m in pattern.finditer(text)))
+        self._arrays = arrays
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def view(self, start: int, end: int) -> "BoundaryIndex":
+        """Вид на подстроку [start:end) (в координатах текущего вида) без копирования массивов."""
+        start = max(0, min(len(self), start))
+        end = max(start, min(len(self), end))
+        return BoundaryIndex(self.text, self._arrays, self.start + start, self.start + end)
+
+    def nearest(self, kind: str, target: int, lo: int, hi: int) -> int | None:
+        """
+        Ближайшая к target граница вида kind в отрезке [lo, hi] (локальные координаты).
+
+        При равенстве расстояний выбирается левая граница.
+        """
+        positions = self._arrays[kind]
+        g_lo, g_hi = self.start + max(0, lo), self.start + min(len(self), hi)
+        g_target = self.start + target
+        i = bisect.bisect_left(positions, g_target)
+        best = None
+        for j in (i - 1, i):
+            if 0 <= j < len(positions) and g_lo <= positions[j] <= g_hi:
+                if best is None or abs(positions[j] - g_target) < abs(best - g_target):
+                    best = positions[j]
+        if best is None:
+            # ближайшие соседи вне отрезка — берём крайние точки внутри него
+            lo_i = bisect.bisect_left(positions, g_lo)
+            hi_i = bisect.bisect_right(positions, g_hi) - 1
+            inside = [positions[j] for j in (lo_i, hi_i) if 0 <= j < len(positions) and g_lo <= positions[j] <= g_hi]
+            if not inside:
+                return None
+            best = min(inside, key=lambda p: abs(p - g_target))
+        return best - self.start
+
+
 class TextMatcher:
     """Логика поиска и сопоставления подстрок в тексте."""
 
+    aligner = AnchorAligner()
+
     @staticmethod
     def _normalize(text: str) -> str:
-        """
-        Нормализует текст для сопоставления:
-        - приводит разные тире к обычному дефису
-        - схлопывает пробелы/переводы строк
-        - убирает лишние пробелы вокруг пунктуации не трогая саму пунктуацию
-        """
+        """Нормализует текст для сопоставления (см. NormalizedText)."""
         if not text:
             return ""
-        # унификация тире/минусов
-        text = text.replace("—", "-").replace("–", "-").replace("−", "-")
-        # унификация кавычек (минимально)
-        text = text.replace("“", '"').replace("”", '"').replace("„", '"').replace("’", "'").replace("‘", "'")
-        # схлопываем whitespace
-        text = re.sub(r"\s+", " ", text, flags=re.UNICODE).strip()
-        return text
+        return NormalizedText(text).text
 
     @staticmethod
-    def _fallback_structural(full_text: str, preferred: int | None = None) -> int:
+    def _fallback_structural(full_text: str, preferred: int | None = None, index: BoundaryIndex | None = None) -> int:
         """
         Fallback #1: структурный разрез по двойному переводу строки / одинарному переводу строки
         около preferred (если задан) иначе около середины.
@@ -39,27 +248,22 @@ class TextMatcher:
             return 0
         target = preferred if preferred is not None else n // 2
         target = max(1, min(n - 1, target))
+        if index is None:
+            index = BoundaryIndex(full_text)
 
-        # кандидаты: границы абзацев/строк
-        candidates: list[int] = []
-        for m in re.finditer(r"\n{2,}", full_text):
-            candidates.append(m.end())
-        for m in re.finditer(r"\n", full_text):
-            candidates.append(m.end())
-
-        # фильтруем слишком ранние/поздние точки
+        # кандидаты: границы абзацев/строк (конец абзаца всегда и конец строки),
+        # слишком ранние/поздние точки отсекаются диапазоном
         min_i = max(1, int(n * 0.15))
         max_i = min(n - 1, int(n * 0.85))
-        candidates = [c for c in candidates if min_i <= c <= max_i]
-        if not candidates:
+        best = index.nearest("line", target, min_i, max_i)
+        if best is None:
             return 0
 
-        best = min(candidates, key=lambda c: abs(c - target))
         logger.info(f"[FALLBACK_STRUCTURAL] split_index={best}")
         return best
 
     @staticmethod
-    def _fallback_sentence(full_text: str, preferred: int | None = None) -> int:
+    def _fallback_sentence(full_text: str, preferred: int | None = None, index: BoundaryIndex | None = None) -> int:
         """
         Fallback #2: разрез по концу предложения (., !, ?, …) около preferred/середины.
         """
@@ -68,24 +272,21 @@ class TextMatcher:
             return 0
         target = preferred if preferred is not None else n // 2
         target = max(1, min(n - 1, target))
+        if index is None:
+            index = BoundaryIndex(full_text)
 
-        # находим окончания предложений, учитывая пробел/перевод строки после
-        candidates: list[int] = []
-        for m in re.finditer(r"[.!?…](?:\s+|$)", full_text):
-            candidates.append(m.end())
-
+        # окончания предложений, учитывая пробел/перевод строки после
         min_i = max(1, int(n * 0.15))
         max_i = min(n - 1, int(n * 0.85))
-        candidates = [c for c in candidates if min_i <= c <= max_i]
-        if not candidates:
+        best = index.nearest("sentence", target, min_i, max_i)
+        if best is None:
             return 0
 
-        best = min(candidates, key=lambda c: abs(c - target))
         logger.info(f"[FALLBACK_SENTENCE] split_index={best}")
         return best
 
     @staticmethod
-    def _fallback_hard(full_text: str, preferred: int | None = None) -> int:
+    def _fallback_hard(full_text: str, preferred: int | None = None, index: BoundaryIndex | None = None) -> int:
         """
         Fallback #3: жёсткий разрез по ближайшему пробелу около preferred/середины.
         """
@@ -94,31 +295,29 @@ class TextMatcher:
             return 0
         target = preferred if preferred is not None else n // 2
         target = max(1, min(n - 1, target))
+        if index is None:
+            index = BoundaryIndex(full_text)
 
-        # ищем ближайший пробел в окне
+        # ищем ближайший пробел/таб в окне
         window = max(20, int(n * 0.05))
         lo = max(1, target - window)
         hi = min(n - 1, target + window)
-        segment = full_text[lo:hi]
-        # ближайший пробел/таб
-        space_positions = [m.start() for m in re.finditer(r"[ \t]", segment)]
-        if not space_positions:
-            split_index = target
-        else:
-            best_local = min(space_positions, key=lambda p: abs((lo + p) - target))
-            split_index = lo + best_local
+        best = index.nearest("space", target, lo, hi - 1)
+        split_index = target if best is None else best
         split_index = max(1, min(n - 1, split_index))
         logger.info(f"[FALLBACK_HARD] split_index={split_index}")
         return split_index
 
     @staticmethod
-    def find_split_index(full_text: str, candidate_block: str) -> int:
+    def find_split_index(full_text: str, candidate_block: str, index: BoundaryIndex | None = None) -> int:
         """
         Находит индекс разделения текста на основе предложенного блока.
         
         Args:
             full_text: Исходный текст
             candidate_block: Текст первого блока, предложенный LLM
+            index: Индекс границ full_text (например, вид на индекс документа);
+                по умолчанию строится по full_text
             
         Returns:
             int: Индекс конца первого блока в исходном тексте (0 если не найдено)
@@ -134,7 +333,7 @@ class TextMatcher:
         if len(full_text) < 200:
             preferred = min(len(full_text) - 1, max(1, len(candidate_block)))
             for fb in (TextMatcher._fallback_structural, TextMatcher._fallback_sentence, TextMatcher._fallback_hard):
-                idx = fb(full_text, preferred=preferred)
+                idx = fb(full_text, preferred=preferred, index=index)
                 if 0 < idx < len(full_text):
                     return idx
         
@@ -148,40 +347,36 @@ class TextMatcher:
             return idx + len(candidate_block)
 
         # 3. Нормализуем и повторяем точный/подстрочный матч на нормализованном тексте.
-        # Это часто лечит расхождения по пробелам/тире/кавычкам.
-        full_norm = TextMatcher._normalize(full_text)
-        cand_norm = TextMatcher._normalize(candidate_block)
-        if full_norm and cand_norm:
-            if full_norm.startswith(cand_norm):
-                # приблизительно возвращаем длину оригинального блока; точная проекция сложна,
-                # но для нашей задачи достаточно корректной точки внутри full_text.
-                approx = min(len(full_text) - 1, len(candidate_block))
-                logger.info(f"[MATCH_NORM_PREFIX] approx_split_index={approx}")
-                return approx
-            idx_norm = full_norm.find(cand_norm)
+        # Это часто лечит расхождения по пробелам/тире/кавычкам. Нормализованные формы
+        # строятся один раз и переиспользуются следующими стратегиями; карта смещений
+        # даёт точный индекс в исходном тексте.
+        full_norm = NormalizedText(full_text)
+        cand_norm = NormalizedText(candidate_block)
+        if full_norm.text and cand_norm.text:
+            if full_norm.text.startswith(cand_norm.text):
+                split_index = full_norm.to_source_end(len(cand_norm))
+                logger.info(f"[MATCH_NORM_PREFIX] split_index={split_index}")
+                return split_index
+            idx_norm = full_norm.text.find(cand_norm.text)
             if idx_norm != -1:
-                # приближённая проекция: берем долю позиции в нормализованном тексте и переносим на исходный
-                frac = (idx_norm + len(cand_norm)) / max(len(full_norm), 1)
-                approx = int(frac * len(full_text))
-                approx = max(1, min(len(full_text) - 1, approx))
-                logger.info(f"[MATCH_NORM_SUBSTR] approx_split_index={approx}")
-                return approx
-
-        # 4. Символьный fuzzy-поиск (SequenceMatcher) по ПРЕФИКСУ candidate_block.
+                split_index = full_norm.to_source_end(idx_norm + len(cand_norm))
+                logger.info(f"[MATCH_NORM_SUBSTR] split_index={split_index}")
+                return split_index
+
+        # 4. Якорный fuzzy-поиск candidate_block от начала текста (k-граммы, линейно по длине).
         # Ключевой фикс для проблемных чанков: LLM часто «продолжает» дальше чанка,
-        # из-за чего full_text содержит только начало candidate_block.
-        prefix_len = min(800, len(candidate_block))
-        cand_prefix = candidate_block[:prefix_len]
+        # из-за чего full_text содержит только начало candidate_block. Выравнивание
+        # линейное, поэтому кандидат больше не обрезается до 800 символов.
+        cand_prefix = cand_norm.text
         min_cover_full = 0.80      # насколько большая часть full_text покрыта совпадением
         min_match_len = 180
-        matcher = difflib.SequenceMatcher(None, full_text, cand_prefix)
-        match = matcher.find_longest_match(0, len(full_text), 0, len(cand_prefix))
-        if match.size >= min_match_len:
-            cover_full = match.size / max(len(full_text), 1)
-            cover_cand = match.size / max(len(cand_prefix), 1)
+        alignment = TextMatcher.aligner.align_prefix(full_norm.text, cand_prefix)
+        if alignment is not None and alignment.matched >= min_match_len:
+            cover_full = alignment.matched / max(len(full_norm), 1)
+            cover_cand = alignment.matched / max(len(cand_prefix), 1)
             # если совпадение почти с начала чанка — считаем это корректным якорем
-            if match.a <= 20 and (cover_cand >= 0.70 or cover_full >= min_cover_full):
-                split_index = match.a + match.size
+            if cover_cand >= 0.70 or cover_full >= min_cover_full:
+                split_index = full_norm.to_source_end(alignment.a_end)
                 split_index = max(1, min(len(full_text) - 1, split_index))
                 logger.info(f"[MATCH_FUZZY_PREFIX] split_index={split_index} (cover_full={cover_full:.2f}, cover_cand={cover_cand:.2f})")
                 return split_index
@@ -189,45 +384,42 @@ class TextMatcher:
         # 5. Поиск по "хвосту" блока (последние 10 слов)
         # Это помогает, если LLM ошиблась в середине длинного текста, 
         # но верно определила точку разделения в конце.
-        words = candidate_block.split()
-        if len(words) >= 10:
-            tail_words = words[-10:]
-            tail_pattern = r"\s+".join([re.escape(w) for w in tail_words])
-            try:
-                # Ищем хвост в тексте. Если он встречается один раз - это наша точка.
-                matches = list(re.finditer(tail_pattern, full_text))
-                if len(matches) == 1:
-                    logger.info(f"[MATCH_TAIL] Точка разделения найдена по хвосту блока: {matches[0].end()}")
-                    return matches[0].end()
-                elif len(matches) > 1:
-                    # Если несколько совпадений, берем то, что ближе всего к длине candidate_block
-                    best_match = min(matches, key=lambda m: abs(m.end() - len(candidate_block)))
-                    logger.info(f"[MATCH_TAIL_NEAR] Найдено несколько совпадений хвоста, выбрано ближайшее: {best_match.end()}")
-                    return best_match.end()
-            except re.error:
-                pass
-
-        # 6. "Fuzzy" поиск по всему блоку (игнорируя различия в пробелах)
-        # Разбиваем блок на слова, экранируя спецсимволы
-        words_escaped = [re.escape(w) for w in words]
-        if not words_escaped:
+        cand_words = cand_norm.text.split(" ")
+        if len(cand_words) >= 10:
+            tail = " ".join(cand_words[-10:])
+            # Ищем хвост в нормализованном тексте; совпадения отображаем в исходные позиции.
+            ends: list[int] = []
+            pos = full_norm.text.find(tail)
+            while pos != -1:
+                ends.append(full_norm.to_source_end(pos + len(tail)))
+                pos = full_norm.text.find(tail, pos + 1)
+            if len(ends) == 1:
+                logger.info(f"[MATCH_TAIL] Точка разделения найдена по хвосту блока: {ends[0]}")
+                return ends[0]
+            elif len(ends) > 1:
+                # Если несколько совпадений, берем то, что ближе всего к длине candidate_block
+                best_end = min(ends, key=lambda e: abs(e - len(candidate_block)))
+                logger.info(f"[MATCH_TAIL_NEAR] Найдено несколько совпадений хвоста, выбрано ближайшее: {best_end}")
+                return best_end
+
+        # 6. "Fuzzy" поиск по всему блоку (игнорируя различия в пробелах):
+        # ищем блок без пробелов в тексте без пробелов и отображаем конец обратно.
+        cand_compact = cand_norm.compact
+        if not cand_compact:
             return 0
-            
-        pattern_str = r'\s*'.join(words_escaped)
-        try:
-            match = re.search(pattern_str, full_text)
-            if match:
-                logger.info(f"[MATCH_FUZZY] Блок найден через fuzzy-поиск, split_index={match.end()}")
-                return match.end()
-        except re.error as e:
-            logger.error(f"[REGEX_ERROR] Ошибка в регулярном выражении при fuzzy поиске: {e}")
+
+        idx_compact = full_norm.compact.find(cand_compact)
+        if idx_compact != -1:
+            split_index = full_norm.compact_to_source_end(idx_compact + len(cand_compact))
+            logger.info(f"[MATCH_FUZZY] Блок найден через fuzzy-поиск, split_index={split_index}")
+            return split_index
 
         # 7. Если сопоставление не удалось — fallback стратегии.
         # preferred: ожидаем, что first_block заканчивается примерно около len(candidate_block),
         # но ограничиваемся длиной full_text.
         preferred = min(len(full_text) - 1, max(1, len(candidate_block)))
         for fb in (TextMatcher._fallback_structural, TextMatcher._fallback_sentence, TextMatcher._fallback_hard):
-            idx = fb(full_text, preferred=preferred)
+            idx = fb(full_text, preferred=preferred, index=index)
             if 0 < idx < len(full_text):
                 return idx
 
@@ -39,11 +39,13 @@ def configure_module_llm(
     if use_global_config:
         try:
             from config.llm import configure_llm
+            from config.registry import get_registry
             configure_llm()
             
             # Если нужны специфичные настройки, переопределяем
             if model or api_base or api_key:
-                lm = dspy.LM(
+                lm = get_registry().register(
+                    "module_template",
                     model=model or os.getenv("OPENROUTER_MODEL", ""),
                     api_base=api_base or os.getenv("OPENROUTER_API_BASE", "https://openrouter.ai/api/v1"),
                     api_key=api_key or os.getenv("OPENROUTER_API_KEY", ""),
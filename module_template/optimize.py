@@ -7,14 +7,16 @@
 import os
 import dspy
 import dotenv
-from typing import Callable, Optional, Any
+from typing import Callable, Optional, Any, Union
+
+from config.concurrency import resolve_num_threads
 
 
 def configure_optimizer(
     optimizer_type: str = "mipro",
     metric: Optional[Callable] = None,
     auto: str = "medium",
-    num_threads: int = 24,
+    num_threads: Union[int, str] = 24,
     track_stats: bool = False,
     **kwargs
 ) -> Any:
@@ -26,6 +28,7 @@ def configure_optimizer(
         metric: Функция метрики для оценки качества
         auto: Уровень оптимизации ('light', 'medium', 'heavy')
         num_threads: Количество потоков для параллельной обработки
+            ("auto" — по адаптивному лимиту параллелизма LM, см. config.concurrency)
         track_stats: Отслеживать статистику (для GEPA)
         **kwargs: Дополнительные параметры для оптимизатора
 
@@ -33,6 +36,7 @@ def configure_optimizer(
         Сконфигурированный оптимизатор
     """
     dotenv.load_dotenv()
+    num_threads = resolve_num_threads(num_threads)
 
     if optimizer_type == "mipro":
         from dspy.teleprompt import MIPROv2